@@ -1 +1,3 @@
-from src.app import *
+from src.app import main
+
+main()
@@ -0,0 +1,87 @@
+"""
+Redis memory per user for the FSM storage layouts:
+RedisStorage2 keys (state + JSON data) vs CompactRedisStorage.
+Every user gets the state and data of a user browsing posts.
+
+Needs Redis from REDIS_HOST / REDIS_PORT, keys are written
+under the "bench_fsm" prefix and removed afterwards.
+
+Usage: python -m benchmarks.bench_fsm_memory [users]
+"""
+import asyncio
+import sys
+
+from src.config import Config
+from src.tg.fsm_storage import (
+    BatchedRedisStorage,
+    CompactRedisStorage,
+    RedisBackend,
+)
+from src.tg.user_states import UserStates
+from src.utils import default_user_data
+
+PREFIX = "bench_fsm"
+FIRST_USER_ID = 100000000
+BATCH = 1000
+
+
+def user_data(n):
+    data = dict(default_user_data)
+    data.update(
+        msg_with_kb_id=n % 100000,
+        category_cache="need_home",
+        location_cache=str(n % 20),
+        last_user_upload=1600000000 + n,
+    )
+    return data
+
+
+async def used_memory(redis):
+    info = await redis.info("memory")
+    return int(info["memory"]["used_memory"])
+
+
+async def measure(storage, redis, users):
+    before = await used_memory(redis)
+    for start in range(0, users, BATCH):
+        storage.begin()
+        for n in range(start, min(start + BATCH, users)):
+            user = FIRST_USER_ID + n
+            await storage.set_state(user=user, state=UserStates.post_view)
+            await storage.set_data(user=user, data=user_data(n))
+        await storage.commit()
+    after = await used_memory(redis)
+
+    keys = await redis.keys(f"{PREFIX}:*")
+    for start in range(0, len(keys), BATCH):
+        await redis.delete(*keys[start : start + BATCH])
+    return (after - before) / users
+
+
+async def main(users=10000):
+    config = Config()
+    config.with_env()
+    backend = RedisBackend(config.redis_host, config.redis_port, config.redis_db)
+    redis = await backend.redis()
+
+    storages = {
+        "RedisStorage2 layout": BatchedRedisStorage(prefix=PREFIX, backend=backend),
+        "compact": CompactRedisStorage(
+            prefix=PREFIX, backend=backend, fields=default_user_data
+        ),
+        "compact + ttl": CompactRedisStorage(
+            prefix=PREFIX, backend=backend, fields=default_user_data, ttl=86400
+        ),
+    }
+
+    print(f"users: {users}")
+    for name, storage in storages.items():
+        per_user = await measure(storage, redis, users)
+        print(f"{name + ':':22} {per_user:.0f} bytes per user")
+
+    await backend.close()
+    await backend.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main(*map(int, sys.argv[1:])))
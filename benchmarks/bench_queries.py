@@ -0,0 +1,235 @@
+"""
+Latency of the query layer as the catalog grows.
+
+For every dataset size the catalog is seeded (benchmarks/dataset.py)
+and analyzed, then measured: select_posts_with_filters for every
+category and direction (filters and post ids vary between rounds),
+search_posts for a common word, two words, a title and a later page,
+select_random_funny_photo, insert_telegram_user and
+ZveroBot._fetch_static_data_from_db.
+
+Post texts are Russian, so the database has to be UTF8.
+
+Needs Postgres from the environment and a dedicated database for the
+bench catalog, given with --database: up to 100k posts are written
+and removed there, the bot's own DB_NAME is refused. The bot talks to
+tests/fake_bot_api.py. Bench rows and users are removed afterwards.
+
+Results are saved as JSON, --compare prints the median change
+against a previous run.
+
+Usage:
+    python -m benchmarks.bench_queries --database zverobot_bench
+        [--posts 1000 10000 100000] [--rounds 50]
+        [--json results.json] [--compare previous.json]
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import platform
+import random
+import statistics
+import time
+
+from sqlalchemy import delete, select
+
+from benchmarks import dataset
+from src.config import Config
+from src.db.models import Post, TelegramUser
+from src.db.queries import (
+    CATEGORIES,
+    insert_telegram_user,
+    select_posts_with_filters,
+    search_posts,
+    select_random_funny_photo,
+)
+from src.tg.zverobot import ZveroBot
+from tests.fake_bot_api import FakeBotApi
+
+FIRST_USER_ID = 1800000000
+WARMUP = 3
+
+
+def _stats(times):
+    return dict(
+        min=min(times),
+        max=max(times),
+        mean=statistics.mean(times),
+        median=statistics.median(times),
+        stddev=statistics.stdev(times) if len(times) > 1 else 0.0,
+        rounds=len(times),
+        ops=len(times) / sum(times),
+    )
+
+
+async def measure(func, rounds):
+    for _ in range(WARMUP):
+        await func()
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await func()
+        times.append(time.perf_counter() - started)
+    return _stats(times)
+
+
+async def bench_dataset(bot, posts, rounds):
+    """Benchmarks for one catalog size as [(name, stats)]"""
+    rnd = random.Random(posts)
+    engine = bot.db
+
+    async with engine.acquire() as conn:
+        await dataset.clear(conn)
+        location_ids, pet_type_ids = await dataset.seed(
+            conn, posts=posts, locations=50, pet_types=10
+        )
+        await dataset.seed_funny_photos(conn)
+        await conn.execute("ANALYZE posts")
+        cursor = await conn.execute(
+            select([Post.id]).where(Post.title.like("BenchPet%"))
+        )
+        post_ids = [row.id for row in await cursor.fetchall()]
+
+    results = []
+    async with engine.acquire() as conn:
+        for category, direction in itertools.product(
+            (None, *CATEGORIES), (None, "<", ">")
+        ):
+
+            async def _select_posts():
+                cursor = await select_posts_with_filters(
+                    conn,
+                    category=category,
+                    pet_type=rnd.choice((None, *pet_type_ids)),
+                    location=rnd.choice((None, *location_ids)),
+                    post_id=rnd.choice(post_ids) if direction else None,
+                    direction=direction,
+                )
+                await cursor.fetchall()
+
+            name = f"select_posts_with_filters[{category}-{direction}]"
+            results.append((name, await measure(_select_posts, rounds)))
+
+        for name, text, offset in (
+            ("word", dataset.WORDS[0], 0),
+            ("two_words", f"{dataset.WORDS[1]} {dataset.WORDS[5]}", 0),
+            ("title", f"BenchPet{posts // 2}", 0),
+            ("page_3", dataset.WORDS[0], 10),
+        ):
+
+            async def _search():
+                await search_posts(conn, text, offset=offset)
+
+            results.append((f"search_posts[{name}]", await measure(_search, rounds)))
+
+        async def _select_photo():
+            await select_random_funny_photo(conn)
+
+        results.append(
+            ("select_random_funny_photo", await measure(_select_photo, rounds))
+        )
+
+        user_ids = itertools.count(FIRST_USER_ID)
+
+        async def _insert_user():
+            await insert_telegram_user(
+                conn, id=next(user_ids), first_name="BenchUser", version="bench"
+            )
+
+        results.append(("insert_telegram_user", await measure(_insert_user, rounds)))
+        await conn.execute(
+            delete(TelegramUser).where(
+                TelegramUser.id.between(FIRST_USER_ID, next(user_ids))
+            )
+        )
+
+    results.append(
+        (
+            "_fetch_static_data_from_db",
+            await measure(bot._fetch_static_data_from_db, rounds),
+        )
+    )
+
+    async with engine.acquire() as conn:
+        await dataset.clear(conn)
+    return results
+
+
+def compare(benchmarks, previous_path):
+    with open(previous_path) as f:
+        previous = {
+            (b["group"], b["name"]): b["stats"]["median"]
+            for b in json.load(f)["benchmarks"]
+        }
+    for b in benchmarks:
+        before = previous.get((b["group"], b["name"]))
+        if before:
+            change = (b["stats"]["median"] / before - 1) * 100
+            print(f"{b['group']:>14} {b['name']:<48} {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query layer benchmarks")
+    parser.add_argument(
+        "--database", required=True, help="dedicated database, not DB_NAME"
+    )
+    parser.add_argument("--posts", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--json", default="bench_queries.json")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+
+    config = Config()
+    config.with_env()
+    if args.database == config.db_name:
+        parser.error(f"{args.database} is the bot database, create one for benchmarks")
+    config.db_name = args.database
+
+    loop = asyncio.get_event_loop()
+    api = FakeBotApi()
+    config.bot_api_url = loop.run_until_complete(api.start())
+    config.notifications_enabled = False
+    bot = ZveroBot(config)
+    loop.run_until_complete(bot.startup())
+
+    benchmarks = []
+    try:
+        for posts in args.posts:
+            group = f"{posts} posts"
+            for name, stats in loop.run_until_complete(
+                bench_dataset(bot, posts, args.rounds)
+            ):
+                benchmarks.append(
+                    dict(group=group, name=name, params=dict(posts=posts), stats=stats)
+                )
+                print(
+                    f"{group:>14} {name:<48} median {stats['median'] * 1000:8.2f} ms"
+                    f"  max {stats['max'] * 1000:8.2f} ms"
+                )
+    finally:
+        loop.run_until_complete(bot.shutdown())
+        bot.db.close()
+        loop.run_until_complete(bot.db.wait_closed())
+        loop.run_until_complete(bot.close())
+        loop.run_until_complete(api.close())
+
+    with open(args.json, "w") as f:
+        json.dump(
+            dict(
+                datetime=datetime.datetime.utcnow().isoformat(),
+                machine_info=dict(
+                    python=platform.python_version(), machine=platform.platform()
+                ),
+                benchmarks=benchmarks,
+            ),
+            f,
+            indent=2,
+        )
+    if args.compare:
+        compare(benchmarks, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+CPU cost of preparing select_posts_with_filters statements,
+building and compiling the query on every call vs the compiled cache.
+No database needed, only statement preparation is measured.
+
+Usage: python -m benchmarks.bench_query_cache [iterations]
+"""
+import itertools
+import sys
+import time
+
+from src.db.queries import (
+    CATEGORIES,
+    _dialect,
+    _bind_posts_query,
+    _posts_with_filters_query,
+)
+
+
+def build_and_compile(category, pet_type, location, post_id, direction):
+    # What every call did before the cache, aiopg compiles the query itself
+    compiled = _posts_with_filters_query(
+        category, pet_type, location, post_id, direction
+    ).compile(dialect=_dialect)
+    return compiled.string, compiled.construct_params()
+
+
+def measure(prepare, combinations, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        for filters in combinations:
+            prepare(*filters)
+    return (time.process_time() - start) / (iterations * len(combinations))
+
+
+def main(iterations=200):
+    combinations = list(
+        itertools.product(
+            (None, *CATEGORIES), (None, 3), (None, 7), (None, 15), (None, "<", ">")
+        )
+    )
+
+    # Warm the cache, so only the hot path is measured
+    for filters in combinations:
+        _bind_posts_query(*filters)
+
+    before = measure(build_and_compile, combinations, iterations)
+    after = measure(_bind_posts_query, combinations, iterations)
+
+    print(f"filter combinations: {len(combinations)}, iterations: {iterations}")
+    print(f"build + compile per call: {before * 1e6:.1f} us")
+    print(f"compiled cache per call:  {after * 1e6:.1f} us")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,225 @@
+"""
+Synthetic catalog for benchmarks: locations, pet types, posts,
+funny photos and the bot texts the handlers need.
+
+Rows are named with the "Bench" prefix or belong to BENCH_USER_ID and
+are removed by clear(), bot texts are only added if missing and only
+those are removed.
+"""
+import random
+import uuid
+
+from sqlalchemy import delete, insert, select
+
+from src.db.models import (
+    BotText,
+    FunnyPhoto,
+    Location,
+    PetType,
+    Post,
+    TelegramUser,
+    TextType,
+)
+
+CATEGORIES = ("need_home", "need_temp", "need_money", "need_other")
+CHUNK = 5000
+# Uploader of the funny photos
+BENCH_USER_ID = 1899999999
+
+MESSAGES = (
+    "about",
+    "all_pets_are_at_home",
+    "all_pets_from_location_are_at_home",
+    "any",
+    "easter_egg",
+    "easter_egg_disabled",
+    "error_on_callback",
+    "help",
+    "location_filter",
+    "location_filter_applied",
+    "locations_list_header",
+    "need_home",
+    "no",
+    "no_funny_photo",
+    "no_such_location",
+    "no_this_category",
+    "no_this_category_filters",
+    "partners",
+    "pet_type_filter",
+    "pet_type_filter_applied",
+    "photo_received",
+    "project_history",
+    "search",
+    "search_nothing_found",
+    "search_results",
+    "search_truncated",
+    "subscribe_to_funny_photos",
+    "support_us",
+    "unknown_command",
+    "unsubscribe_from_funny_photos",
+    "upload_time_limit",
+    "useful_articles",
+    "user_post_view",
+    "user_post_view_need_home",
+    "volunteers",
+    "welcome",
+    "yes",
+)
+BUTTONS = (
+    "about",
+    "any_location",
+    "any_pet_type",
+    "back_to_prev",
+    "easter_egg",
+    "get_pic",
+    "help",
+    "location_filter",
+    "need_home",
+    "need_money",
+    "need_other",
+    "need_temp",
+    "next",
+    "partners",
+    "pet_type_filter",
+    "previous",
+    "project_history",
+    "search",
+    "sub_pic",
+    "support_us",
+    "unsub_pic",
+    "useful_articles",
+    "volunteers",
+)
+# Post texts are made of these, so the search has real Russian words to stem
+WORDS = (
+    "ласковый",
+    "игривая",
+    "рыжий",
+    "чёрная",
+    "пушистый",
+    "котёнок",
+    "кошка",
+    "щенок",
+    "собака",
+    "привит",
+    "стерилизована",
+    "кастрирован",
+    "приучен",
+    "лотку",
+    "поводку",
+    "ищет",
+    "дом",
+    "передержку",
+    "лечение",
+    "операцию",
+    "корм",
+    "лекарства",
+    "подобрали",
+    "улице",
+    "спокойный",
+    "ладит",
+    "детьми",
+    "другими",
+    "животными",
+    "ветеринар",
+)
+
+
+def _bench_text(name):
+    # Extra format() arguments are ignored, so a plain name fits every text
+    return f"Bench {name}"
+
+
+async def _insert_ids(conn, table, rows):
+    cursor = await conn.execute(insert(table).values(rows).returning(table.id))
+    return [row.id for row in await cursor.fetchall()]
+
+
+async def seed(conn, posts=1000, locations=20, pet_types=5, rnd_seed=0):
+    """Adds the catalog, returns (location ids, pet type ids)"""
+    rnd = random.Random(rnd_seed)
+
+    cursor = await conn.execute(select([BotText.text_type, BotText.name]))
+    existing = {(row.text_type, row.name) for row in await cursor.fetchall()}
+    texts = [
+        dict(name=name, text_type=text_type, value=_bench_text(name))
+        for text_type, names in (
+            (TextType.MESSAGE, MESSAGES),
+            (TextType.BUTTON, BUTTONS),
+        )
+        for name in names
+        if (text_type, name) not in existing
+    ]
+    if texts:
+        await conn.execute(insert(BotText).values(texts))
+
+    location_ids = await _insert_ids(
+        conn,
+        Location,
+        [
+            dict(
+                name=f"BenchCity{n}",
+                button_text=f"BenchCity{n}",
+                display_on_keyboard=n < 10,
+            )
+            for n in range(locations)
+        ],
+    )
+    pet_type_ids = await _insert_ids(
+        conn,
+        PetType,
+        [
+            dict(
+                name=f"BenchType{n}",
+                emoji="*",
+                button_text=f"BenchType{n}",
+                nullable_visible=True,
+            )
+            for n in range(pet_types)
+        ],
+    )
+
+    for start in range(0, posts, CHUNK):
+        rows = []
+        for n in range(start, min(start + CHUNK, posts)):
+            row = dict(
+                title=f"BenchPet{n}",
+                pet_type_id=rnd.choice(pet_type_ids),
+                location_id=rnd.choice(location_ids),
+                # Most posts are shown, like in the real catalog
+                visible=rnd.random() < 0.9,
+                notifications_complete=True,
+            )
+            for category in CATEGORIES:
+                words = " ".join(rnd.sample(WORDS, 6))
+                row[category] = f"BenchPet{n} {category} {words}"
+                row[f"{category}_visible"] = rnd.random() < 0.5
+            rows.append(row)
+        await conn.execute(insert(Post).values(rows))
+
+    return location_ids, pet_type_ids
+
+
+async def seed_funny_photos(conn, count=100):
+    await conn.execute(
+        insert(TelegramUser).values(id=BENCH_USER_ID, first_name="BenchUser")
+    )
+    await conn.execute(
+        insert(FunnyPhoto).values(
+            [
+                dict(filename=uuid.uuid4(), upload_by_id=BENCH_USER_ID, approved=True)
+                for _ in range(count)
+            ]
+        )
+    )
+
+
+async def clear(conn):
+    await conn.execute(
+        delete(FunnyPhoto).where(FunnyPhoto.upload_by_id == BENCH_USER_ID)
+    )
+    await conn.execute(delete(TelegramUser).where(TelegramUser.id == BENCH_USER_ID))
+    await conn.execute(delete(Post).where(Post.title.like("BenchPet%")))
+    await conn.execute(delete(Location).where(Location.name.like("BenchCity%")))
+    await conn.execute(delete(PetType).where(PetType.name.like("BenchType%")))
+    await conn.execute(delete(BotText).where(BotText.value == "Bench " + BotText.name))
@@ -0,0 +1,315 @@
+"""
+Throughput and latency of the dispatcher under synthetic or recorded load.
+
+Updates go through dp.process_updates with all the handlers and
+middlewares, so Postgres and Redis from the environment are used,
+the Bot API is answered by tests/fake_bot_api.py with optional
+latency, errors and 429 injected (--api-latency, --api-error-rate,
+--api-flood-rate).
+Outbox limits are off unless OUTBOX_RATE / OUTBOX_CHAT_INTERVAL are set,
+the bot is measured, not Telegram's flood control.
+
+synthetic: users go through start, main menu, pet type, filters and
+pagination callbacks (<,need_home,1,1,15). The catalog is seeded,
+see benchmarks/dataset.py, and removed afterwards with the users.
+
+replay: updates recorded with RECORD_UPDATES_PATH are sent with their
+original intervals divided by --speed, updates of a user keep their order.
+Run it against a copy of the production database.
+
+Both modes write users, posts and FSM sessions, so they need a dedicated
+database and Redis db given with --database and --redis-db, the bot's
+DB_NAME and REDIS_DB are refused. Postgres and Redis servers still come
+from the environment.
+
+Usage:
+    python -m benchmarks.loadtest synthetic --database zverobot_load
+        --redis-db 15 [--users 200] [--concurrency 50] [--rate 0] [--posts 1000]
+    python -m benchmarks.loadtest replay updates.jsonl --database zverobot_copy
+        --redis-db 15 [--speed 1]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+
+from aiogram import Bot, Dispatcher, types
+from sqlalchemy import delete, select
+
+from benchmarks import dataset
+from src.config import Config
+from src.db.models import Post, TelegramUser
+from src.db.queries import init_database
+from src.tg.ratelimit import TokenBucket
+from src.tg.recorder import read_updates
+from tests.fake_bot_api import FakeBotApi
+
+FIRST_USER_ID = 1900000000
+PAGES_PER_VIEW = 5
+
+
+class Scenario:
+    """Builds the updates a user sends while browsing the catalog"""
+
+    def __init__(self, texts, pet_types, post_ids, rnd_seed=0):
+        self.buttons = texts["buttons"]
+        self.pet_types = pet_types
+        self.post_ids = post_ids
+        self.rnd = random.Random(rnd_seed)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return dict(id=user_id, is_bot=False, first_name=f"Load{user_id}")
+
+    def message(self, user_id, text):
+        return types.Update(
+            update_id=next(self._update_ids),
+            message=dict(
+                message_id=next(self._message_ids),
+                date=int(time.time()),
+                chat=dict(id=user_id, type="private"),
+                text=text,
+                **{"from": self._user(user_id)},
+            ),
+        )
+
+    def callback(self, user_id, data):
+        update_id = next(self._update_ids)
+        return types.Update(
+            update_id=update_id,
+            callback_query=dict(
+                id=str(update_id),
+                chat_instance=str(user_id),
+                data=data,
+                message=dict(
+                    message_id=next(self._message_ids),
+                    date=int(time.time()),
+                    chat=dict(id=user_id, type="private"),
+                ),
+                **{"from": self._user(user_id)},
+            ),
+        )
+
+    def _pages(self, user_id, pet_type):
+        for _ in range(PAGES_PER_VIEW):
+            direction = self.rnd.choice("<>")
+            post_id = self.rnd.choice(self.post_ids)
+            yield self.callback(
+                user_id, f"{direction},need_home,None,{pet_type},{post_id}"
+            )
+
+    def session(self, user_id):
+        pet_type = self.rnd.choice(self.pet_types)
+        filter_value = self.rnd.choice([None, *self.pet_types])
+
+        yield self.message(user_id, "/start")
+        yield self.message(user_id, self.buttons["need_home"])
+        yield self.message(user_id, f"{pet_type.emoji}{pet_type.button_text}")
+        yield from self._pages(user_id, pet_type.id)
+        yield self.callback(user_id, "pet_type_cache")
+        yield self.callback(
+            user_id, f"pet_type_cache,{filter_value.id if filter_value else 'any'}"
+        )
+        yield from self._pages(user_id, filter_value.id if filter_value else None)
+        yield self.message(user_id, self.buttons["back_to_prev"])
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    async def process(self, dp, update):
+        started = time.perf_counter()
+        try:
+            # process_update skips update middlewares (FSM session, recorder)
+            await dp.process_updates([update])
+        except Exception:
+            self.errors += 1
+        self.latencies.append(time.perf_counter() - started)
+
+    def percentile(self, q):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        count = len(self.latencies)
+        print(f"updates: {count}, errors: {self.errors}, elapsed: {elapsed:.2f} s")
+        if not count:
+            return
+        print(f"throughput: {count / elapsed:.1f} updates/s")
+        print(
+            "latency p50 / p95 / p99: "
+            + " / ".join(f"{self.percentile(q) * 1000:.1f}" for q in (0.5, 0.95, 0.99))
+            + " ms"
+        )
+
+
+async def run_synthetic(dp, users, concurrency, rate):
+    async with dp.bot.db.acquire() as conn:
+        cursor = await conn.execute(
+            select([Post.id]).where(Post.title.like("BenchPet%"))
+        )
+        post_ids = [row.id for row in await cursor.fetchall()]
+    pet_types = [p for p in dp.bot.pet_types if p.name.startswith("BenchType")]
+    scenario = Scenario(dp.bot.texts, pet_types, post_ids)
+
+    limiter = TokenBucket(rate) if rate else None
+    user_ids = iter(range(FIRST_USER_ID, FIRST_USER_ID + users))
+    stats = Stats()
+
+    async def _user_worker():
+        for user_id in user_ids:
+            for update in scenario.session(user_id):
+                if limiter:
+                    await limiter.acquire()
+                await stats.process(dp, update)
+
+    await asyncio.gather(*[_user_worker() for _ in range(concurrency)])
+    stats.report()
+
+
+def _update_user(update):
+    event = update.message or update.callback_query
+    return event.from_user.id if event else None
+
+
+async def run_replay(dp, path, speed):
+    recorded = list(read_updates(path))
+    if not recorded:
+        return
+    stats = Stats()
+    first = recorded[0][0]
+    last_task = dict()
+
+    async def _process(update, delay, previous):
+        await asyncio.sleep(delay)
+        if previous:
+            await previous
+        await stats.process(dp, update)
+
+    for recorded_at, update in recorded:
+        delay = (recorded_at - first) / speed - (time.perf_counter() - stats.started)
+        user_id = _update_user(update)
+        task = asyncio.ensure_future(
+            _process(update, max(delay, 0), last_task.get(user_id))
+        )
+        last_task[user_id] = task
+    await asyncio.gather(*last_task.values())
+    stats.report()
+
+
+async def cleanup(dp, users):
+    async with dp.bot.db.acquire() as conn:
+        await dataset.clear(conn)
+        await conn.execute(
+            delete(TelegramUser).where(
+                TelegramUser.id.between(FIRST_USER_ID, FIRST_USER_ID + users)
+            )
+        )
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users):
+        await dp.storage.reset_state(chat=user_id, user=user_id, with_data=True)
+
+
+async def seed(posts):
+    config = Config()
+    config.with_env()
+    engine = await init_database(
+        host=config.db_host,
+        port=config.db_port,
+        user=config.db_user,
+        password=config.db_password,
+        database=config.db_name,
+    )
+    async with engine.acquire() as conn:
+        await dataset.clear(conn)
+        await dataset.seed(conn, posts=posts)
+    engine.close()
+    await engine.wait_closed()
+
+
+def main():
+    common_options = argparse.ArgumentParser(add_help=False)
+    common_options.add_argument("--api-latency", type=float, default=0, help="seconds")
+    common_options.add_argument("--api-error-rate", type=float, default=0)
+    common_options.add_argument("--api-flood-rate", type=float, default=0)
+    common_options.add_argument(
+        "--database", required=True, help="dedicated database, not DB_NAME"
+    )
+    common_options.add_argument(
+        "--redis-db", type=int, required=True, help="dedicated Redis db, not REDIS_DB"
+    )
+
+    parser = argparse.ArgumentParser(description="Dispatcher load test")
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    synthetic = modes.add_parser("synthetic", parents=[common_options])
+    synthetic.add_argument("--users", type=int, default=200)
+    synthetic.add_argument("--concurrency", type=int, default=50)
+    synthetic.add_argument("--rate", type=float, default=0, help="updates/s, 0 is max")
+    synthetic.add_argument("--posts", type=int, default=1000)
+
+    replay = modes.add_parser("replay", parents=[common_options])
+    replay.add_argument("path")
+    replay.add_argument("--speed", type=float, default=1)
+
+    args = parser.parse_args()
+
+    config = Config()
+    config.with_env()
+    if args.database == config.db_name:
+        parser.error(f"{args.database} is the bot database, use a dedicated one")
+    if args.redis_db == config.redis_db:
+        parser.error(f"Redis db {args.redis_db} is the bot's one, use a dedicated one")
+    # Read by seed() and by the bot created on import below
+    os.environ["DB_NAME"] = args.database
+    os.environ["REDIS_DB"] = str(args.redis_db)
+
+    loop = asyncio.get_event_loop()
+    api = FakeBotApi(
+        latency=args.api_latency,
+        error_rate=args.api_error_rate,
+        flood_rate=args.api_flood_rate,
+    )
+    os.environ["BOT_API_URL"] = loop.run_until_complete(api.start())
+    os.environ.setdefault("OUTBOX_RATE", "1000000")
+    os.environ.setdefault("OUTBOX_CHAT_INTERVAL", "0")
+    if args.mode == "synthetic":
+        loop.run_until_complete(seed(args.posts))
+
+    # The bot is created on import, after the environment is ready
+    from src.tg.dp import dp
+    from src.tg.handlers import admin_handlers, base_handlers
+
+    # Set by the executor when the bot runs for real
+    Dispatcher.set_current(dp)
+    Bot.set_current(dp.bot)
+    loop.run_until_complete(dp.bot.startup(dp.storage))
+    try:
+        if args.mode == "synthetic":
+            loop.run_until_complete(
+                run_synthetic(dp, args.users, args.concurrency, args.rate)
+            )
+        else:
+            loop.run_until_complete(run_replay(dp, args.path, args.speed))
+        flooded = sum(1 for c in api.calls if c.status == 429)
+        print(f"Bot API calls: {len(api.calls)}, 429 answers: {flooded}")
+    finally:
+        loop.run_until_complete(dp.bot.shutdown())
+        if args.mode == "synthetic":
+            loop.run_until_complete(cleanup(dp, args.users))
+        loop.run_until_complete(dp.storage.close())
+        loop.run_until_complete(dp.storage.wait_closed())
+        dp.bot.db.close()
+        loop.run_until_complete(dp.bot.db.wait_closed())
+        loop.run_until_complete(dp.bot.close())
+        loop.run_until_complete(api.close())
+
+
+if __name__ == "__main__":
+    main()
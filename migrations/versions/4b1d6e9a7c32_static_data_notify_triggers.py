@@ -0,0 +1,47 @@
+"""static_data_notify_triggers
+
+Revision ID: 4b1d6e9a7c32
+Revises: c55541aa214e
+Create Date: 2026-10-18 18:41:09.125733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "4b1d6e9a7c32"
+down_revision = "c55541aa214e"
+branch_labels = None
+depends_on = None
+
+TABLES = ("bot_texts", "locations", "pet_types")
+
+
+def upgrade():
+    # The table name goes to the static_data channel once per statement,
+    # notifications of one transaction are delivered on commit
+    op.execute(
+        """
+        CREATE FUNCTION notify_static_data() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('static_data', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    for table in TABLES:
+        op.execute(
+            f"""
+            CREATE TRIGGER {table}_notify_static_data
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE PROCEDURE notify_static_data()
+            """
+        )
+
+
+def downgrade():
+    for table in TABLES:
+        op.execute(f"DROP TRIGGER {table}_notify_static_data ON {table}")
+    op.execute("DROP FUNCTION notify_static_data()")
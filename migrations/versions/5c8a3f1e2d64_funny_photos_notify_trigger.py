@@ -0,0 +1,32 @@
+"""funny_photos_notify_trigger
+
+Revision ID: 5c8a3f1e2d64
+Revises: 9e2f0c5d8a17
+Create Date: 2026-10-18 08:41:12.481093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5c8a3f1e2d64"
+down_revision = "9e2f0c5d8a17"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Photos are added and approved in the admin panel, the bot keeps
+    # approved ids in memory. Saved telegram_file_id doesn't notify.
+    op.execute(
+        """
+        CREATE TRIGGER funny_photos_notify_static_data
+        AFTER INSERT OR UPDATE OF approved OR DELETE OR TRUNCATE ON funny_photos
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_static_data()
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER funny_photos_notify_static_data ON funny_photos")
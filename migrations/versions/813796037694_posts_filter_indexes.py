@@ -0,0 +1,51 @@
+"""posts_filter_indexes
+
+Revision ID: 813796037694
+Revises: 362a7f6f0775
+Create Date: 2026-10-18 12:04:31.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "813796037694"
+down_revision = "362a7f6f0775"
+branch_labels = None
+depends_on = None
+
+# Partial indexes follow the WHERE clauses of select_posts_with_filters,
+# one set per category plus one for the "any category" views.
+# id goes last, so keyset pagination (id < / id > with ORDER BY id)
+# is served by the same index.
+predicates = {
+    "visible": "visible",
+    "need_home": "visible AND need_home_visible AND need_home <> ''",
+    "need_temp": "visible AND need_temp_visible AND need_temp <> ''",
+    "need_money": "visible AND need_money_visible AND need_money <> ''",
+    "need_other": "visible AND need_other_visible AND need_other <> ''",
+}
+
+columns = {
+    "id": ["id"],
+    "pet_type": ["pet_type_id", "id"],
+    "location": ["location_id", "id"],
+}
+
+
+def upgrade():
+    for predicate_name, predicate in predicates.items():
+        for columns_name, index_columns in columns.items():
+            op.create_index(
+                f"ix_posts_{predicate_name}_{columns_name}",
+                "posts",
+                index_columns,
+                postgresql_where=sa.text(predicate),
+            )
+
+
+def downgrade():
+    for predicate_name in predicates:
+        for columns_name in columns:
+            op.drop_index(f"ix_posts_{predicate_name}_{columns_name}", "posts")
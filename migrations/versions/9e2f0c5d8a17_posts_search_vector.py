@@ -0,0 +1,67 @@
+"""posts_search_vector
+
+Revision ID: 9e2f0c5d8a17
+Revises: 4b1d6e9a7c32
+Create Date: 2026-10-18 20:12:37.602148
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "9e2f0c5d8a17"
+down_revision = "4b1d6e9a7c32"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "posts", sa.Column("search_vector", postgresql.TSVECTOR(), nullable=True)
+    )
+    # Postgres 10 has no generated columns, a trigger keeps the vector.
+    # Title weighs more than the texts, hidden texts are not searched.
+    op.execute(
+        """
+        CREATE FUNCTION posts_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector :=
+                setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+                setweight(to_tsvector('russian', concat_ws(' ',
+                    CASE WHEN NEW.need_home_visible THEN NEW.need_home END,
+                    CASE WHEN NEW.need_temp_visible THEN NEW.need_temp END,
+                    CASE WHEN NEW.need_money_visible THEN NEW.need_money END,
+                    CASE WHEN NEW.need_other_visible THEN NEW.need_other END
+                )), 'B');
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER posts_search_vector
+        BEFORE INSERT OR UPDATE OF title, need_home, need_home_visible,
+            need_temp, need_temp_visible, need_money, need_money_visible,
+            need_other, need_other_visible
+        ON posts FOR EACH ROW EXECUTE PROCEDURE posts_search_vector()
+        """
+    )
+    # Fills the vector of the existing posts
+    op.execute("UPDATE posts SET title = title")
+    op.create_index(
+        "ix_posts_search_vector",
+        "posts",
+        ["search_vector"],
+        postgresql_using="gin",
+        postgresql_where=sa.text("visible"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_posts_search_vector", "posts")
+    op.execute("DROP TRIGGER posts_search_vector ON posts")
+    op.execute("DROP FUNCTION posts_search_vector()")
+    op.drop_column("posts", "search_vector")
@@ -0,0 +1,51 @@
+"""search_texts
+
+Revision ID: a7d41e9c3b58
+Revises: 5c8a3f1e2d64
+Create Date: 2026-10-18 21:34:18.207415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a7d41e9c3b58"
+down_revision = "5c8a3f1e2d64"
+branch_labels = None
+depends_on = None
+
+# /search reads these, the admin panel may change them later.
+# The search button stays hidden until its text is added.
+MESSAGES = {
+    "search": "Напишите, что ищете: кличку, породу, окрас или район.",
+    "search_nothing_found": "По запросу {} ничего не нашлось, попробуйте другие слова.",
+    "search_results": "Найдено по запросу {}:",
+    "search_truncated": "Показаны только {} самых новых совпадений, "
+    "уточните запрос, чтобы найти более старые объявления.",
+}
+
+
+def upgrade():
+    # Texts already added in the admin panel are kept
+    for name, value in MESSAGES.items():
+        op.execute(
+            sa.text(
+                """
+                INSERT INTO bot_texts (name, text_type, value)
+                SELECT :name, 'MESSAGE', :value
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM bot_texts
+                    WHERE name = :name AND text_type = 'MESSAGE'
+                )
+                """
+            ).bindparams(name=name, value=value)
+        )
+
+
+def downgrade():
+    op.execute(
+        sa.text(
+            "DELETE FROM bot_texts WHERE name IN :names AND text_type = 'MESSAGE'"
+        ).bindparams(sa.bindparam("names", tuple(MESSAGES), expanding=True))
+    )
@@ -0,0 +1,26 @@
+"""funny_photos_telegram_file_id
+
+Revision ID: c55541aa214e
+Revises: ec902df4cfd1
+Create Date: 2026-10-18 16:02:44.316250
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c55541aa214e"
+down_revision = "ec902df4cfd1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "funny_photos", sa.Column("telegram_file_id", sa.String(), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("funny_photos", "telegram_file_id")
@@ -0,0 +1,29 @@
+"""posts_notifications_checkpoint
+
+Revision ID: ec902df4cfd1
+Revises: 813796037694
+Create Date: 2026-10-18 15:20:07.482913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "ec902df4cfd1"
+down_revision = "813796037694"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Last telegram_users.id the post was sent to, broadcast resumes after it
+    op.add_column(
+        "posts", sa.Column("notifications_last_user_id", sa.Integer(), nullable=True)
+    )
+    # Posts published before notifications existed are not broadcast
+    op.execute("UPDATE posts SET notifications_complete = true")
+
+
+def downgrade():
+    op.drop_column("posts", "notifications_last_user_id")
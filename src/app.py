@@ -1,8 +1,59 @@
+import asyncio
+
+from aiohttp import web
 from aiogram.utils import executor
 
-from src.tg.dp import dp
+from src.metrics import start_metrics_server
+from src.tg.cluster import WORKER_PATH, run_cluster
+from src.tg.dp import dp, cfg
+from src.tg.webhook import add_lifecycle, make_webhook_app, start_webhook
+from src.utils import get_logger
 
 from src.tg.handlers.admin_handlers import *
 from src.tg.handlers.base_handlers import *
 
-executor.start_polling(dp)
+log = get_logger("app")
+
+metrics_runner = None
+
+
+def _startup_done(task):
+    if task.cancelled() or task.exception() is None:
+        return
+    log.error("Startup failed, stopping", exc_info=task.exception())
+    asyncio.get_event_loop().stop()
+
+
+async def on_startup(dp):
+    global metrics_runner
+    if cfg.metrics_enabled:
+        metrics_runner = await start_metrics_server(cfg.metrics_host, cfg.metrics_port)
+    # Polling starts at once, updates wait for the warm-up in StartupGateMiddleware
+    startup = asyncio.get_event_loop().create_task(dp.bot.startup(dp.storage))
+    startup.add_done_callback(_startup_done)
+
+
+async def on_shutdown(dp):
+    await dp.bot.shutdown()
+    if metrics_runner:
+        await metrics_runner.cleanup()
+
+
+def run_worker(index):
+    """Worker of the multi-process mode, updates come from the front end"""
+    # The front end exposes its metrics on metrics_port
+    cfg.metrics_port += index + 1
+    app = make_webhook_app(dp, WORKER_PATH, max_body_size=cfg.webhook_max_body_size)
+    add_lifecycle(app, dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    web.run_app(
+        app, host=cfg.worker_host, port=cfg.worker_base_port + index, print=None
+    )
+
+
+def main():
+    if cfg.workers > 1:
+        run_cluster(cfg)
+    elif cfg.webhook_enabled:
+        start_webhook(dp, cfg, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
@@ -16,12 +16,68 @@ class Config:
     db_user: str
     db_password: str
     db_name: str
-
-    redis_port: int
+    db_pool_min_size: int = 1
+    db_pool_max_size: int = 10
+    db_pool_timeout: float = 60
+    db_pool_recycle: float = -1
+    db_statement_timeout_ms: int = 0
+
+    redis_host: str = "redis-local"
+    redis_port: int = 6379
+    redis_db: int = None
+    redis_password: str = None
+    redis_pool_size: int = 10
+    fsm_ttl: int = None
 
     easter_egg_enabled: bool = False
 
     photo_stock_id: int
+    funny_photo_history: int = 5
+
+    post_catalog_enabled: bool = False
+    post_catalog_refresh_interval: int = 30
+
+    bot_api_url: str = None
+
+    webhook_enabled: bool = False
+    webhook_url: str = None
+    webhook_path: str = "/webhook"
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_secret_token: str = None
+    webhook_max_body_size: int = 1024**2
+
+    workers: int = 1
+    worker_host: str = "127.0.0.1"
+    worker_base_port: int = 8100
+    worker_queue_size: int = 10000
+    refresh_channel: str = "zverobot:refresh"
+    static_data_listen_enabled: bool = True
+    static_data_debounce: float = 0.5
+    static_data_health_check_interval: float = 30
+
+    slow_query_threshold_ms: int = 500
+    slow_query_window: int = 600
+
+    metrics_enabled: bool = False
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9101
+
+    record_updates_path: str = None
+
+    registration_queue_size: int = 10000
+    registration_batch_size: int = 500
+    registration_flush_interval: float = 1
+
+    notifications_enabled: bool = False
+    notifications_interval: int = 60
+    outbox_rate: float = 30
+    outbox_chat_interval: float = 1
+    outbox_chat_burst: int = 3
+    outbox_workers: int = 16
+    broadcast_chat_interval: float = 1
+    broadcast_workers: int = 10
+    broadcast_batch_size: int = 1000
 
     def __init__(self):
         load_dotenv()
@@ -37,9 +93,89 @@ class Config:
         self.db_user = getenv("DB_USER")
         self.db_password = getenv("DB_PASSWORD")
         self.db_name = getenv("DB_NAME")
+        self.db_pool_min_size = int(getenv("DB_POOL_MIN_SIZE", 1))
+        self.db_pool_max_size = int(getenv("DB_POOL_MAX_SIZE", 10))
+        # Seconds to wait for a free connection
+        self.db_pool_timeout = float(getenv("DB_POOL_TIMEOUT", 60))
+        # Connections older than that are reopened, -1 keeps them forever
+        self.db_pool_recycle = float(getenv("DB_POOL_RECYCLE", -1))
+        # 0 means no limit
+        self.db_statement_timeout_ms = int(getenv("DB_STATEMENT_TIMEOUT_MS", 0))
         self.easter_egg_enabled = bool(int(getenv("EASTER_EGG_ENABLED")))
 
+        self.redis_host = getenv("REDIS_HOST", "redis-local")
+        self.redis_port = int(getenv("REDIS_PORT", 6379))
+        self.redis_db = int(getenv("REDIS_DB", 0))
+        self.redis_password = getenv("REDIS_PASSWORD") or None
+        self.redis_pool_size = int(getenv("REDIS_POOL_SIZE", 10))
+        # Sessions of users idle for longer are dropped, 0 keeps them forever
+        self.fsm_ttl = int(getenv("FSM_TTL", 30 * 24 * 60 * 60)) or None
+
         self.photo_stock_id = int(getenv("PHOTO_STOCK_ID"))
+        # Last photos not repeated to the same user, 0 allows repeats
+        self.funny_photo_history = int(getenv("FUNNY_PHOTO_HISTORY", 5))
+
+        self.post_catalog_enabled = bool(int(getenv("POST_CATALOG_ENABLED", 0)))
+        self.post_catalog_refresh_interval = int(
+            getenv("POST_CATALOG_REFRESH_INTERVAL", 30)
+        )
+
+        # Empty means api.telegram.org
+        self.bot_api_url = getenv("BOT_API_URL") or None
+
+        self.webhook_enabled = bool(int(getenv("WEBHOOK_ENABLED", 0)))
+        self.webhook_url = getenv("WEBHOOK_URL")
+        self.webhook_path = getenv("WEBHOOK_PATH", "/webhook")
+        self.webhook_host = getenv("WEBHOOK_HOST", "0.0.0.0")
+        self.webhook_port = int(getenv("WEBHOOK_PORT", 8080))
+        self.webhook_secret_token = getenv("WEBHOOK_SECRET_TOKEN") or None
+        self.webhook_max_body_size = int(getenv("WEBHOOK_MAX_BODY_SIZE", 1024**2))
+
+        # More than 1 runs the webhook as a front end of that many processes
+        self.workers = int(getenv("WORKERS", 1))
+        # Worker i listens on worker_base_port + i
+        self.worker_host = getenv("WORKER_HOST", "127.0.0.1")
+        self.worker_base_port = int(getenv("WORKER_BASE_PORT", 8100))
+        # Updates waiting for one worker, the front end answers 503 above it
+        self.worker_queue_size = int(getenv("WORKER_QUEUE_SIZE", 10000))
+        self.refresh_channel = getenv("REFRESH_CHANNEL", "zverobot:refresh")
+        # Texts, locations and pet types are reloaded on change in Postgres,
+        # changes within debounce seconds make a single reload
+        self.static_data_listen_enabled = bool(
+            int(getenv("STATIC_DATA_LISTEN_ENABLED", 1))
+        )
+        self.static_data_debounce = float(getenv("STATIC_DATA_DEBOUNCE", 0.5))
+        # Seconds without notifications before the connection is checked
+        self.static_data_health_check_interval = float(
+            getenv("STATIC_DATA_HEALTH_CHECK_INTERVAL", 30)
+        )
+
+        self.slow_query_threshold_ms = int(getenv("SLOW_QUERY_THRESHOLD_MS", 500))
+        self.slow_query_window = int(getenv("SLOW_QUERY_WINDOW", 600))
+
+        self.metrics_enabled = bool(int(getenv("METRICS_ENABLED", 0)))
+        self.metrics_host = getenv("METRICS_HOST", "127.0.0.1")
+        self.metrics_port = int(getenv("METRICS_PORT", 9101))
+
+        # Incoming updates are appended there as JSONL, empty disables
+        self.record_updates_path = getenv("RECORD_UPDATES_PATH") or None
+
+        self.registration_queue_size = int(getenv("REGISTRATION_QUEUE_SIZE", 10000))
+        self.registration_batch_size = int(getenv("REGISTRATION_BATCH_SIZE", 500))
+        self.registration_flush_interval = float(
+            getenv("REGISTRATION_FLUSH_INTERVAL", 1)
+        )
+
+        self.notifications_enabled = bool(int(getenv("NOTIFICATIONS_ENABLED", 0)))
+        self.notifications_interval = int(getenv("NOTIFICATIONS_INTERVAL", 60))
+        # Telegram limits: ~30 messages per second, 1 per second to a chat
+        self.outbox_rate = float(getenv("OUTBOX_RATE", 30))
+        self.outbox_chat_interval = float(getenv("OUTBOX_CHAT_INTERVAL", 1))
+        self.outbox_chat_burst = int(getenv("OUTBOX_CHAT_BURST", 3))
+        self.outbox_workers = int(getenv("OUTBOX_WORKERS", 16))
+        self.broadcast_chat_interval = float(getenv("BROADCAST_CHAT_INTERVAL", 1))
+        self.broadcast_workers = int(getenv("BROADCAST_WORKERS", 10))
+        self.broadcast_batch_size = int(getenv("BROADCAST_BATCH_SIZE", 1000))
 
     def set_custom_attr(self, attr_name: str, env_param_name: str = None):
         """
@@ -0,0 +1,147 @@
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+
+from src.db.queries import CATEGORIES, PostPage, select_visible_posts
+from src.utils import get_logger
+
+log = get_logger("PostCatalog")
+
+
+def _to_id(value):
+    # Callback data brings ids as strings
+    return int(value) if value else None
+
+
+def _post_categories(post):
+    for category in CATEGORIES:
+        if post[category] and post[f"{category}_visible"]:
+            yield category
+
+
+class PostCatalog:
+    """
+    In-process copy of visible posts.
+
+    Every post is indexed by (category, pet_type_id, location_id),
+    where None in the key means "any", so each filter combination
+    is a sorted list of post ids and prev/next lookups are bisects.
+    Filter semantics are the same as in select_posts_with_filters.
+    """
+
+    def __init__(self, full_reload_every=10):
+        # There is no updated_at in posts, so edited and hidden posts
+        # are picked up only by the periodic full reload
+        self.full_reload_every = full_reload_every
+        self.loaded = False
+
+        self._posts = dict()
+        self._index = dict()
+        self._last_id = None
+        self._last_created_at = None
+        self._loads_count = 0
+
+    def __len__(self):
+        return len(self._posts)
+
+    def _add(self, post, posts, index):
+        if post.id in posts:
+            return
+        posts[post.id] = post
+        for category in (None, *_post_categories(post)):
+            for pet_type in (None, post.pet_type_id):
+                for location in (None, post.location_id):
+                    insort(
+                        index.setdefault((category, pet_type, location), []), post.id
+                    )
+
+    def _track(self, posts):
+        for post in posts:
+            if self._last_id is None or post.id > self._last_id:
+                self._last_id = post.id
+            if post.created_at and (
+                self._last_created_at is None or post.created_at > self._last_created_at
+            ):
+                self._last_created_at = post.created_at
+
+    async def load(self, conn):
+        """Full reload. New index is built aside and swapped in at once"""
+        rows = await select_visible_posts(conn)
+        posts, index = dict(), dict()
+        for post in rows:
+            self._add(post, posts, index)
+
+        self._posts, self._index = posts, index
+        self._last_id, self._last_created_at = None, None
+        self._track(rows)
+        self.loaded = True
+
+    async def load_delta(self, conn):
+        """Load only posts added since the last load"""
+        rows = await select_visible_posts(
+            conn, after_id=self._last_id, after_created_at=self._last_created_at
+        )
+        for post in rows:
+            self._add(post, self._posts, self._index)
+        self._track(rows)
+
+    async def sync(self, conn):
+        if not self.loaded or self._loads_count % self.full_reload_every == 0:
+            await self.load(conn)
+        else:
+            await self.load_delta(conn)
+        self._loads_count += 1
+
+    async def run(self, engine, interval):
+        while True:
+            try:
+                async with engine.acquire() as conn:
+                    await self.sync(conn)
+            except Exception as ex:
+                log.warning(f"Catalog sync failed: {ex}")
+            await asyncio.sleep(interval)
+
+    def _ids(self, category, pet_type, location):
+        return self._index.get((category, _to_id(pet_type), _to_id(location)), [])
+
+    def select_posts_with_filters(
+        self, category=None, pet_type=None, location=None, post_id=None, direction=None
+    ):
+        """Same filters and ordering as in the SQL version, returns a list of posts"""
+        ids = self._ids(category, pet_type, location)
+
+        if post_id and direction == "<":
+            ids = reversed(ids[: bisect_left(ids, int(post_id))])
+        elif post_id and direction == ">":
+            ids = ids[bisect_right(ids, int(post_id)) :]
+
+        return [self._posts[i] for i in ids]
+
+    def _position(self, ids, post_id, direction):
+        if post_id and direction == "<":
+            return bisect_left(ids, int(post_id)) - 1
+        elif post_id and direction == ">":
+            return bisect_right(ids, int(post_id))
+        return 0
+
+    def first(
+        self, category=None, pet_type=None, location=None, post_id=None, direction=None
+    ):
+        """First post of select_posts_with_filters or None without copying the index"""
+        ids = self._ids(category, pet_type, location)
+        pos = self._position(ids, post_id, direction)
+        if 0 <= pos < len(ids):
+            return self._posts[ids[pos]]
+
+    def select_post_page(
+        self, category=None, pet_type=None, location=None, post_id=None, direction=None
+    ):
+        """Same as the SQL select_post_page"""
+        ids = self._ids(category, pet_type, location)
+        if not ids:
+            return
+
+        pos = self._position(ids, post_id, direction)
+        if not 0 <= pos < len(ids):
+            pos = 0
+
+        return PostPage(self._posts[ids[pos]], pos > 0, pos < len(ids) - 1)
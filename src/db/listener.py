@@ -0,0 +1,127 @@
+import asyncio
+
+import aiopg
+import psycopg2
+
+from src.metrics import Counter
+from src.utils import get_logger
+
+log = get_logger("StaticDataListener")
+
+STATIC_DATA_CHANNEL = "static_data"
+STATIC_TABLES = frozenset(("bot_texts", "locations", "pet_types"))
+# Approved funny photo ids are kept in memory too, see FunnyPhotoPool
+LISTENED_TABLES = STATIC_TABLES | {"funny_photos"}
+
+static_data_notifications = Counter(
+    "zverobot_static_data_notifications_total",
+    "Change notifications from Postgres",
+    labels=("table",),
+)
+
+
+class StaticDataListener:
+    """
+    LISTENs to the static_data channel filled by triggers on bot_texts,
+    locations, pet_types (see the static_data_notify_triggers migration)
+    and funny_photos.
+
+    Uses its own connection, never one of the pool. Notifications coming
+    within `debounce` seconds of the first one are merged, so a bulk edit
+    in the admin panel makes a single reload of every changed table.
+    After a lost connection changes could be missed, so all tables are
+    reloaded. A dropped connection doesn't always wake the notifies
+    queue (aiopg 1.0 never closes it), so after `health_check_interval`
+    seconds without notifications the connection is checked with
+    SELECT 1.
+    """
+
+    def __init__(
+        self, debounce=0.5, reconnect_interval=1, health_check_interval=30, **pg_config
+    ):
+        self.debounce = debounce
+        self.reconnect_interval = reconnect_interval
+        self.health_check_interval = health_check_interval
+        self._pg_config = pg_config
+        self._conn = None
+        self._closed = False
+        self._task = None
+        self.listening = asyncio.Event()
+
+    async def _collect(self, notifies):
+        """
+        Changed tables of the first notification and the ones following it,
+        None when nothing came within health_check_interval
+        """
+        loop = asyncio.get_event_loop()
+        tables = set()
+        deadline = None
+        while deadline is None or loop.time() < deadline:
+            try:
+                msg = await asyncio.wait_for(
+                    notifies.get(),
+                    self.health_check_interval
+                    if deadline is None
+                    else deadline - loop.time(),
+                )
+            except asyncio.TimeoutError:
+                if deadline is None:
+                    return
+                break
+            static_data_notifications.inc(msg.payload)
+            tables.add(msg.payload)
+            if deadline is None:
+                deadline = loop.time() + self.debounce
+        return tables & LISTENED_TABLES
+
+    @staticmethod
+    async def _reload(callback, tables):
+        try:
+            await callback(tables)
+        except Exception as ex:
+            log.exception(f"Reload of {', '.join(sorted(tables))} failed: {ex}")
+
+    async def run(self, callback):
+        """Calls `await callback(tables)` for changes until close()"""
+        reconnected = False
+        while not self._closed:
+            try:
+                self._conn = await aiopg.connect(**self._pg_config)
+                async with self._conn.cursor() as cur:
+                    await cur.execute(f"LISTEN {STATIC_DATA_CHANNEL}")
+                self.listening.set()
+                if reconnected:
+                    await self._reload(callback, set(LISTENED_TABLES))
+                while True:
+                    tables = await self._collect(self._conn.notifies)
+                    if tables is None:
+                        # Raises when the connection is lost
+                        async with self._conn.cursor() as cur:
+                            await cur.execute("SELECT 1")
+                    elif tables:
+                        await self._reload(callback, tables)
+            except (OSError, psycopg2.Error) as ex:
+                if not self._closed:
+                    log.warning(f"Listener connection lost: {ex}")
+            finally:
+                self.listening.clear()
+                if self._conn is not None:
+                    self._conn.close()
+            reconnected = True
+            if not self._closed:
+                await asyncio.sleep(self.reconnect_interval)
+
+    def start(self, callback):
+        self._task = asyncio.get_event_loop().create_task(self.run(callback))
+
+    async def close(self):
+        """Stops run(), waiting for a reload in progress is not needed"""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._conn is not None:
+            self._conn.close()
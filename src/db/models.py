@@ -9,8 +9,11 @@ from sqlalchemy import (
     Boolean,
     ForeignKey,
     Text,
+    Index,
+    and_,
     Enum as saEnum,
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 import sqlalchemy_utils as sa_utils
@@ -105,6 +108,49 @@ class Post(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow())
 
     notifications_complete = Column(Boolean, default=False)
+    # Broadcast checkpoint, see src/tg/broadcast.py
+    notifications_last_user_id = Column(Integer)
+
+    # Title and visible need_* texts, filled by a trigger, see search_posts
+    search_vector = Column(TSVECTOR)
+
+
+def _post_filter_indexes(name, predicate):
+    # Partial indexes for select_posts_with_filters predicates,
+    # id is the last column for keyset pagination
+    Index(f"ix_posts_{name}_id", Post.id, postgresql_where=predicate)
+    Index(
+        f"ix_posts_{name}_pet_type",
+        Post.pet_type_id,
+        Post.id,
+        postgresql_where=predicate,
+    )
+    Index(
+        f"ix_posts_{name}_location",
+        Post.location_id,
+        Post.id,
+        postgresql_where=predicate,
+    )
+
+
+_post_filter_indexes("visible", Post.visible)
+for _category in ("need_home", "need_temp", "need_money", "need_other"):
+    _post_filter_indexes(
+        _category,
+        and_(
+            Post.visible,
+            getattr(Post, f"{_category}_visible"),
+            getattr(Post, _category) != "",
+        ),
+    )
+
+
+Index(
+    "ix_posts_search_vector",
+    Post.search_vector,
+    postgresql_using="gin",
+    postgresql_where=Post.visible,
+)
 
 
 class FunnyPhoto(Base):
@@ -121,6 +167,9 @@ class FunnyPhoto(Base):
 
     caption = Column(Text, nullable=True)
 
+    # Set after the first upload, later sends reuse it
+    telegram_file_id = Column(String, nullable=True)
+
 
 class TextType(Enum):
     MESSAGE = 0
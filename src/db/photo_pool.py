@@ -0,0 +1,104 @@
+import random
+from collections import OrderedDict, deque
+
+from src.db.queries import select_approved_funny_photo_ids, select_funny_photo
+from src.utils import get_logger
+
+log = get_logger("FunnyPhotoPool")
+
+
+class FunnyPhotoPool:
+    """
+    Ids of approved funny photos, so a random one is picked in O(1)
+    and only the chosen row is fetched from the database.
+
+    Ids live in a list with their positions in a dict,
+    removal swaps the id with the last one. The pool is loaded
+    on first use and reloaded when funny_photos change in Postgres,
+    see StaticDataListener.
+
+    With history > 0 the last `history` photos sent to a user
+    are skipped when the pool is big enough.
+    """
+
+    def __init__(self, history=5, max_users=10000):
+        self.history = history
+        self.max_users = max_users
+        self.loaded = False
+
+        self._ids = list()
+        self._positions = dict()
+        self._recent = OrderedDict()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, photo_id):
+        return photo_id in self._positions
+
+    def add(self, photo_id):
+        if photo_id in self._positions:
+            return
+        self._positions[photo_id] = len(self._ids)
+        self._ids.append(photo_id)
+
+    def remove(self, photo_id):
+        position = self._positions.pop(photo_id, None)
+        if position is None:
+            return
+        last = self._ids.pop()
+        if last != photo_id:
+            self._ids[position] = last
+            self._positions[last] = position
+
+    async def load(self, conn):
+        ids = await select_approved_funny_photo_ids(conn)
+        if ids is None:
+            return
+        self._ids = list()
+        self._positions = dict()
+        for photo_id in ids:
+            self.add(photo_id)
+        self.loaded = True
+
+    def _user_recent(self, user_id):
+        recent = self._recent.get(user_id)
+        if recent is None:
+            if len(self._recent) >= self.max_users:
+                self._recent.popitem(last=False)
+            recent = self._recent[user_id] = deque(maxlen=self.history)
+        else:
+            self._recent.move_to_end(user_id)
+        return recent
+
+    def choice(self, user_id=None):
+        if not self._ids:
+            return
+
+        if not self.history or user_id is None:
+            return random.choice(self._ids)
+
+        recent = self._user_recent(user_id)
+        photo_id = random.choice(self._ids)
+        if len(self._ids) > len(recent):
+            # Recent photos are at most `history` of the pool,
+            # so a few draws are enough on average
+            while photo_id in recent:
+                photo_id = random.choice(self._ids)
+        recent.append(photo_id)
+        return photo_id
+
+    async def select_random(self, conn, user_id=None):
+        if not self.loaded:
+            await self.load(conn)
+
+        while self._ids:
+            photo_id = self.choice(user_id)
+            photo = await select_funny_photo(conn, photo_id)
+            if photo is None:
+                # The query failed, not the photo, the pool is kept
+                return
+            if photo:
+                return photo
+            # Deleted or disapproved outside of the bot
+            self.remove(photo_id)
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from src.metrics import Gauge, Histogram
+
+pool_acquire_duration = Histogram(
+    "zverobot_db_pool_acquire_seconds",
+    "Wait for a pooled Postgres connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+pool_in_use = Gauge("zverobot_db_pool_in_use", "Connections given out")
+pool_free = Gauge("zverobot_db_pool_free", "Open connections ready to be given")
+pool_waiters = Gauge("zverobot_db_pool_waiters", "Coroutines waiting in acquire()")
+pool_max_size = Gauge("zverobot_db_pool_max_size", "Pool max size")
+
+
+class _AcquireContext:
+    __slots__ = ("_engine", "_conn")
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._conn = None
+
+    def __await__(self):
+        return self._engine._acquire().__await__()
+
+    async def __aenter__(self):
+        self._conn = await self._engine._acquire()
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        conn, self._conn = self._conn, None
+        await conn.close()
+
+
+class InstrumentedEngine:
+    """
+    aiopg engine publishing pool statistics.
+
+    Every acquire() is timed, so waits for a free connection under
+    bursts show up in the histogram, current waiters and connections
+    in use are gauges. Everything else goes to the wrapped engine.
+    """
+
+    def __init__(self, engine):
+        self._engine = engine
+        self.waiters = 0
+
+        pool_in_use.callback = lambda: self._engine.size - self._engine.freesize
+        pool_free.callback = lambda: self._engine.freesize
+        pool_waiters.callback = lambda: self.waiters
+        pool_max_size.callback = lambda: self._engine.maxsize
+
+    def __getattr__(self, name):
+        return getattr(self._engine, name)
+
+    def acquire(self):
+        return _AcquireContext(self)
+
+    async def _acquire(self):
+        self.waiters += 1
+        started = time.perf_counter()
+        try:
+            return await self._engine.acquire()
+        finally:
+            self.waiters -= 1
+            pool_acquire_duration.observe(time.perf_counter() - started)
+
+    async def warm_up(self):
+        """Opens minsize connections and checks every one of them"""
+
+        async def _check():
+            async with self.acquire() as conn:
+                await conn.execute("SELECT 1")
+
+        await asyncio.gather(*[_check() for _ in range(self._engine.minsize)])
@@ -1,30 +1,49 @@
 import random
+from collections import namedtuple
+
 from aiopg.sa import SAConnection as SAConn, create_engine as create_pg_engine
+from aiopg.sa.engine import get_dialect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.sql import insert, delete, update, select, join
 import sqlalchemy as sa
 
 
+from src.db.query_log import execute
 from src.db.models import TelegramUser, Post, FunnyPhoto, PetType, Location, BotText
+from src.metrics import Histogram, timed
 from src.utils import get_logger
 
 log = get_logger("PostgresClient")
 
+query_duration = Histogram(
+    "zverobot_query_duration_seconds", "Query function time", labels=("query",)
+)
+
+CATEGORIES = ("need_home", "need_temp", "need_money", "need_other")
+
+PostPage = namedtuple("PostPage", ["post", "has_prev", "has_next"])
+SearchPage = namedtuple("SearchPage", ["posts", "has_prev", "has_next", "truncated"])
+
+# Text search configuration of posts.search_vector, see the migration
+SEARCH_CONFIG = "russian"
+SEARCH_CANDIDATES = 1000
+
+_dialect = get_dialect()
+_compiled_queries = dict()
 
-async def init_database(**pg_config):
+
+async def init_database(statement_timeout=None, **pg_config):
     # Async engine to execute clients requests
+    if statement_timeout:
+        # Milliseconds, libpq sets it for every connection of the pool
+        pg_config["options"] = f"-c statement_timeout={int(statement_timeout)}"
     engine = await create_pg_engine(**pg_config)
     return engine
 
 
-async def select_posts_with_filters(
-    conn: SAConn,
-    category=None,
-    pet_type=None,
-    location=None,
-    post_id=None,
-    direction=None,
+def _posts_with_filters_query(
+    category=None, pet_type=None, location=None, post_id=None, direction=None
 ):
-
     pet_type_alias = sa.alias(PetType, name="pet_type")
     location_alias = sa.alias(Location, name="location")
     j = join(Post, pet_type_alias, Post.pet_type_id == pet_type_alias.c.id).join(
@@ -42,10 +61,10 @@ async def select_posts_with_filters(
         location_alias.c.button_text.label("location_button_text"),
     ]
 
-    if pet_type:
+    if pet_type is not None:
         where_clauses &= pet_type_alias.c.id == pet_type
 
-    if location:
+    if location is not None:
         where_clauses &= location_alias.c.id == location
 
     if category == "need_home":
@@ -83,7 +102,7 @@ async def select_posts_with_filters(
 
     order_by = None
 
-    if post_id:
+    if post_id is not None:
         if direction:
             if direction == "<":
                 where_clauses &= Post.id < post_id
@@ -96,27 +115,435 @@ async def select_posts_with_filters(
 
     q = select(columns_to_select).select_from(j).where(where_clauses)
     q = q.order_by(order_by)
+    return q
+
+
+def _neighbor_exists(category, pet_type, location, direction):
+    """
+    EXISTS over the posts matching the same filters
+    on the given side of the outer query's post
+    """
+    if direction == "<":
+        neighbor = sa.alias(Post.__table__, name="prev_post")
+    else:
+        neighbor = sa.alias(Post.__table__, name="next_post")
+    c = neighbor.c
+
+    # Same rows as the inner joins of select_posts_with_filters give
+    where_clauses = c.visible == True
+    if pet_type is not None:
+        where_clauses &= c.pet_type_id == pet_type
+    else:
+        where_clauses &= c.pet_type_id != None
+
+    if location is not None:
+        where_clauses &= c.location_id == location
+    else:
+        where_clauses &= c.location_id != None
+
+    if category in CATEGORIES:
+        where_clauses &= c[category] != None
+        where_clauses &= c[category] != ""
+        where_clauses &= c[f"{category}_visible"] == True
+
+    if direction == "<":
+        where_clauses &= c.id < Post.id
+    else:
+        where_clauses &= c.id > Post.id
+
+    return sa.exists().where(where_clauses)
+
+
+def _bind_posts_query(
+    category=None,
+    pet_type=None,
+    location=None,
+    post_id=None,
+    direction=None,
+    page=False,
+):
+    """
+    Statement for this combination of filters is compiled once
+    with bind parameters in place of the values and cached,
+    so a call only builds the parameters dict.
+    Returns SQL string and parameters for it.
+    """
+    params = dict()
+    if pet_type:
+        params["pet_type"] = pet_type
+    if location:
+        params["location"] = location
+    if post_id and direction in ("<", ">"):
+        params["post_id"] = post_id
+
+    key = (
+        category if category in CATEGORIES else None,
+        "pet_type" in params,
+        "location" in params,
+        # post_id without direction gives unordered posts
+        bool(post_id),
+        direction if "post_id" in params else None,
+        page,
+    )
+
+    compiled = _compiled_queries.get(key)
+
+    if compiled is None:
+        category, has_pet_type, has_location, has_post_id, direction, page = key
+
+        filters = (
+            category,
+            sa.bindparam("pet_type") if has_pet_type else None,
+            sa.bindparam("location") if has_location else None,
+        )
+        post_id_param = sa.bindparam("post_id") if has_post_id else None
 
-    cursor = await conn.execute(q)
+        q = _posts_with_filters_query(*filters, post_id_param, direction)
+        if page:
+            q = q.column(_neighbor_exists(*filters, "<").label("has_prev"))
+            q = q.column(_neighbor_exists(*filters, ">").label("has_next"))
+            q = q.limit(1)
+
+        compiled = _compiled_queries[key] = q.compile(dialect=_dialect)
+
+    return compiled.string, compiled.construct_params(params)
+
+
+@timed(query_duration)
+async def select_posts_with_filters(
+    conn: SAConn,
+    category=None,
+    pet_type=None,
+    location=None,
+    post_id=None,
+    direction=None,
+):
+    q, params = _bind_posts_query(category, pet_type, location, post_id, direction)
+    cursor = await execute(conn, q, params)
     return cursor
 
 
+@timed(query_duration)
+async def select_post_page(
+    conn: SAConn,
+    category=None,
+    pet_type=None,
+    location=None,
+    post_id=None,
+    direction=None,
+):
+    """
+    First post of select_posts_with_filters together with has_prev/has_next
+    flags in a single round-trip.
+    If nothing is left in the direction (the post was hidden or filters
+    were changed) the first post without direction is returned.
+    Returns PostPage or None if no posts match the filters.
+    """
+    filters = (category, pet_type, location)
+
+    for _direction in (direction, None) if direction else (None,):
+        q, params = _bind_posts_query(
+            *filters, _direction and post_id, _direction, page=True
+        )
+        cursor = await execute(conn, q, params)
+        post = await cursor.fetchone()
+        if post:
+            return PostPage(post, post.has_prev, post.has_next)
+
+
+def _search_posts_query():
+    """
+    Visible posts matching the bound `text`, best ranked first, with
+    `limit` and `offset`. Compiled once, like _bind_posts_query.
+
+    Only the newest `candidates` matches are ranked: a common word
+    matches a good share of the catalog and ranking all of it costs
+    tens of milliseconds at 100k posts. Selective queries are served by
+    the GIN index, common words by the id index read backwards.
+    One more match is read, every row gets the number of matches read
+    so the caller knows when older ones were left out.
+    """
+    compiled = _compiled_queries.get("search")
+    if compiled is None:
+        tsquery = sa.func.plainto_tsquery(SEARCH_CONFIG, sa.bindparam("text"))
+        matches = (
+            select([Post.id, Post.search_vector])
+            .where((Post.visible == True) & Post.search_vector.op("@@")(tsquery))
+            .order_by(Post.id.desc())
+            .limit(sa.bindparam("candidates") + 1)
+            .alias("match")
+        )
+        candidates = select(
+            [
+                matches.c.id,
+                # Cover density, words close to each other rank higher
+                sa.func.ts_rank_cd(matches.c.search_vector, tsquery).label("rank"),
+                sa.func.row_number().over(order_by=matches.c.id.desc()).label("n"),
+                sa.func.count().over().label("matched"),
+            ]
+        ).alias("candidate")
+
+        pet_type_alias = sa.alias(PetType, name="pet_type")
+        location_alias = sa.alias(Location, name="location")
+        j = (
+            join(candidates, Post, Post.id == candidates.c.id)
+            .join(pet_type_alias, Post.pet_type_id == pet_type_alias.c.id)
+            .join(location_alias, Post.location_id == location_alias.c.id)
+        )
+
+        columns = [
+            Post.id,
+            Post.title,
+            pet_type_alias.c.emoji.label("pet_type_emoji"),
+            location_alias.c.button_text.label("location_button_text"),
+        ]
+        for category in CATEGORIES:
+            columns += [getattr(Post, category), getattr(Post, f"{category}_visible")]
+
+        q = (
+            select(columns + [candidates.c.rank, candidates.c.matched])
+            .select_from(j)
+            .where(candidates.c.n <= sa.bindparam("candidates"))
+            .order_by(candidates.c.rank.desc(), Post.id.desc())
+            .limit(sa.bindparam("limit"))
+            .offset(sa.bindparam("offset"))
+        )
+        compiled = _compiled_queries["search"] = q.compile(dialect=_dialect)
+    return compiled
+
+
+@timed(query_duration)
+async def search_posts(
+    conn: SAConn, text, offset=0, limit=5, candidates=SEARCH_CANDIDATES
+):
+    """
+    Full-text search over titles and visible need_* texts, served by
+    the GIN index on posts.search_vector. One page of the ranked
+    results is fetched with one more row to know if there is a next one.
+    SearchPage.truncated tells that more than `candidates` posts match
+    and only the newest of them are found.
+    Returns SearchPage or None on error.
+    """
+    compiled = _search_posts_query()
+    params = compiled.construct_params(
+        dict(text=text, limit=limit + 1, offset=offset, candidates=candidates)
+    )
+    try:
+        cursor = await execute(conn, compiled.string, params)
+        rows = await cursor.fetchall()
+        truncated = bool(rows) and rows[0].matched > candidates
+        return SearchPage(rows[:limit], offset > 0, len(rows) > limit, truncated)
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
+async def select_visible_posts(conn: SAConn, after_id=None, after_created_at=None):
+    """
+    Visible posts with everything the post view needs.
+    With after_id/after_created_at only posts added since then are selected.
+    """
+    pet_type_alias = sa.alias(PetType, name="pet_type")
+    location_alias = sa.alias(Location, name="location")
+    j = join(Post, pet_type_alias, Post.pet_type_id == pet_type_alias.c.id).join(
+        location_alias, Post.location_id == location_alias.c.id
+    )
+
+    where_clauses = Post.visible == True
+
+    if after_id is not None and after_created_at is not None:
+        where_clauses &= (Post.id > after_id) | (Post.created_at > after_created_at)
+    elif after_id is not None:
+        where_clauses &= Post.id > after_id
+
+    q = (
+        select(
+            [
+                Post.id,
+                Post.title,
+                Post.pet_type_id,
+                Post.location_id,
+                Post.created_at,
+                pet_type_alias.c.name.label("pet_type_name"),
+                pet_type_alias.c.emoji.label("pet_type_emoji"),
+                location_alias.c.name.label("location_name"),
+                location_alias.c.button_text.label("location_button_text"),
+                Post.need_home,
+                Post.need_home_visible,
+                Post.need_home_allow_other_location,
+                Post.need_temp,
+                Post.need_temp_visible,
+                Post.need_money,
+                Post.need_money_visible,
+                Post.need_other,
+                Post.need_other_visible,
+            ]
+        )
+        .select_from(j)
+        .where(where_clauses)
+        .order_by(Post.id.asc())
+    )
+
+    cursor = await execute(conn, q)
+    return await cursor.fetchall()
+
+
+@timed(query_duration)
+async def select_pet_types_posts_count(conn: SAConn):
+    """
+    Visible posts count for every pet type, in total and per category,
+    in one aggregated query. Returns dict by pet_type_id.
+    """
+    columns = [Post.pet_type_id, sa.func.count().label("posts")]
+    for category in CATEGORIES:
+        column = getattr(Post, category)
+        visible = getattr(Post, f"{category}_visible")
+        columns.append(
+            sa.func.count()
+            .filter((column != None) & (column != "") & (visible == True))
+            .label(category)
+        )
+
+    # Join with locations to count the same rows select_posts_with_filters gives
+    q = (
+        select(columns)
+        .select_from(join(Post, Location, Post.location_id == Location.id))
+        .where(Post.visible == True)
+        .group_by(Post.pet_type_id)
+    )
+    try:
+        cursor = await execute(conn, q)
+        return {i.pet_type_id: i for i in await cursor.fetchall()}
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
+async def select_posts_to_notify(conn: SAConn):
+    """Visible posts which are not broadcast yet, with their checkpoints"""
+    j = join(Post, PetType, Post.pet_type_id == PetType.id).join(
+        Location, Post.location_id == Location.id
+    )
+    q = (
+        select(
+            [
+                Post.id,
+                Post.title,
+                Post.notifications_last_user_id,
+                PetType.emoji.label("pet_type_emoji"),
+                Location.button_text.label("location_button_text"),
+            ]
+        )
+        .select_from(j)
+        .where((Post.visible == True) & (Post.notifications_complete.isnot(True)))
+        .order_by(Post.id.asc())
+    )
+    try:
+        cursor = await execute(conn, q)
+        return await cursor.fetchall()
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
+async def select_telegram_user_ids(conn: SAConn, after_id=None, limit=1000):
+    """
+    Next batch of users ordered by id.
+
+    Keyset pagination instead of a server-side cursor:
+    named cursors aren't available on async psycopg2 connections.
+    """
+    q = select([TelegramUser.id]).order_by(TelegramUser.id.asc()).limit(limit)
+    if after_id is not None:
+        q = q.where(TelegramUser.id > after_id)
+    try:
+        cursor = await execute(conn, q)
+        return [row[0] for row in await cursor.fetchall()]
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
+async def update_post_notifications(
+    conn: SAConn, post_id, last_user_id=None, complete=False
+):
+    values = {Post.notifications_last_user_id: last_user_id}
+    if complete:
+        values[Post.notifications_complete] = True
+    try:
+        await execute(conn, update(Post).values(values).where(Post.id == post_id))
+        return True
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
+async def try_advisory_lock(conn: SAConn, key):
+    """
+    True when the session-level lock is taken. It is held until
+    advisory_unlock() or until the connection is closed.
+    """
+    try:
+        cursor = await execute(conn, select([sa.func.pg_try_advisory_lock(key)]))
+        return (await cursor.fetchone())[0]
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
+async def advisory_unlock(conn: SAConn, key):
+    try:
+        cursor = await execute(conn, select([sa.func.pg_advisory_unlock(key)]))
+        return (await cursor.fetchone())[0]
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
 async def insert_telegram_user(conn: SAConn, **user_data):
+    """Returns id of the new user or None if the user already exists"""
     try:
-        await conn.execute(insert(TelegramUser).values(**user_data))
-        cursor = await conn.execute(
-            select([TelegramUser.id]).where(TelegramUser.id == user_data["id"])
+        cursor = await execute(
+            conn,
+            pg_insert(TelegramUser)
+            .values(**user_data)
+            .on_conflict_do_nothing(index_elements=[TelegramUser.id])
+            .returning(TelegramUser.id),
         )
         result = await cursor.fetchone()
-        return result[0]
+        return result[0] if result else None
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
+async def upsert_telegram_users(conn: SAConn, users):
+    """
+    Insert users or update profiles of the existing ones in one statement,
+    registration time and subscriptions are kept. Users must have the same
+    keys and unique ids. Returns ids of all the users.
+    """
+    q = pg_insert(TelegramUser).values(users)
+    q = q.on_conflict_do_update(
+        index_elements=[TelegramUser.id],
+        set_={
+            key: getattr(q.excluded, key)
+            for key in users[0]
+            if key not in ("id", "registered_at", "funny_photos_subscribed")
+        },
+    ).returning(TelegramUser.id)
+    try:
+        cursor = await execute(conn, q)
+        return [row[0] for row in await cursor.fetchall()]
     except Exception as ex:
         log.debug(ex)
 
 
+@timed(query_duration)
 async def select_random_funny_photo(conn: SAConn):
     try:
-        cursor = await conn.execute(
-            select([FunnyPhoto]).where(FunnyPhoto.approved == True).as_scalar()
+        cursor = await execute(
+            conn, select([FunnyPhoto]).where(FunnyPhoto.approved == True).as_scalar()
         )
         if cursor.rowcount == 0:
             return
@@ -126,57 +553,108 @@ async def select_random_funny_photo(conn: SAConn):
         log.debug(ex)
 
 
+@timed(query_duration)
+async def select_approved_funny_photo_ids(conn: SAConn):
+    try:
+        cursor = await execute(
+            conn, select([FunnyPhoto.id]).where(FunnyPhoto.approved == True)
+        )
+        return [row[0] for row in await cursor.fetchall()]
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
+async def select_funny_photo(conn: SAConn, photo_id):
+    """
+    The approved photo, False when there is no such photo
+    or it is not approved, None on error.
+    """
+    try:
+        cursor = await execute(
+            conn,
+            select([FunnyPhoto]).where(
+                (FunnyPhoto.id == photo_id) & (FunnyPhoto.approved == True)
+            ),
+        )
+        return await cursor.fetchone() or False
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
 async def insert_photo(conn: SAConn, filename, user_id, caption=None):
+    """Returns (id, approved) of the new photo"""
     try:
-        await conn.execute(
-            insert(FunnyPhoto).values(
-                {"filename": filename, "upload_by_id": user_id, "caption": caption}
-            )
+        cursor = await execute(
+            conn,
+            insert(FunnyPhoto)
+            .values({"filename": filename, "upload_by_id": user_id, "caption": caption})
+            .returning(FunnyPhoto.id, FunnyPhoto.approved),
         )
+        return await cursor.fetchone()
 
     except Exception as ex:
         log.debug(ex)
 
 
+@timed(query_duration)
+async def update_funny_photo_file_id(conn: SAConn, photo_id, file_id):
+    try:
+        await execute(
+            conn,
+            update(FunnyPhoto)
+            .values({FunnyPhoto.telegram_file_id: file_id})
+            .where(FunnyPhoto.id == photo_id),
+        )
+    except Exception as ex:
+        log.debug(ex)
+
+
+@timed(query_duration)
 async def select_all_locations(conn: SAConn):
     try:
-        cursor = await conn.execute(select([Location]))
+        cursor = await execute(conn, select([Location]))
         result = await cursor.fetchall()
         return result
     except Exception as ex:
         log.debug(ex)
 
 
+@timed(query_duration)
 async def select_all_pet_types(conn: SAConn):
     try:
-        cursor = await conn.execute(select([PetType]))
+        cursor = await execute(conn, select([PetType]))
         result = await cursor.fetchall()
         return result
     except Exception as ex:
         log.debug(ex)
 
 
+@timed(query_duration)
 async def select_all_bot_texts(conn: SAConn):
     try:
-        cursor = await conn.execute(select([BotText]))
+        cursor = await execute(conn, select([BotText]))
         result = await cursor.fetchall()
         return result
     except Exception as ex:
         log.debug(ex)
 
 
+@timed(query_duration)
 async def select_all_telegram_users(conn: SAConn):
     try:
-        cursor = await conn.execute(select([TelegramUser]))
+        cursor = await execute(conn, select([TelegramUser]))
         return cursor
     except Exception as ex:
         log.debug(ex)
 
 
+@timed(query_duration)
 async def select_telegram_user(conn: SAConn, user_id):
     try:
-        cursor = await conn.execute(
-            select([TelegramUser]).where(TelegramUser.id == user_id)
+        cursor = await execute(
+            conn, select([TelegramUser]).where(TelegramUser.id == user_id)
         )
         result = await cursor.fetchone()
         return result
@@ -184,7 +662,8 @@ async def select_telegram_user(conn: SAConn, user_id):
         log.debug(ex)
 
 
+@timed(query_duration)
 async def update_telegram_user(conn, user_id, **values):
-    await conn.execute(
-        update(TelegramUser).values(**values).where(TelegramUser.id == user_id)
+    await execute(
+        conn, update(TelegramUser).values(**values).where(TelegramUser.id == user_id)
     )
@@ -0,0 +1,148 @@
+import asyncio
+import re
+import time
+
+from src.utils import get_logger
+
+log = get_logger("QueryLog")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_ROWS = re.compile(r"(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """Statement with literals replaced by ?, so calls group by their shape"""
+    if isinstance(statement, bytes):
+        statement = statement.decode(errors="replace")
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _LIST.sub("(...)", statement)
+    statement = _ROWS.sub(r"\1", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+class _Stats:
+    __slots__ = ("calls", "total", "max", "rows", "slowest")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slowest = None
+
+    def add(self, other):
+        self.calls += other.calls
+        self.total += other.total
+        self.rows += other.rows
+        if other.max >= self.max:
+            self.max = other.max
+            self.slowest = other.slowest
+
+
+class QueryLog:
+    """
+    Durations of executed statements grouped by fingerprint.
+
+    Statements slower than `threshold` seconds are logged with their
+    parameters. Stats are kept for the current and the previous
+    `window` seconds, so top() covers a rolling period of 1-2 windows.
+    """
+
+    def __init__(self, threshold=0.5, window=600, max_fingerprints=1000):
+        self.threshold = threshold
+        self.window = window
+        self.max_fingerprints = max_fingerprints
+
+        self._current = dict()
+        self._previous = dict()
+        self._window_started = time.monotonic()
+
+    def configure(self, threshold=None, window=None):
+        if threshold is not None:
+            self.threshold = threshold
+        if window is not None:
+            self.window = window
+
+    def _rotate(self, now):
+        if now - self._window_started >= self.window:
+            self._previous = self._current
+            self._current = dict()
+            self._window_started = now
+
+    def record(self, statement, duration, rowcount):
+        self._rotate(time.monotonic())
+
+        if isinstance(statement, bytes):
+            statement = statement.decode(errors="replace")
+        key = fingerprint(statement)
+
+        stats = self._current.get(key)
+        if stats is None:
+            if len(self._current) >= self.max_fingerprints:
+                return
+            stats = self._current[key] = _Stats()
+        stats.calls += 1
+        stats.total += duration
+        stats.rows += max(rowcount, 0)
+        if duration >= stats.max:
+            stats.max = duration
+            stats.slowest = statement
+
+        if duration >= self.threshold:
+            log.warning(
+                f"Slow query {duration * 1000:.0f} ms, {rowcount} rows: {statement}"
+            )
+
+    def top(self, n=10, by="max"):
+        """Slowest fingerprints as (fingerprint, calls, total, max, rows, slowest)"""
+        merged = dict()
+        for stats in (self._previous, self._current):
+            for key, value in stats.items():
+                merged.setdefault(key, _Stats()).add(value)
+
+        ordered = sorted(merged.items(), key=lambda i: getattr(i[1], by), reverse=True)
+        return [
+            (key, s.calls, s.total, s.max, s.rows, s.slowest) for key, s in ordered[:n]
+        ]
+
+    def reset(self):
+        self._current = dict()
+        self._previous = dict()
+
+
+query_log = QueryLog()
+
+
+class QueryCancelled(Exception):
+    """Statement cancelled by the server, e.g. by statement_timeout"""
+
+
+async def execute(conn, query, *multiparams, **params):
+    """SAConnection.execute, recorded to query_log"""
+    started = time.perf_counter()
+    try:
+        result = await conn.execute(query, *multiparams, **params)
+    except asyncio.CancelledError:
+        # aiopg raises CancelledError for statements cancelled by the server,
+        # a cancelled task closes the connection, a cancelled statement doesn't
+        if conn.closed:
+            raise
+        duration = time.perf_counter() - started
+        log.warning(f"Query cancelled after {duration * 1000:.0f} ms: {query}")
+        raise QueryCancelled(str(query)) from None
+    except Exception as ex:
+        duration = time.perf_counter() - started
+        log.warning(f"Query failed after {duration * 1000:.0f} ms: {ex!r} {query}")
+        raise
+    duration = time.perf_counter() - started
+
+    # psycopg2 keeps the last statement with parameters bound,
+    # aiopg exposes the cursor only as a private attribute
+    cursor = getattr(result, "_cursor", None)
+    statement = getattr(cursor, "query", None) or str(query)
+    query_log.record(statement, duration, result.rowcount)
+    return result
@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+
+from src.db.queries import upsert_telegram_users
+from src.utils import get_logger
+
+log = get_logger("RegistrationQueue")
+
+USER_FIELDS = (
+    "id",
+    "username",
+    "first_name",
+    "last_name",
+    "language_code",
+    "version",
+    "registered_at",
+)
+
+
+def registration_row(user_data):
+    """telegram_users row of a telegram user dict"""
+    user = {field: user_data.get(field) for field in USER_FIELDS}
+    if not user["registered_at"]:
+        user["registered_at"] = datetime.datetime.utcnow()
+    return user
+
+
+class RegistrationQueue:
+    """
+    Write-behind queue of telegram users to register.
+
+    Handlers put users without waiting for Postgres, run() upserts
+    them in batches, one statement per batch. The queue is bounded:
+    add() waits only when max_size users are already pending.
+    close() waits for the flush in progress, stops run() and flushes
+    everything left.
+    """
+
+    def __init__(
+        self,
+        engine,
+        max_size=10000,
+        batch_size=500,
+        flush_interval=1.0,
+        close_retries=3,
+    ):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.close_retries = close_retries
+
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self._failed = dict()
+        self._closed = False
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return self._queue.qsize() + len(self._failed)
+
+    async def add(self, user_data):
+        await self._queue.put(registration_row(user_data))
+
+    def _next_batch(self):
+        # Same user twice in one statement is an error for ON CONFLICT DO UPDATE
+        batch = self._failed
+        self._failed = dict()
+        while len(batch) < self.batch_size and not self._queue.empty():
+            user = self._queue.get_nowait()
+            batch[user["id"]] = user
+        return batch
+
+    async def flush(self):
+        """Upsert pending users, returns how many were written"""
+        written = 0
+        batch = self._next_batch()
+        while batch:
+            async with self.engine.acquire() as conn:
+                ids = await upsert_telegram_users(conn, list(batch.values()))
+            if ids is None:
+                # Retried with the next flush
+                self._failed = batch
+                log.warning(f"{len(batch)} registrations are not written yet")
+                break
+            written += len(ids)
+            batch = self._next_batch()
+        return written
+
+    async def run(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._closed:
+                break
+            try:
+                await self.flush()
+            except Exception as ex:
+                log.exception(ex)
+
+    def start(self):
+        self._task = asyncio.get_event_loop().create_task(self.run())
+
+    async def close(self):
+        """Stops run() and writes what is left, retrying a failed flush"""
+        self._closed = True
+        self._wake.set()
+        if self._task is not None:
+            # A flush in progress is finished, not cancelled with its batch
+            await self._task
+        for attempt in range(self.close_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as ex:
+                log.exception(ex)
+            if not len(self):
+                return
+        log.error(f"{len(self)} registrations are lost on close")
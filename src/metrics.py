@@ -0,0 +1,168 @@
+"""
+Minimal metrics in Prometheus text format.
+
+Metrics are plain dicts changed only from the event loop thread,
+so updates need no locks: a counter increment is one dict operation,
+a histogram observation is a bisect and a few increments.
+"""
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = dict()
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = dict()
+        if registry is not None:
+            registry.register(self)
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, value=1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+
+class Gauge(_Metric):
+    """Set directly or read from a callback when rendered"""
+
+    type = "gauge"
+
+    def __init__(self, *args, callback=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.callback = callback
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        values = self._values
+        if self.callback:
+            values = {(): self.callback(), **values}
+        for labels, value in values.items():
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            # Counts per bucket, the last one is +Inf, then sum
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels):
+        series = self._values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def samples(self):
+        for labels, series in self._values.items():
+            cumulative = 0
+            for le, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                le_label = _labels(self.labels, labels, [("le", le)])
+                yield f"{self.name}_bucket{le_label} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+def timed(histogram: Histogram):
+    """Observes duration of every call of an async function, by its name"""
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, func.__name__)
+
+        return wrapper
+
+    return decorator
+
+
+def make_metrics_app(registry=REGISTRY):
+    async def metrics_handler(request):
+        return web.Response(
+            text=registry.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    return app
+
+
+async def start_metrics_server(host, port, registry=REGISTRY):
+    """Serves /metrics in the running loop, returns runner to cleanup()"""
+    runner = web.AppRunner(make_metrics_app(registry))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,48 @@
+import aiohttp
+from aiogram import Bot
+from aiogram.bot import api
+from aiogram.utils import exceptions
+
+
+class ApiUrlBot(Bot):
+    """
+    Bot which sends requests to the given Bot API server
+    instead of api.telegram.org, for example to a stub in tests.
+    """
+
+    def __init__(self, token, *args, api_url=None, **kwargs):
+        super().__init__(token, *args, **kwargs)
+        self.api_url = api_url.rstrip("/") if api_url else None
+        self._method_url = f"{self.api_url}/bot{token}/{{method}}"
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if not self.api_url:
+            return await super().request(method, data, files, **kwargs)
+
+        # Same as aiogram.bot.api.make_request, but with our url
+        url = self._method_url.format(method=method)
+        req = api.compose_data(data, files)
+        if hasattr(self, "get_session"):
+            # Newer aiogram creates the session lazily
+            session = await self.get_session()
+        else:
+            session = self.session
+        try:
+            async with session.post(
+                url,
+                data=req,
+                proxy=self.proxy,
+                proxy_auth=self.proxy_auth,
+                timeout=self.timeout,
+                **kwargs,
+            ) as response:
+                return api.check_result(
+                    method,
+                    response.content_type,
+                    response.status,
+                    await response.text(),
+                )
+        except aiohttp.ClientError as e:
+            raise exceptions.NetworkError(
+                f"aiohttp client throws an error: {e.__class__.__name__}: {e}"
+            )
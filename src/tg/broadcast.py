@@ -0,0 +1,156 @@
+import asyncio
+
+from aiogram import Bot
+from aiogram.utils.exceptions import (
+    RetryAfter,
+    BotBlocked,
+    UserDeactivated,
+    ChatNotFound,
+)
+
+from src.db.queries import (
+    advisory_unlock,
+    try_advisory_lock,
+    select_telegram_user_ids,
+    select_posts_to_notify,
+    update_post_notifications,
+)
+from src.tg.ratelimit import TokenBucket, ChatRateLimiter
+from src.utils import get_logger
+
+log = get_logger("broadcast")
+
+# Advisory lock id of notify_posts, shared by every bot process
+NOTIFY_POSTS_LOCK = 0x7A7665
+
+
+class Broadcaster:
+    """
+    Sends one message to every telegram user.
+
+    Recipients are read from the database in batches ordered by id and
+    go through a bounded pool of workers. Every send takes a token from
+    the global bucket (Telegram allows ~30 msg/s) and from the per-chat
+    limiter (1 msg/s), so 100k users take about 100000 / rate seconds.
+    RetryAfter pauses the global bucket, so all workers wait together.
+
+    After every batch the last user id is reported to on_checkpoint,
+    a restarted broadcast resumes from it, at most one batch is resent.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        engine,
+        rate=30,
+        chat_interval=1.0,
+        workers=10,
+        batch_size=1000,
+        limiter: TokenBucket = None,
+    ):
+        self.bot = bot
+        self.engine = engine
+        # Shared with the outbox, so both stay within one global rate
+        self.limiter = limiter or TokenBucket(rate)
+        self.chat_limiter = ChatRateLimiter(chat_interval)
+        self.workers = workers
+        self.batch_size = batch_size
+
+    async def _send(self, chat_id, text):
+        while True:
+            await self.chat_limiter.acquire(chat_id)
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as ex:
+                log.warning(f"Flood control, broadcast paused for {ex.timeout}s")
+                self.limiter.pause(ex.timeout)
+            except (BotBlocked, UserDeactivated, ChatNotFound):
+                return False
+            except Exception as ex:
+                log.debug(ex)
+                return False
+
+    async def broadcast(self, text, after_id=None, on_checkpoint=None):
+        """
+        Returns (sent, failed) counts,
+        or None if recipients couldn't be read and the broadcast stopped.
+        """
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        counts = [0, 0]
+
+        async def _worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    counts[0 if await self._send(chat_id, text) else 1] += 1
+                finally:
+                    queue.task_done()
+
+        workers = [
+            asyncio.get_event_loop().create_task(_worker()) for _ in range(self.workers)
+        ]
+        try:
+            while True:
+                async with self.engine.acquire() as conn:
+                    batch = await select_telegram_user_ids(
+                        conn, after_id=after_id, limit=self.batch_size
+                    )
+                if batch is None:
+                    return
+                if not batch:
+                    return tuple(counts)
+
+                for chat_id in batch:
+                    await queue.put(chat_id)
+                await queue.join()
+
+                after_id = batch[-1]
+                if on_checkpoint:
+                    await on_checkpoint(after_id)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def notify_posts(self, template):
+        """
+        Broadcast every new visible post and mark it notifications_complete.
+
+        Only one process broadcasts at a time: the others skip the round
+        while the advisory lock is held, so with several workers users get
+        every post once. The lock connection is kept out of the pool until
+        the broadcast ends, a lost connection releases the lock.
+        """
+        async with self.engine.acquire() as lock_conn:
+            if not await try_advisory_lock(lock_conn, NOTIFY_POSTS_LOCK):
+                return
+            try:
+                await self._notify_posts(template)
+            finally:
+                await advisory_unlock(lock_conn, NOTIFY_POSTS_LOCK)
+
+    async def _notify_posts(self, template):
+        async with self.engine.acquire() as conn:
+            posts = await select_posts_to_notify(conn)
+
+        for post in posts or []:
+
+            async def _checkpoint(last_user_id, post_id=post.id):
+                async with self.engine.acquire() as conn:
+                    await update_post_notifications(conn, post_id, last_user_id)
+
+            text = template.format(
+                post.pet_type_emoji, post.title, post.location_button_text
+            )
+            result = await self.broadcast(
+                text,
+                after_id=post.notifications_last_user_id,
+                on_checkpoint=_checkpoint,
+            )
+            if result is None:
+                return
+
+            async with self.engine.acquire() as conn:
+                await update_post_notifications(conn, post.id, complete=True)
+            log.info(f"Post {post.id} broadcast: {result[0]} sent, {result[1]} failed")
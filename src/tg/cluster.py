@@ -0,0 +1,241 @@
+"""
+Multi-process mode.
+
+The front end receives webhook updates from Telegram and forwards them
+to WORKERS worker processes, every one a complete bot listening on
+worker_base_port + i. Updates are sharded by user id, so a user is
+always served by the same worker and gets answers in order. Workers are
+restarted when they exit. Static data is kept in sync between workers
+by the RefreshChannel.
+"""
+import asyncio
+import hmac
+import signal
+import sys
+
+import aiohttp
+from aiohttp import web
+
+from src.metrics import Counter, Gauge, start_metrics_server
+from src.tg.bot_api import ApiUrlBot
+from src.tg.webhook import SECRET_TOKEN_HEADER, set_webhook, user_id_of
+from src.utils import get_logger
+
+log = get_logger("cluster")
+
+WORKER_PATH = "/update"
+
+forwarded_updates = Counter(
+    "zverobot_cluster_forwarded_total", "Updates forwarded", labels=("worker",)
+)
+forward_errors = Counter(
+    "zverobot_cluster_forward_errors_total",
+    "Failed attempts to forward an update",
+    labels=("worker",),
+)
+worker_restarts = Counter(
+    "zverobot_cluster_worker_restarts_total", "Workers restarted", labels=("worker",)
+)
+pending_updates = Gauge(
+    "zverobot_cluster_pending_updates", "Updates waiting to be forwarded"
+)
+
+
+def shard_of(data: dict, shards):
+    """Worker of a raw update, updates without a user are spread by their id"""
+    user_id = user_id_of(data)
+    key = user_id if user_id is not None else data.get("update_id", 0)
+    return key % shards
+
+
+class ShardRouter:
+    """
+    Forwards raw updates to worker urls, one queue per worker.
+
+    A worker gets its updates one by one in the arrival order. A failed
+    delivery (the worker is restarting) is retried and holds back the
+    rest of its queue, so the order is never broken.
+    """
+
+    def __init__(self, urls, queue_size=10000, retry_interval=0.5, timeout=10):
+        self.urls = urls
+        self.queues = [asyncio.Queue(maxsize=queue_size) for _ in urls]
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self._session = None
+        self._tasks = []
+
+        pending_updates.callback = lambda: sum(q.qsize() for q in self.queues)
+
+    def route(self, data: dict):
+        """False when the worker queue is full"""
+        try:
+            self.queues[shard_of(data, len(self.urls))].put_nowait(data)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def start(self):
+        self._session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        loop = asyncio.get_event_loop()
+        self._tasks = [
+            loop.create_task(self._forward(i)) for i in range(len(self.urls))
+        ]
+
+    async def _forward(self, i):
+        queue, url = self.queues[i], self.urls[i]
+        while True:
+            data = await queue.get()
+            while True:
+                try:
+                    async with self._session.post(url, json=data) as resp:
+                        if resp.status < 500:
+                            break
+                        log.warning(f"Worker {i} answered {resp.status}")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                    log.warning(f"Worker {i} unavailable: {ex!r}")
+                forward_errors.inc(str(i))
+                await asyncio.sleep(self.retry_interval)
+            if resp.status != 200:
+                log.error(f"Worker {i} rejected update {data.get('update_id')}")
+            forwarded_updates.inc(str(i))
+            queue.task_done()
+
+    async def close(self, timeout=10):
+        """Waits for queued updates to be delivered"""
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*[q.join() for q in self.queues]), timeout
+            )
+        except asyncio.TimeoutError:
+            log.warning("Queued updates were dropped on close")
+        for task in self._tasks:
+            task.cancel()
+        await self._session.close()
+
+
+def make_front_app(
+    router: ShardRouter, path, secret_token=None, max_body_size=1024**2
+):
+    """aiohttp app receiving updates from Telegram and routing them to workers"""
+    app = web.Application(client_max_size=max_body_size)
+
+    async def webhook_handler(request: web.Request):
+        if secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_TOKEN_HEADER, ""), secret_token
+        ):
+            raise web.HTTPForbidden()
+
+        try:
+            data = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest()
+        if not isinstance(data, dict):
+            raise web.HTTPBadRequest()
+
+        if not router.route(data):
+            # Telegram sends it again later
+            raise web.HTTPServiceUnavailable()
+        return web.Response()
+
+    app.router.add_post(path, webhook_handler)
+    return app
+
+
+class WorkerSupervisor:
+    """Keeps a process running for every command, restarting the exited ones"""
+
+    def __init__(self, commands, restart_interval=1):
+        self.commands = commands
+        self.restart_interval = restart_interval
+        self.processes = [None] * len(commands)
+        self._tasks = []
+        self._stopping = False
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        self._tasks = [
+            loop.create_task(self._supervise(i)) for i in range(len(self.commands))
+        ]
+
+    async def _supervise(self, i):
+        while not self._stopping:
+            self.processes[i] = await asyncio.create_subprocess_exec(*self.commands[i])
+            log.info(f"Worker {i} started, pid {self.processes[i].pid}")
+            code = await self.processes[i].wait()
+            if self._stopping:
+                break
+            log.error(f"Worker {i} exited with {code}, restarting")
+            worker_restarts.inc(str(i))
+            await asyncio.sleep(self.restart_interval)
+
+    async def stop(self, timeout=30):
+        """SIGTERM to every worker, SIGKILL to the ones still running after timeout"""
+        self._stopping = True
+        running = [p for p in self.processes if p and p.returncode is None]
+        for p in running:
+            p.send_signal(signal.SIGTERM)
+        if running:
+            await asyncio.wait(
+                [asyncio.ensure_future(p.wait()) for p in running], timeout=timeout
+            )
+            for p in running:
+                if p.returncode is None:
+                    p.kill()
+        for task in self._tasks:
+            task.cancel()
+
+
+def worker_command(index):
+    return [sys.executable, "-m", "src.worker", str(index)]
+
+
+def run_cluster(config):
+    """Runs the front end in this process and config.workers workers"""
+    if not config.webhook_url:
+        raise RuntimeError("WORKERS > 1 needs the webhook, set WEBHOOK_URL")
+
+    urls = [
+        f"http://{config.worker_host}:{config.worker_base_port + i}{WORKER_PATH}"
+        for i in range(config.workers)
+    ]
+    router = ShardRouter(urls, queue_size=config.worker_queue_size)
+    supervisor = WorkerSupervisor([worker_command(i) for i in range(config.workers)])
+    app = make_front_app(
+        router,
+        path=config.webhook_path,
+        secret_token=config.webhook_secret_token,
+        max_body_size=config.webhook_max_body_size,
+    )
+
+    async def _on_startup(app):
+        if config.metrics_enabled:
+            app["metrics_runner"] = await start_metrics_server(
+                config.metrics_host, config.metrics_port
+            )
+        bot = ApiUrlBot(config.token, api_url=config.bot_api_url)
+        try:
+            await set_webhook(
+                bot,
+                f"{config.webhook_url}{config.webhook_path}",
+                secret_token=config.webhook_secret_token,
+            )
+        finally:
+            await bot.close()
+        # Updates are queued until workers are up
+        supervisor.start()
+        router.start()
+
+    async def _on_shutdown(app):
+        # Telegram keeps the updates not answered yet
+        await router.close()
+        await supervisor.stop()
+        if app.get("metrics_runner"):
+            await app["metrics_runner"].cleanup()
+
+    app.on_startup.append(_on_startup)
+    app.on_shutdown.append(_on_shutdown)
+
+    web.run_app(app, host=config.webhook_host, port=config.webhook_port)
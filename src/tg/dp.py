@@ -1,12 +1,30 @@
 from aiogram.dispatcher import Dispatcher
-from aiogram.contrib.fsm_storage.redis import RedisStorage2
 
+from src.tg.fsm_storage import CompactRedisStorage, StateSessionMiddleware
+from src.tg.metrics import MetricsMiddleware
+from src.tg.recorder import UpdateRecorder
+from src.tg.startup import StartupGateMiddleware
 from src.tg.zverobot import ZveroBot
 from src.config import Config
+from src.utils import default_user_data
 
 cfg = Config()
 cfg.with_env()
 
-storage = RedisStorage2(host="redis-local")
+storage = CompactRedisStorage(
+    host=cfg.redis_host,
+    port=cfg.redis_port,
+    db=cfg.redis_db,
+    password=cfg.redis_password,
+    pool_size=cfg.redis_pool_size,
+    fields=default_user_data,
+    ttl=cfg.fsm_ttl,
+)
 bot = ZveroBot(cfg)
 dp = Dispatcher(bot, storage=storage)
+if cfg.record_updates_path:
+    # Before the gate, so updates are recorded at their arrival
+    dp.middleware.setup(UpdateRecorder(cfg.record_updates_path))
+dp.middleware.setup(StartupGateMiddleware(bot))
+dp.middleware.setup(StateSessionMiddleware(storage))
+dp.middleware.setup(MetricsMiddleware())
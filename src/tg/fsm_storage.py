@@ -0,0 +1,320 @@
+import json
+from contextvars import ContextVar
+
+import aioredis
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.storage import BaseStorage
+
+STATE_KEY = "state"
+STATE_DATA_KEY = "data"
+
+_session = ContextVar("fsm_session", default=None)
+
+
+class RedisBackend:
+    """
+    Runs a batch of commands in one pipelined round-trip.
+
+    Commands are ("get", key), ("set", key, value, ttl), ("expire", key, ttl)
+    and ("delete", key), results come back in the same order.
+    """
+
+    def __init__(
+        self, host="localhost", port=6379, db=None, password=None, pool_size=10
+    ):
+        self._address = (host, port)
+        self._db = db
+        self._password = password
+        self._pool_size = pool_size
+        self._redis = None
+
+    async def redis(self):
+        if self._redis is None:
+            self._redis = await aioredis.create_redis_pool(
+                self._address,
+                db=self._db,
+                password=self._password,
+                maxsize=self._pool_size,
+                encoding="utf8",
+            )
+        return self._redis
+
+    async def warm_up(self):
+        redis = await self.redis()
+        await redis.ping()
+
+    async def execute(self, commands):
+        redis = await self.redis()
+        pipe = redis.pipeline()
+        for command, key, *args in commands:
+            if command == "get":
+                pipe.get(key)
+            elif command == "set":
+                value, ttl = args
+                pipe.set(key, value, expire=ttl or 0)
+            elif command == "expire":
+                pipe.expire(key, args[0])
+            else:
+                pipe.delete(key)
+        return await pipe.execute()
+
+    async def close(self):
+        if self._redis is not None:
+            self._redis.close()
+
+    async def wait_closed(self):
+        if self._redis is not None:
+            await self._redis.wait_closed()
+            self._redis = None
+
+
+class _Record:
+    __slots__ = ("state", "data", "state_changed", "data_changed", "legacy")
+
+    def __init__(self, state, data):
+        self.state = state
+        self.data = data
+        self.state_changed = False
+        self.data_changed = False
+        self.legacy = False
+
+    @property
+    def changed(self):
+        return self.state_changed or self.data_changed
+
+
+class BatchedRedisStorage(BaseStorage):
+    """
+    FSM storage with a per-update session.
+
+    Within a session (see StateSessionMiddleware) state and data of a user
+    are loaded together on the first access, handlers read and change the
+    loaded copy, and all the changes go to Redis in one pipeline when the
+    update is processed. So an update costs at most 2 Redis round-trips.
+
+    Outside of a session every call goes to Redis at once.
+    Keys are the same as in RedisStorage2.
+    """
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=None,
+        password=None,
+        pool_size=10,
+        prefix="fsm",
+        state_ttl=None,
+        data_ttl=None,
+        backend=None,
+    ):
+        self.backend = backend or RedisBackend(host, port, db, password, pool_size)
+        self._prefix = prefix
+        self._state_ttl = state_ttl
+        self._data_ttl = data_ttl
+
+    def generate_key(self, *parts):
+        return ":".join((self._prefix, *map(str, parts)))
+
+    async def warm_up(self):
+        """Opens the connection pool before the first update"""
+        await self.backend.warm_up()
+
+    async def close(self):
+        await self.backend.close()
+
+    async def wait_closed(self):
+        await self.backend.wait_closed()
+
+    @staticmethod
+    def begin():
+        """Start a session in the current context"""
+        _session.set(dict())
+
+    async def commit(self):
+        """Write all the session changes in one pipeline and end the session"""
+        session = _session.get()
+        _session.set(None)
+        if not session:
+            return
+
+        commands = []
+        for (chat, user), record in session.items():
+            commands.extend(self._write_commands(chat, user, record))
+        if commands:
+            await self.backend.execute(commands)
+
+    def _write_commands(self, chat, user, record):
+        if record.state_changed:
+            key = self.generate_key(chat, user, STATE_KEY)
+            if record.state is None:
+                yield "delete", key
+            else:
+                yield "set", key, record.state, self._state_ttl
+        if record.data_changed:
+            key = self.generate_key(chat, user, STATE_DATA_KEY)
+            if record.data:
+                yield "set", key, self.encode(record.data), self._data_ttl
+            else:
+                yield "delete", key
+
+    def encode(self, data):
+        return json.dumps(data)
+
+    def decode(self, raw):
+        return json.loads(raw) if raw else {}
+
+    def _read_commands(self, chat, user):
+        return [
+            ("get", self.generate_key(chat, user, STATE_KEY)),
+            ("get", self.generate_key(chat, user, STATE_DATA_KEY)),
+        ]
+
+    def _read_record(self, results):
+        state, raw_data = results
+        return _Record(state, self.decode(raw_data))
+
+    async def _record(self, chat, user):
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        session = _session.get()
+        record = session.get((chat, user)) if session is not None else None
+        if record is None:
+            results = await self.backend.execute(self._read_commands(chat, user))
+            record = self._read_record(results)
+            if session is not None:
+                session[(chat, user)] = record
+        return chat, user, record, session is not None
+
+    async def _save(self, chat, user, record, in_session):
+        if not in_session:
+            commands = list(self._write_commands(chat, user, record))
+            if commands:
+                await self.backend.execute(commands)
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        _, _, record, _ = await self._record(chat, user)
+        return record.state or self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        _, _, record, _ = await self._record(chat, user)
+        return dict(record.data) or default or {}
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        chat, user, record, in_session = await self._record(chat, user)
+        record.state = None if state is None else self.resolve_state(state)
+        record.state_changed = True
+        await self._save(chat, user, record, in_session)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        chat, user, record, in_session = await self._record(chat, user)
+        record.data = dict(data or {})
+        record.data_changed = True
+        await self._save(chat, user, record, in_session)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        chat, user, record, in_session = await self._record(chat, user)
+        record.data.update(data or {}, **kwargs)
+        record.data_changed = True
+        await self._save(chat, user, record, in_session)
+
+
+class CompactCodec:
+    """
+    State and data of a user packed into one short JSON array:
+
+        [state, fields mask, *values of the present fields, {other keys}]
+
+    Fields of the fixed schema are stored by position, so a default
+    session takes ~60 bytes instead of ~170 bytes of a JSON dict
+    plus a separate state key.
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+
+    def encode(self, state, data):
+        mask = 0
+        values = []
+        for i, field in enumerate(self.fields):
+            if field in data:
+                mask |= 1 << i
+                values.append(data[field])
+
+        packed = [state, mask, *values]
+        extra = {k: v for k, v in data.items() if k not in self.fields}
+        if extra:
+            packed.append(extra)
+        return json.dumps(packed, separators=(",", ":"))
+
+    def decode(self, raw):
+        """Returns (state, data)"""
+        state, mask, *values = json.loads(raw)
+        data = dict()
+        values = iter(values)
+        for i, field in enumerate(self.fields):
+            if mask & (1 << i):
+                data[field] = next(values)
+        data.update(next(values, {}))
+        return state, data
+
+
+class CompactRedisStorage(BatchedRedisStorage):
+    """
+    BatchedRedisStorage keeping a user in one key encoded by CompactCodec.
+
+    The key expires after `ttl` seconds without updates from the user,
+    every processed update of the user prolongs it.
+    Users stored by RedisStorage2 are read from the old keys
+    and moved to the compact key on the next write.
+    """
+
+    def __init__(self, *args, fields=(), ttl=None, **kwargs):
+        super().__init__(*args, state_ttl=ttl, data_ttl=ttl, **kwargs)
+        self.codec = CompactCodec(fields)
+        self.ttl = ttl
+
+    def _read_commands(self, chat, user):
+        return [("get", self.generate_key(chat, user))] + super()._read_commands(
+            chat, user
+        )
+
+    def _read_record(self, results):
+        packed, *legacy = results
+        if packed:
+            return _Record(*self.codec.decode(packed))
+
+        record = super()._read_record(legacy)
+        if record.state or record.data:
+            record.state_changed = record.data_changed = record.legacy = True
+        return record
+
+    def _write_commands(self, chat, user, record):
+        key = self.generate_key(chat, user)
+        if not record.changed:
+            if self.ttl:
+                yield "expire", key, self.ttl
+            return
+
+        if record.state is None and not record.data:
+            yield "delete", key
+        else:
+            yield "set", key, self.codec.encode(record.state, record.data), self.ttl
+        if record.legacy:
+            yield "delete", self.generate_key(chat, user, STATE_KEY)
+            yield "delete", self.generate_key(chat, user, STATE_DATA_KEY)
+            record.legacy = False
+
+
+class StateSessionMiddleware(BaseMiddleware):
+    """Wraps processing of every update into a BatchedRedisStorage session"""
+
+    def __init__(self, storage: BatchedRedisStorage):
+        super().__init__()
+        self.storage = storage
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        self.storage.begin()
+
+    async def on_post_process_update(self, update: types.Update, result, data: dict):
+        await self.storage.commit()
@@ -0,0 +1,54 @@
+import asyncio
+import io
+
+from aiogram import Bot, types
+from aiogram.utils.exceptions import BadRequest
+
+from src.db.queries import update_funny_photo_file_id
+from src.utils import get_logger
+
+log = get_logger("funny_photos")
+
+
+class FunnyPhotoFiles:
+    """
+    Telegram file_id of every funny photo sent at least once.
+
+    A photo is uploaded from static/images only on the first send,
+    then Telegram's file_id is kept here and in funny_photos.telegram_file_id.
+    Files are read in the default executor, off the event loop.
+    """
+
+    def __init__(self, images_dir):
+        self.images_dir = images_dir
+        self._file_ids = dict()
+
+    def file_id(self, photo):
+        return self._file_ids.get(photo.id) or photo.telegram_file_id
+
+    def _read(self, photo):
+        with open(f"{self.images_dir}/{photo.filename}.png", "rb") as f:
+            return f.read()
+
+    async def send(self, bot: Bot, conn, chat_id, photo, **kwargs):
+        file_id = self.file_id(photo)
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            except BadRequest as ex:
+                # file_id of another bot token or expired, upload again
+                log.warning(f"Funny photo {photo.id} file_id rejected: {ex}")
+                self._file_ids.pop(photo.id, None)
+
+        data = await asyncio.get_event_loop().run_in_executor(None, self._read, photo)
+        msg = await bot.send_photo(
+            chat_id=chat_id,
+            photo=types.InputFile(io.BytesIO(data), filename=f"{photo.filename}.png"),
+            **kwargs,
+        )
+
+        # The largest size is the original photo
+        file_id = msg.photo[-1].file_id
+        self._file_ids[photo.id] = file_id
+        await update_funny_photo_file_id(conn, photo.id, file_id)
+        return msg
@@ -0,0 +1,38 @@
+from aiogram import types
+from aiogram.utils.markdown import hcode
+
+from src.db.query_log import query_log
+from src.tg.dp import dp
+
+
+def _is_root(message: types.Message):
+    return str(message.from_user.id) == str(dp.bot.root_id)
+
+
+@dp.message_handler(_is_root, commands=["slow_queries"], state="*")
+async def slow_queries_handler(message: types.Message):
+    """/slow_queries [n] [max|total|calls] - slowest query fingerprints"""
+    args = message.get_args().split()
+    # Keeps the answer within Telegram's message length
+    n = min(int(args[0]), 10) if args and args[0].isdigit() else 5
+    by = args[1] if len(args) > 1 and args[1] in ("max", "total", "calls") else "max"
+
+    lines = []
+    for fingerprint, calls, total, max_duration, rows, _ in query_log.top(n, by):
+        lines.append(
+            f"max {max_duration * 1000:.0f} ms, total {total * 1000:.0f} ms, "
+            f"{calls} calls, {rows} rows\n{hcode(fingerprint[:500])}"
+        )
+
+    await dp.bot.safe_send_message(
+        chat_id=message.chat.id, text="\n\n".join(lines) or "No queries yet"
+    )
+
+
+@dp.message_handler(_is_root, commands=["refresh"], state="*")
+async def refresh_handler(message: types.Message):
+    """/refresh - reload pet types, locations and texts in every worker"""
+    workers = await dp.bot.refresh_channel.publish()
+    await dp.bot.safe_send_message(
+        chat_id=message.chat.id, text=f"Refreshing {workers} workers"
+    )
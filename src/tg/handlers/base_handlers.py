@@ -1,22 +1,25 @@
 import asyncio
+import re
 from os import mkdir
 from datetime import datetime, timedelta
 
-from src.config import project_root_dir
 from aiogram import types
 from aiogram.dispatcher import FSMContext
-from aiogram.utils.markdown import hcode, hbold
+from aiogram.utils.markdown import hcode, hbold, quote_html
 
 from src import __version__
 from src.tg.user_states import UserStates
 from src.tg.dp import dp
 from src.db.queries import (
-    insert_telegram_user,
-    select_posts_with_filters,
-    select_random_funny_photo,
+    CATEGORIES,
+    SEARCH_CANDIDATES,
+    search_posts,
+    select_post_page,
     update_telegram_user,
+    upsert_telegram_users,
     select_telegram_user,
 )
+from src.db.registrations import registration_row
 from src.utils import default_user_data, get_logger
 
 
@@ -32,6 +35,11 @@ except FileExistsError:
 _UPLOAD_TIME_LIMIT = 60
 upload_time_limit = timedelta(seconds=_UPLOAD_TIME_LIMIT)
 
+SEARCH_PAGE_SIZE = 5
+_SEARCH_MAX_LENGTH = 200
+_SNIPPET_LENGTH = 150
+_html_tag = re.compile(r"<[^>]+>")
+
 
 async def clear_user_view(message, state):
     user_data = await state.get_data()
@@ -53,7 +61,7 @@ so placed in the order of registration"""
 
 
 @dp.message_handler(
-    lambda message: message.text == dp.bot.texts["buttons"]["back_to_prev"], state="*"
+    lambda message: message.text == dp.bot.router.back_to_prev, state="*"
 )
 async def back_to_prev_handler(message: types.Message, state: FSMContext):
     await clear_user_view(message, state)
@@ -69,11 +77,9 @@ async def start_handler(message: types.Message, state: FSMContext):
     user_data = await state.get_data()
 
     if not user_data:
-        async with dp.bot.db.acquire() as conn:
-            telegram_user = dict(message.from_user)
-            telegram_user.pop("is_bot")
-            telegram_user["version"] = __version__
-            await insert_telegram_user(conn, **telegram_user)
+        telegram_user = dict(message.from_user)
+        telegram_user["version"] = __version__
+        await dp.bot.registrations.add(telegram_user)
 
     await clear_user_view(message, state)
 
@@ -85,28 +91,46 @@ async def start_handler(message: types.Message, state: FSMContext):
     )
 
 
+@dp.message_handler(commands=["search"], state="*")
+async def search_command_handler(message: types.Message, state: FSMContext):
+    """/search [words] - opens the search, with words searches at once"""
+    await clear_user_view(message, state)
+    await UserStates.search.set()
+    query = message.get_args()
+    if query:
+        await search_view_build(message, state, query[:_SEARCH_MAX_LENGTH])
+    else:
+        await dp.bot.safe_send_message(
+            chat_id=message.chat.id,
+            text=dp.bot.texts["messages"]["search"],
+            reply_markup=search_kb(),
+        )
+
+
 @dp.message_handler(state=UserStates.start)
-async def main_menu_handler(message: types.Message):
-    if message.text == dp.bot.texts["buttons"]["need_home"]:
-        kb = select_pet_type_kb(dp.bot.pet_types)
+async def main_menu_handler(message: types.Message, state: FSMContext):
+    action, _ = dp.bot.router.resolve(UserStates.start, message.text)
+
+    if action == "need_home":
+        kb = select_pet_type_kb()
         msg = dp.bot.texts["messages"]["need_home"]
         await UserStates.post_view.set()
 
-    elif message.text == dp.bot.texts["buttons"]["help"]:
+    elif action == "help":
         await UserStates.post_view.set()
         msg = dp.bot.texts["messages"]["help"]
         kb = help_kb()
 
-    elif message.text == dp.bot.texts["buttons"]["volunteers"]:
+    elif action == "volunteers":
         msg = dp.bot.texts["messages"]["volunteers"]
         kb = None
 
-    elif message.text == dp.bot.texts["buttons"]["about"]:
+    elif action == "about":
         await UserStates.about.set()
         msg = dp.bot.texts["messages"]["about"]
         kb = about_kb()
 
-    elif message.text == dp.bot.texts["buttons"]["easter_egg"]:
+    elif action == "easter_egg":
         if dp.bot.easter_egg_enabled:
             await UserStates.easter_egg.set()
             msg = dp.bot.texts["messages"]["easter_egg"]
@@ -115,6 +139,12 @@ async def main_menu_handler(message: types.Message):
             msg = dp.bot.texts["messages"]["easter_egg_disabled"]
             kb = start_kb()
 
+    elif action == "search":
+        await clear_user_view(message, state)
+        await UserStates.search.set()
+        msg = dp.bot.texts["messages"]["search"]
+        kb = search_kb()
+
     else:
         msg = dp.bot.texts["messages"]["unknown_command"]
         kb = None
@@ -127,55 +157,28 @@ async def main_menu_handler(message: types.Message):
 
 @dp.message_handler(state=UserStates.about)
 async def about_handler(message: types.Message):
-    if message.text == dp.bot.texts["buttons"]["partners"]:
-        msg = dp.bot.texts["messages"]["partners"]
-        kb = None
-    elif message.text == dp.bot.texts["buttons"]["project_history"]:
-        msg = dp.bot.texts["messages"]["project_history"]
-        kb = None
-    elif message.text == dp.bot.texts["buttons"]["useful_articles"]:
-        msg = dp.bot.texts["messages"]["useful_articles"]
-        kb = None
-    else:
-        msg = dp.bot.texts["messages"]["unknown_command"]
-        kb = None
-    await dp.bot.safe_send_message(chat_id=message.chat.id, text=msg, reply_markup=kb)
+    # Actions of the about menu are names of the messages to send
+    action, _ = dp.bot.router.resolve(UserStates.about, message.text)
+    msg = dp.bot.texts["messages"][action or "unknown_command"]
+    await dp.bot.safe_send_message(chat_id=message.chat.id, text=msg, reply_markup=None)
 
 
 @dp.message_handler(state=[UserStates.post_view])
 async def help_choose_handler(message: types.Message, state: FSMContext):
-    if message.text == dp.bot.texts["buttons"]["support_us"]:
+    action, payload = dp.bot.router.resolve(UserStates.post_view, message.text)
+
+    if action == "support_us":
         await dp.bot.safe_send_message(
             chat_id=message.chat.id,
             text=dp.bot.texts["messages"]["support_us"],
             reply_markup=None,
         )
 
-    elif (
-        message.text
-        in [
-            dp.bot.texts["buttons"]["need_money"],
-            dp.bot.texts["buttons"]["need_temp"],
-            dp.bot.texts["buttons"]["need_other"],
-        ]
-    ) or (message.text in [f"{i.emoji}{i.button_text}" for i in dp.bot.pet_types]):
+    elif action == "category":
 
         await clear_user_view(message, state)
 
-        category = None
-        pet_type = None
-
-        if message.text == dp.bot.texts["buttons"]["need_money"]:
-            category = "need_money"
-        elif message.text == dp.bot.texts["buttons"]["need_temp"]:
-            category = "need_temp"
-        elif message.text == dp.bot.texts["buttons"]["need_other"]:
-            category = "need_other"
-        else:
-            for _pet_type in dp.bot.pet_types:
-                if _pet_type.emoji in message.text:
-                    category = "need_home"
-                    pet_type = _pet_type.id
+        category, pet_type = payload
 
         await state.update_data({"category_cache": category})
         await state.update_data({"pet_type_cache": pet_type})
@@ -223,6 +226,29 @@ async def filter_message_handler(message: types.Message, state: FSMContext):
         await apply_filter(message, state, param, value)
 
 
+@dp.message_handler(state=UserStates.search)
+async def search_message_handler(message: types.Message, state: FSMContext):
+    # A new query gets a new message, the previous results go away
+    await clear_user_view(message, state)
+    await search_view_build(message, state, message.text[:_SEARCH_MAX_LENGTH])
+
+
+@dp.callback_query_handler(
+    lambda callback: callback.data.startswith("search,"), state=UserStates.search
+)
+async def search_callback_handler(
+    callback_query: types.CallbackQuery, state: FSMContext
+):
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        # Results of an expired session
+        await dp.bot.answer_callback_query(callback_query_id=callback_query.id)
+        return
+    offset = max(int(callback_query.data.split(",")[1]), 0)
+    await search_view_build(callback_query, state, query, offset)
+    await dp.bot.answer_callback_query(callback_query_id=callback_query.id)
+
+
 @dp.callback_query_handler(
     lambda callback: callback.data in ["sub_pic", "unsub_pic"], state="*"
 )
@@ -235,7 +261,11 @@ async def funny_photo_subscription_handler(callback_query: types.CallbackQuery):
         answer_text = dp.bot.texts["messages"]["subscribe_to_funny_photos"]
     else:
         raise
+    telegram_user = dict(callback_query.from_user)
+    telegram_user["version"] = __version__
     async with dp.bot.db.acquire() as conn:
+        # The user may still wait in the registration queue
+        await upsert_telegram_users(conn, [registration_row(telegram_user)])
         await update_telegram_user(
             conn, callback_query.from_user.id, funny_photos_subscribed=is_sub
         )
@@ -306,7 +336,7 @@ async def post_view_callback_query_handler(
             msg += dp.bot.texts["messages"]["location_filter"]
             await state.update_data({"input_value_await": callback_query.data})
 
-            kb = location_filter_kb(dp.bot.locations)
+            kb = location_filter_kb()
             await UserStates.filter.set()
             await dp.bot.safe_edit_message(
                 message_id=callback_query.message.message_id,
@@ -319,7 +349,7 @@ async def post_view_callback_query_handler(
             msg = dp.bot.texts["messages"]["pet_type_filter"]
             await state.update_data({"input_value_await": callback_query.data})
 
-            kb = pet_type_filter_kb(dp.bot.pet_types)
+            kb = pet_type_filter_kb()
             await UserStates.filter.set()
             await dp.bot.safe_edit_message(
                 message_id=callback_query.message.message_id,
@@ -375,6 +405,21 @@ async def apply_filter(
     await UserStates.post_view.set()
 
 
+def _post_catalog():
+    catalog = dp.bot.catalog
+    if catalog and catalog.loaded:
+        return catalog
+
+
+async def _select_post_page(user_filters):
+    catalog = _post_catalog()
+    if catalog:
+        return catalog.select_post_page(**user_filters)
+
+    async with dp.bot.db.acquire() as conn:
+        return await select_post_page(conn, **user_filters)
+
+
 async def post_view_build(
     user_activity: types.Message or types.CallbackQuery,
     state: FSMContext,
@@ -384,14 +429,6 @@ async def post_view_build(
     pet_type=None,
     post_id=None,
 ):
-    async def _get_neighbors():
-        pagination_bts = []
-        for _direction in ("<", ">"):
-            user_filters["direction"] = _direction
-            cursor = await select_posts_with_filters(conn, **user_filters)
-            pagination_bts.append(False if cursor.rowcount == 0 else True)
-        return pagination_bts
-
     user_filters = {"category": category}
 
     if post_id:
@@ -419,97 +456,143 @@ async def post_view_build(
     user_filters["pet_type"] = pet_type
     user_filters["location"] = location
 
-    async with dp.bot.db.acquire() as conn:
+    # Falls back to the first post if nothing is left in the direction
+    page = await _select_post_page(user_filters)
 
-        post_cursor = await select_posts_with_filters(conn, **user_filters)
+    if page is None:
 
-        if post_cursor.rowcount == 0:
+        if category == "need_home":
+            if location:
+                msg = dp.bot.texts["messages"][
+                    "all_pets_from_location_are_at_home"
+                ].format(pet_type_text.lower(), hbold(location_text))
+            else:
+                msg = dp.bot.texts["messages"]["all_pets_are_at_home"].format(
+                    pet_type_text.lower()
+                )
 
-            if not direction:
+        else:
+            if not (location or pet_type):
+                msg = dp.bot.texts["messages"]["no_this_category"]
+            else:
+                msg = dp.bot.texts["messages"]["no_this_category_filters"].format(
+                    hbold(dp.bot.texts["buttons"][category]),
+                    hbold(location_text),
+                    hbold(pet_type_text),
+                )
 
-                if category == "need_home":
-                    if location:
-                        msg = dp.bot.texts["messages"][
-                            "all_pets_from_location_are_at_home"
-                        ].format(pet_type_text.lower(), hbold(location_text))
-                    else:
-                        msg = dp.bot.texts["messages"]["all_pets_are_at_home"].format(
-                            pet_type_text.lower()
-                        )
+        has_prev, has_next = False, False
 
-                else:
-                    if not (location or pet_type):
-                        msg = dp.bot.texts["messages"]["no_this_category"]
-                    else:
-                        msg = dp.bot.texts["messages"][
-                            "no_this_category_filters"
-                        ].format(
-                            hbold(dp.bot.texts["buttons"][category]),
-                            hbold(location_text),
-                            hbold(pet_type_text),
-                        )
+    else:
+        post, has_prev, has_next = page
+        post_id = post.id
+        if category == "need_home":
+            if post.need_home_allow_other_location:
+                allow_other_locations = dp.bot.texts["messages"]["yes"]
+            else:
+                allow_other_locations = dp.bot.texts["messages"]["no"]
+            msg = dp.bot.texts["messages"]["user_post_view_need_home"].format(
+                post.pet_type_emoji,
+                post.title,
+                post.location_button_text,
+                allow_other_locations,
+                post[category],
+            )
+        else:
+            msg = dp.bot.texts["messages"]["user_post_view"].format(
+                post.pet_type_emoji,
+                post.title,
+                post.location_button_text,
+                post[category],
+            )
 
-                has_prev, has_next = False, False
+    kb = post_view_kb(
+        category=category,
+        location=location,
+        pet_type=pet_type,
+        post_id=post_id,
+        has_prev=has_prev,
+        has_next=has_next,
+    )
 
-            else:
-                user_filters.pop("direction")
+    user_data = await state.get_data()
+    current_msg = user_data.get("msg_with_kb_id")
 
-                # Some recursive code. Maybe change this?
-                await post_view_build(user_activity, state, **user_filters)
-                return
+    if current_msg:
+        await dp.bot.safe_edit_message(
+            message_id=current_msg,
+            chat_id=user_activity.from_user.id,
+            text=msg,
+            reply_markup=kb,
+        )
 
-        else:
-            post = await post_cursor.fetchone()
-            user_filters["post_id"] = post_id = post.id
-            if category == "need_home":
-                if post.need_home_allow_other_location:
-                    allow_other_locations = dp.bot.texts["messages"]["yes"]
-                else:
-                    allow_other_locations = dp.bot.texts["messages"]["no"]
-                msg = dp.bot.texts["messages"]["user_post_view_need_home"].format(
-                    post.pet_type_emoji,
-                    post.title,
-                    post.location_button_text,
-                    allow_other_locations,
-                    post[category],
-                )
-            else:
-                msg = dp.bot.texts["messages"]["user_post_view"].format(
-                    post.pet_type_emoji,
-                    post.title,
-                    post.location_button_text,
-                    post[category],
-                )
-            has_prev, has_next = await _get_neighbors()
-
-        kb = post_view_kb(
-            category=category,
-            location=location,
-            pet_type=pet_type,
-            post_id=post_id,
-            has_prev=has_prev,
-            has_next=has_next,
+    else:
+        send = await dp.bot.safe_send_message(
+            chat_id=user_activity.chat.id, text=msg, reply_markup=kb
         )
 
-        user_data = await state.get_data()
-        current_msg = user_data.get("msg_with_kb_id")
+        await state.update_data({"msg_with_kb_id": send.message_id})
 
-        if current_msg:
-            await dp.bot.safe_edit_message(
-                message_id=current_msg,
-                chat_id=user_activity.from_user.id,
-                text=msg,
-                reply_markup=kb,
-            )
 
-        else:
-            send = await dp.bot.safe_send_message(
-                chat_id=user_activity.chat.id, text=msg, reply_markup=kb
+def _search_snippet(post):
+    # The first text the post is shown with, without markup
+    for category in CATEGORIES:
+        if post[f"{category}_visible"] and post[category]:
+            text = _html_tag.sub("", post[category])
+            if len(text) > _SNIPPET_LENGTH:
+                text = text[:_SNIPPET_LENGTH].rsplit(" ", 1)[0] + "…"
+            return quote_html(text)
+    return ""
+
+
+async def search_view_build(
+    user_activity: types.Message or types.CallbackQuery,
+    state: FSMContext,
+    query,
+    offset=0,
+):
+    async with dp.bot.db.acquire() as conn:
+        page = await search_posts(conn, query, offset=offset, limit=SEARCH_PAGE_SIZE)
+
+    if not page or not page.posts:
+        msg = dp.bot.texts["messages"]["search_nothing_found"].format(hcode(query))
+        has_prev, has_next = False, False
+    else:
+        lines = [dp.bot.texts["messages"]["search_results"].format(hcode(query))]
+        for n, post in enumerate(page.posts, start=offset + 1):
+            lines.append(
+                f"{n}. {post.pet_type_emoji}{hbold(post.title)}, "
+                f"{post.location_button_text}\n{_search_snippet(post)}"
             )
+        if page.truncated:
+            # Older matches are never ranked, a narrower query finds them
+            lines.append(
+                dp.bot.texts["messages"]["search_truncated"].format(SEARCH_CANDIDATES)
+            )
+        msg = "\n\n".join(lines)
+        has_prev, has_next = page.has_prev, page.has_next
+
+    kb = search_results_kb(offset, has_prev, has_next)
 
+    await state.update_data({"search_query": query})
+    current_msg = (await state.get_data()).get("msg_with_kb_id")
+
+    if current_msg:
+        await dp.bot.safe_edit_message(
+            message_id=current_msg,
+            chat_id=user_activity.from_user.id,
+            text=msg,
+            reply_markup=kb,
+        )
+    else:
+        send = await dp.bot.safe_send_message(
+            chat_id=user_activity.chat.id, text=msg, reply_markup=kb
+        )
+        if send:
             await state.update_data({"msg_with_kb_id": send.message_id})
 
 
+@dp.bot.keyboards.cached
 def easter_egg_kb():
     kb = types.reply_keyboard.ReplyKeyboardMarkup(resize_keyboard=True)
     get_pic = types.reply_keyboard.KeyboardButton(
@@ -524,6 +607,7 @@ def easter_egg_kb():
     return kb
 
 
+@dp.bot.keyboards.cached
 def start_kb():
     need_home_bt = types.reply_keyboard.KeyboardButton(
         text=dp.bot.texts["buttons"]["need_home"]
@@ -547,9 +631,15 @@ def start_kb():
         kb.row(about_button, easter_egg_button)
     else:
         kb.row(about_button)
+    # Shown once the button text is added, /search works without it
+    if dp.bot.texts["buttons"].get("search"):
+        kb.row(
+            types.reply_keyboard.KeyboardButton(text=dp.bot.texts["buttons"]["search"])
+        )
     return kb
 
 
+@dp.bot.keyboards.cached
 def about_kb():
     kb = types.reply_keyboard.ReplyKeyboardMarkup(resize_keyboard=True)
     about_project_history_bt = types.reply_keyboard.KeyboardButton(
@@ -571,6 +661,7 @@ def about_kb():
     return kb
 
 
+@dp.bot.keyboards.cached
 def help_kb():
     need_money_bt = types.reply_keyboard.KeyboardButton(
         text=dp.bot.texts["buttons"]["need_money"]
@@ -596,12 +687,13 @@ def help_kb():
     return kb
 
 
-def select_pet_type_kb(pet_types):
+@dp.bot.keyboards.cached
+def select_pet_type_kb():
     kb = types.reply_keyboard.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
     kb.add(
         *[
             types.reply_keyboard.KeyboardButton(text=f"{p.emoji}{p.button_text}")
-            for p in pet_types
+            for p in dp.bot.pet_types
         ]
     )
     kb.row(
@@ -612,7 +704,8 @@ def select_pet_type_kb(pet_types):
     return kb
 
 
-def location_filter_kb(locations):
+@dp.bot.keyboards.cached
+def location_filter_kb():
     kb = types.inline_keyboard.InlineKeyboardMarkup(resize_keyboard=True)
     kb.row(
         types.inline_keyboard.InlineKeyboardButton(
@@ -620,7 +713,7 @@ def location_filter_kb(locations):
             callback_data="location_cache,any",
         )
     )
-    for loc in locations:
+    for loc in dp.bot.locations:
         if loc.display_on_keyboard:
             kb.add(
                 types.inline_keyboard.InlineKeyboardButton(
@@ -631,7 +724,8 @@ def location_filter_kb(locations):
     return kb
 
 
-def pet_type_filter_kb(pet_types):
+@dp.bot.keyboards.cached
+def pet_type_filter_kb():
     kb = types.inline_keyboard.InlineKeyboardMarkup(resize_keyboard=True, row_width=2)
     kb.row(
         types.inline_keyboard.InlineKeyboardButton(
@@ -645,12 +739,49 @@ def pet_type_filter_kb(pet_types):
             types.inline_keyboard.InlineKeyboardButton(
                 text=f"{p.emoji}{p.button_text}", callback_data=f"pet_type_cache,{p.id}"
             )
-            for p in pet_types
+            for p in dp.bot.pet_types
         ]
     )
     return kb
 
 
+@dp.bot.keyboards.cached
+def search_kb():
+    kb = types.reply_keyboard.ReplyKeyboardMarkup(resize_keyboard=True)
+    kb.row(
+        types.reply_keyboard.KeyboardButton(
+            text=dp.bot.texts["buttons"]["back_to_prev"]
+        )
+    )
+    return kb
+
+
+def search_results_kb(offset, has_prev, has_next):
+    """
+    Typical look of the button's callback data: search,10
+    The query itself is kept in the user data.
+    """
+    kb = types.inline_keyboard.InlineKeyboardMarkup()
+    buttons = []
+    if has_prev:
+        buttons.append(
+            types.inline_keyboard.InlineKeyboardButton(
+                text=dp.bot.texts["buttons"]["previous"],
+                callback_data=f"search,{max(offset - SEARCH_PAGE_SIZE, 0)}",
+            )
+        )
+    if has_next:
+        buttons.append(
+            types.inline_keyboard.InlineKeyboardButton(
+                text=dp.bot.texts["buttons"]["next"],
+                callback_data=f"search,{offset + SEARCH_PAGE_SIZE}",
+            )
+        )
+    if buttons:
+        kb.row(*buttons)
+    return kb
+
+
 def post_view_kb(category, location, pet_type, post_id, has_prev=False, has_next=False):
     """
     Typical look of the button's callback data: <,need_home,1,1,15
@@ -717,17 +848,21 @@ async def funny_photo_handler(message: types.Message, state: FSMContext):
 async def get_funny_photo_handler(message: types.Message):
     if message.text == dp.bot.texts["buttons"]["get_pic"]:
         async with dp.bot.db.acquire() as conn:
-            photo = await select_random_funny_photo(conn)
+            photo = await dp.bot.funny_photo_pool.select_random(
+                conn, message.from_user.id
+            )
             if photo:
                 user_db_data = await select_telegram_user(conn, message.from_user.id)
+                # Not registered yet, see RegistrationQueue
+                is_sub = bool(user_db_data and user_db_data.funny_photos_subscribed)
 
-                await dp.bot.send_photo(
+                await dp.bot.funny_photo_files.send(
+                    dp.bot,
+                    conn,
                     chat_id=message.chat.id,
-                    photo=open(
-                        f"{project_root_dir}/static/images/{photo.filename}.png", "rb"
-                    ),
+                    photo=photo,
                     caption=photo.caption,
-                    reply_markup=funny_photo_kb(user_db_data.funny_photos_subscribed),
+                    reply_markup=funny_photo_kb(is_sub),
                 )
                 return
             msg = dp.bot.texts["messages"]["no_funny_photo"]
@@ -737,6 +872,7 @@ async def get_funny_photo_handler(message: types.Message):
     await dp.bot.safe_send_message(chat_id=message.chat.id, text=msg)
 
 
+@dp.bot.keyboards.cached
 def funny_photo_kb(is_sub):
     kb = types.inline_keyboard.InlineKeyboardMarkup()
     if not is_sub:
@@ -752,3 +888,9 @@ def funny_photo_kb(is_sub):
             )
         )
     return kb
+
+
+@dp.message_handler(state=None)
+async def expired_session_handler(message: types.Message, state: FSMContext):
+    # Idle sessions expire in the FSM storage, start such users over
+    await start_handler(message, state)
@@ -0,0 +1,44 @@
+import inspect
+import json
+from functools import wraps
+
+
+class KeyboardRegistry:
+    """
+    Static keyboards depend only on bot texts, locations and pet types,
+    so each of them is built once and kept already serialized:
+    aiogram sends a JSON string reply_markup as is.
+
+    Cache is dropped when static data is reloaded from the database.
+    """
+
+    def __init__(self):
+        self._cache = dict()
+        self._static = list()
+
+    def cached(self, builder):
+        """Decorator for keyboard builders, arguments must be hashable"""
+
+        @wraps(builder)
+        def wrapper(*args):
+            key = (builder.__name__, *args)
+            kb = self._cache.get(key)
+            if kb is None:
+                kb = self._cache[key] = json.dumps(builder(*args).to_python())
+            return kb
+
+        if not inspect.signature(builder).parameters:
+            self._static.append(wrapper)
+        return wrapper
+
+    def prerender(self):
+        """Builds keyboards without arguments before updates need them"""
+        for wrapper in self._static:
+            try:
+                wrapper()
+            except KeyError:
+                # A bot text is missing, the handler fails on it anyway
+                pass
+
+    def invalidate(self):
+        self._cache = dict()
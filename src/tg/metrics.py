@@ -0,0 +1,78 @@
+import sys
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from src.metrics import Counter, Gauge, Histogram
+
+handler_duration = Histogram(
+    "zverobot_handler_duration_seconds",
+    "Handler processing time",
+    labels=("handler", "state", "status"),
+)
+api_requests = Counter(
+    "zverobot_telegram_requests_total",
+    "Bot API requests",
+    labels=("method",),
+)
+api_errors = Counter(
+    "zverobot_telegram_errors_total",
+    "Bot API requests failed",
+    labels=("method", "exception"),
+)
+api_duration = Histogram(
+    "zverobot_telegram_request_duration_seconds",
+    "Bot API request time",
+    labels=("method",),
+)
+swallowed_exceptions = Counter(
+    "zverobot_swallowed_exceptions_total",
+    "Exceptions ignored by ZveroBot.safe_* methods",
+    labels=("method", "exception"),
+)
+
+startup_duration = Gauge(
+    "zverobot_startup_seconds", "Time of ZveroBot.startup() warm-up"
+)
+time_to_first_response = Gauge(
+    "zverobot_time_to_first_response_seconds",
+    "Time from the bot creation to the first processed update",
+)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Duration of every handler by its name, user state and outcome"""
+
+    async def _started(self, data):
+        data["_metrics_started"] = time.perf_counter()
+        data["_metrics_handler"] = current_handler.get().__name__
+
+    async def _finished(self, data):
+        started = data.get("_metrics_started")
+        if started is None:
+            # No handler matched
+            return
+        # post_process runs in `finally`, exception is still in flight
+        status = "error" if sys.exc_info()[0] else "ok"
+        handler_duration.observe(
+            time.perf_counter() - started,
+            data["_metrics_handler"],
+            data.get("raw_state") or "",
+            status,
+        )
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        await self._started(data)
+
+    async def on_post_process_message(self, message: types.Message, results, data):
+        await self._finished(data)
+
+    async def on_process_callback_query(self, query: types.CallbackQuery, data: dict):
+        await self._started(data)
+
+    async def on_post_process_callback_query(
+        self, query: types.CallbackQuery, results, data
+    ):
+        await self._finished(data)
@@ -0,0 +1,155 @@
+import asyncio
+from collections import deque
+
+from aiogram.utils.exceptions import RetryAfter
+
+from src.metrics import Counter, Gauge
+from src.tg.ratelimit import TokenBucket, ChatRateLimiter
+from src.utils import get_logger
+
+log = get_logger("Outbox")
+
+outbox_retry_after = Counter(
+    "zverobot_outbox_retry_after_total", "RetryAfter answers to outbox requests"
+)
+outbox_coalesced = Counter(
+    "zverobot_outbox_coalesced_edits_total", "Edits replaced by a newer edit"
+)
+outbox_pending = Gauge(
+    "zverobot_outbox_pending_requests", "Requests waiting in the outbox"
+)
+outbox_chats = Gauge("zverobot_outbox_pending_chats", "Chats with waiting requests")
+
+
+class _Job:
+    __slots__ = ("call", "edit_of", "limited", "futures")
+
+    def __init__(self, call, edit_of, limited):
+        self.call = call
+        self.edit_of = edit_of
+        self.limited = limited
+        self.futures = [asyncio.get_event_loop().create_future()]
+
+    def resolve(self, result=None, exception=None):
+        for future in self.futures:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+
+
+class Outbox:
+    """
+    Outgoing Bot API requests with Telegram's flood limits.
+
+    Requests of a chat are sent one by one in FIFO order, chats are
+    served round-robin by a pool of workers. Messages and edits take
+    a token from the global bucket and from the chat limiter,
+    RetryAfter pauses the global bucket and the request is repeated.
+
+    An edit of a message which is still waiting right behind another
+    edit of the same message by the same method replaces it, only the
+    latest is sent. A text edit followed by a reply markup edit keeps
+    both, the markup edit doesn't carry the text.
+    """
+
+    def __init__(self, rate=30, chat_interval=1.0, chat_burst=3, workers=16):
+        self.limiter = TokenBucket(rate)
+        self.chat_limiter = ChatRateLimiter(chat_interval, burst=chat_burst)
+        self.workers = workers
+
+        self._chats = dict()
+        self._ready = asyncio.Queue()
+        self._tasks = []
+        self._pending = 0
+
+        outbox_pending.callback = lambda: self._pending
+        outbox_chats.callback = lambda: len(self._chats)
+
+    def __len__(self):
+        return self._pending
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self, timeout=10):
+        """Send what is queued and stop the workers"""
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"{self._pending} requests are dropped on close")
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def _put(self, chat_id, call, edit_of=None, limited=True):
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = deque()
+            self._ready.put_nowait(chat_id)
+
+        last = queue[-1] if queue else None
+        if edit_of is not None and last is not None and last.edit_of == edit_of:
+            # Not started yet, the newer edit goes instead of it
+            last.call = call
+            last.futures.append(asyncio.get_event_loop().create_future())
+            outbox_coalesced.inc()
+            return last.futures[-1]
+
+        job = _Job(call, edit_of, limited)
+        queue.append(job)
+        self._pending += 1
+        return job.futures[0]
+
+    async def send(self, chat_id, call):
+        """Queue a new message, call() makes the request"""
+        return await self._put(chat_id, call)
+
+    async def edit(self, chat_id, message_id, call, method=None):
+        """Queue an edit, `method` is the Bot API method call() uses"""
+        return await self._put(chat_id, call, edit_of=(message_id, method))
+
+    async def delete(self, chat_id, call):
+        # Deletions don't count as messages, only keep their order
+        return await self._put(chat_id, call, limited=False)
+
+    async def _execute(self, chat_id, job):
+        if job.limited:
+            await self.chat_limiter.acquire(chat_id)
+        while True:
+            await self.limiter.acquire()
+            try:
+                return await job.call()
+            except RetryAfter as ex:
+                outbox_retry_after.inc()
+                log.warning(f"Flood control, outbox paused for {ex.timeout}s")
+                self.limiter.pause(ex.timeout)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._chats[chat_id]
+            job = queue.popleft()
+            # Later edits can't be merged into a job being sent
+            job.edit_of = None
+            try:
+                job.resolve(await self._execute(chat_id, job))
+            except asyncio.CancelledError:
+                job.cancel()
+                raise
+            except Exception as ex:
+                job.resolve(exception=ex)
+            finally:
+                self._pending -= 1
+                if queue:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._chats[chat_id]
+                self._ready.task_done()
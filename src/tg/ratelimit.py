@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second with bursts up to `capacity`.
+
+    Waiters are served in FIFO order. pause() stops everyone,
+    it is used when Telegram answers with RetryAfter.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if now <= self._updated_at:
+            return
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = self._clock()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+                await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        now = self._clock()
+        self._paused_until = max(self._paused_until, now + seconds)
+        # No burst right after the pause
+        self._tokens = 0
+        self._updated_at = max(self._updated_at, self._paused_until)
+
+    @property
+    def paused(self):
+        return self._clock() < self._paused_until
+
+
+class ChatRateLimiter:
+    """
+    One acquisition per `interval` seconds for every chat on average,
+    up to `burst` acquisitions of a chat may go without waiting.
+    """
+
+    def __init__(self, interval=1.0, burst=1, clock=time.monotonic, max_chats=10000):
+        self.interval = interval
+        self.burst = burst
+        self._clock = clock
+        self._max_chats = max_chats
+        # Time when the chat is back to a full burst
+        self._next_at = dict()
+
+    def _prune(self, now):
+        self._next_at = {chat_id: t for chat_id, t in self._next_at.items() if t > now}
+
+    async def acquire(self, chat_id):
+        now = self._clock()
+        if len(self._next_at) >= self._max_chats:
+            self._prune(now)
+
+        next_at = max(self._next_at.get(chat_id, now), now)
+        self._next_at[chat_id] = next_at + self.interval
+        delay = next_at - (self.burst - 1) * self.interval - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def __len__(self):
+        return len(self._next_at)
@@ -0,0 +1,35 @@
+import json
+import time
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+
+class UpdateRecorder(BaseMiddleware):
+    """
+    Appends every incoming update to a JSONL file,
+    a line is {"time": unix time of arrival, "update": raw update}.
+    Recordings are replayed by benchmarks/loadtest.py.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        # Line buffered, a crash loses at most the update being written
+        self._file = open(path, "a", buffering=1, encoding="utf-8")
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        record = dict(time=time.time(), update=update.to_python())
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+def read_updates(path):
+    """Recorded (time, Update) pairs in the order of arrival"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record["time"], types.Update(**record["update"])
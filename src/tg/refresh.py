@@ -0,0 +1,93 @@
+import asyncio
+
+import aioredis
+
+from src.metrics import Counter
+from src.utils import get_logger
+
+log = get_logger("refresh")
+
+REFRESH_ALL = "all"
+
+refreshes_published = Counter(
+    "zverobot_refreshes_published_total", "Static data refreshes requested"
+)
+refreshes_received = Counter(
+    "zverobot_refreshes_received_total", "Static data refreshes received"
+)
+
+
+class RefreshChannel:
+    """
+    Static data refreshes over Redis pub/sub.
+
+    Every worker listens to the channel and reloads pet types, locations
+    and texts once per message, so an admin change is seen everywhere at
+    the same time without polling Postgres. Anything able to talk to
+    Redis may request it, e.g. `PUBLISH zverobot:refresh all`.
+    """
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=None,
+        password=None,
+        channel="zverobot:refresh",
+        reconnect_interval=1,
+    ):
+        self._address = (host, port)
+        self._db = db
+        self._password = password
+        self.channel = channel
+        self.reconnect_interval = reconnect_interval
+        self._publisher = None
+        self._subscriber = None
+        self._closed = False
+        self.subscribed = asyncio.Event()
+
+    async def _connect(self):
+        return await aioredis.create_redis(
+            self._address, db=self._db, password=self._password
+        )
+
+    async def publish(self, scope=REFRESH_ALL):
+        """Returns the number of workers that got the message"""
+        if self._publisher is None or self._publisher.closed:
+            self._publisher = await self._connect()
+        refreshes_published.inc()
+        return await self._publisher.publish(self.channel, scope)
+
+    async def listen(self, callback):
+        """
+        Calls `await callback(scope)` for every message until close().
+
+        Messages are handled one at a time, a lost connection is
+        reopened, refreshes published meanwhile are lost.
+        """
+        while not self._closed:
+            try:
+                self._subscriber = await self._connect()
+                (channel,) = await self._subscriber.subscribe(self.channel)
+                self.subscribed.set()
+                async for scope in channel.iter(encoding="utf8"):
+                    refreshes_received.inc()
+                    try:
+                        await callback(scope)
+                    except Exception as ex:
+                        log.exception(f"Refresh {scope} failed: {ex}")
+            except (OSError, aioredis.RedisError) as ex:
+                log.warning(f"Refresh channel lost: {ex}")
+            finally:
+                self.subscribed.clear()
+                if self._subscriber is not None:
+                    self._subscriber.close()
+            if not self._closed:
+                await asyncio.sleep(self.reconnect_interval)
+
+    async def close(self):
+        self._closed = True
+        for conn in (self._subscriber, self._publisher):
+            if conn is not None:
+                conn.close()
+                await conn.wait_closed()
@@ -0,0 +1,46 @@
+from src.tg.user_states import UserStates
+
+
+class ReplyRouter:
+    """
+    Reply keyboard texts resolved to actions with one dict lookup.
+
+    There is a table per user state, mapping button text
+    to (action, payload). Tables are rebuilt and swapped
+    when static data is reloaded from the database.
+    """
+
+    def __init__(self):
+        self.back_to_prev = None
+        self._routes = dict()
+
+    def rebuild(self, texts, pet_types):
+        buttons = texts["buttons"]
+
+        def _table(names):
+            return {buttons[i]: (i, None) for i in names if buttons.get(i)}
+
+        post_view = _table(("support_us",))
+        for category in ("need_money", "need_temp", "need_other"):
+            if buttons.get(category):
+                post_view[buttons[category]] = ("category", (category, None))
+        for pet_type in pet_types:
+            post_view[f"{pet_type.emoji}{pet_type.button_text}"] = (
+                "category",
+                ("need_home", pet_type.id),
+            )
+
+        self._routes = {
+            UserStates.start: _table(
+                ("need_home", "help", "volunteers", "about", "easter_egg", "search")
+            ),
+            UserStates.about: _table(
+                ("partners", "project_history", "useful_articles")
+            ),
+            UserStates.post_view: post_view,
+        }
+        self.back_to_prev = buttons.get("back_to_prev")
+
+    def resolve(self, state, text):
+        """(action, payload) for the text in the state or (None, None)"""
+        return self._routes.get(state, {}).get(text, (None, None))
@@ -0,0 +1,34 @@
+import time
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from src.tg.metrics import time_to_first_response
+from src.utils import get_logger
+
+log = get_logger("startup")
+
+
+class StartupGateMiddleware(BaseMiddleware):
+    """
+    Holds updates until ZveroBot.startup() is done,
+    so handlers never see the bot without texts and pools.
+    Time from the bot creation to the first processed update is measured.
+    """
+
+    def __init__(self, bot):
+        super().__init__()
+        self.bot = bot
+        self._first_processed = False
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        if not self.bot.started.is_set():
+            await self.bot.started.wait()
+
+    async def on_post_process_update(self, update: types.Update, result, data: dict):
+        if self._first_processed:
+            return
+        self._first_processed = True
+        seconds = time.perf_counter() - self.bot.created_at
+        time_to_first_response.set(seconds)
+        log.info(f"First update processed {seconds:.2f} s after start")
@@ -7,3 +7,4 @@ class UserStates(StatesGroup):
     about = State()
     filter = State()
     easter_egg = State()
+    search = State()
@@ -0,0 +1,134 @@
+import asyncio
+import hmac
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot import api
+
+from src.utils import get_logger
+
+log = get_logger("webhook")
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def user_id_of(data: dict):
+    """Id of the user behind a raw update, None for updates without one"""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if user:
+                return user.get("id")
+    return None
+
+
+async def set_webhook(bot: Bot, url, secret_token=None, max_connections=None):
+    # aiogram 2.10 Bot.set_webhook doesn't know secret_token yet
+    payload = {"url": url}
+    if secret_token:
+        payload["secret_token"] = secret_token
+    if max_connections:
+        payload["max_connections"] = max_connections
+    return await bot.request(api.Methods.SET_WEBHOOK, payload)
+
+
+def make_webhook_app(
+    dispatcher: Dispatcher, path, secret_token=None, max_body_size=1024**2
+):
+    """
+    aiohttp app receiving updates from Telegram.
+
+    Telegram gets 200 as soon as the update is parsed,
+    the update itself is processed in a background task.
+    Updates of the same user are processed in their arrival order.
+    Bodies larger than max_body_size are rejected with 413 by aiohttp.
+    """
+    app = web.Application(client_max_size=max_body_size)
+    app["updates_in_progress"] = set()
+    # user id -> task of the last update of the user
+    last_updates = {}
+
+    async def _process_update(update, previous=None):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            # Through updates_handler, so update middlewares are triggered
+            await dispatcher.updates_handler.notify(update)
+        except Exception as ex:
+            log.exception(f"Update {update.update_id} failed: {ex}")
+
+    async def webhook_handler(request: web.Request):
+        if secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_TOKEN_HEADER, ""), secret_token
+        ):
+            raise web.HTTPForbidden()
+
+        try:
+            data = await request.json()
+            update = types.Update(**data)
+        except (ValueError, TypeError):
+            raise web.HTTPBadRequest()
+
+        Bot.set_current(dispatcher.bot)
+        Dispatcher.set_current(dispatcher)
+
+        user_id = user_id_of(data)
+        task = asyncio.get_event_loop().create_task(
+            _process_update(update, last_updates.get(user_id))
+        )
+        app["updates_in_progress"].add(task)
+        task.add_done_callback(app["updates_in_progress"].discard)
+        if user_id is not None:
+            last_updates[user_id] = task
+            task.add_done_callback(lambda t: _forget(user_id, t))
+
+        return web.Response()
+
+    def _forget(user_id, task):
+        if last_updates.get(user_id) is task:
+            del last_updates[user_id]
+
+    async def _wait_updates(app):
+        if app["updates_in_progress"]:
+            await asyncio.wait(app["updates_in_progress"])
+
+    app.router.add_post(path, webhook_handler)
+    app.on_shutdown.append(_wait_updates)
+    return app
+
+
+def add_lifecycle(app, dispatcher: Dispatcher, on_startup=None, on_shutdown=None):
+    async def _on_startup(app):
+        if on_startup:
+            await on_startup(dispatcher)
+
+    async def _on_shutdown(app):
+        if on_shutdown:
+            await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        await dispatcher.bot.close()
+
+    app.on_startup.append(_on_startup)
+    app.on_shutdown.append(_on_shutdown)
+
+
+def start_webhook(dispatcher: Dispatcher, config, on_startup=None, on_shutdown=None):
+    app = make_webhook_app(
+        dispatcher,
+        path=config.webhook_path,
+        secret_token=config.webhook_secret_token,
+        max_body_size=config.webhook_max_body_size,
+    )
+    add_lifecycle(app, dispatcher, on_startup, on_shutdown)
+
+    async def _set_webhook(app):
+        await set_webhook(
+            dispatcher.bot,
+            f"{config.webhook_url}{config.webhook_path}",
+            secret_token=config.webhook_secret_token,
+        )
+
+    app.on_startup.append(_set_webhook)
+
+    web.run_app(app, host=config.webhook_host, port=config.webhook_port)
@@ -1,25 +1,48 @@
 import asyncio
+import time
 
-from aiogram import Bot
 from aiogram.types import ParseMode
-from aiogram.utils.exceptions import *
 
-from src.config import Config
+from src.config import Config, project_root_dir
 from src.db.queries import (
     init_database,
     select_all_pet_types,
     select_all_locations,
     select_all_bot_texts,
-    select_posts_with_filters,
+    select_pet_types_posts_count,
 )
 from src.db.models import TextType
+from src.db.catalog import PostCatalog
+from src.db.listener import STATIC_TABLES, StaticDataListener
+from src.db.photo_pool import FunnyPhotoPool
+from src.db.pool import InstrumentedEngine
+from src.db.query_log import query_log
+from src.db.registrations import RegistrationQueue
+from src.tg.bot_api import ApiUrlBot
+from src.tg.funny_photos import FunnyPhotoFiles
+from src.tg.broadcast import Broadcaster
+from src.tg.keyboards import KeyboardRegistry
+from src.tg.metrics import (
+    api_requests,
+    api_errors,
+    api_duration,
+    startup_duration,
+    swallowed_exceptions,
+)
+from src.tg.outbox import Outbox
+from src.tg.refresh import RefreshChannel
+from src.tg.routing import ReplyRouter
+from src.utils import get_logger
 
 DEFAULT_PARSE_MODE = ParseMode.HTML
 
+log = get_logger("ZveroBot")
+
 
-class ZveroBot(Bot):
+class ZveroBot(ApiUrlBot):
     def __init__(self, config: Config, *args, **kwargs):
         kwargs["token"] = config.token
+        kwargs["api_url"] = config.bot_api_url
         super().__init__(*args, **kwargs)
 
         self.easter_egg_enabled = config.easter_egg_enabled
@@ -28,58 +51,233 @@ class ZveroBot(Bot):
         self.pet_types = list()
         self.locations = list()
         self.texts = dict(messages={}, buttons={})
+        self.keyboards = KeyboardRegistry()
+        self.router = ReplyRouter()
+        self.funny_photo_files = FunnyPhotoFiles(f"{project_root_dir}/static/images")
+        self.funny_photo_pool = FunnyPhotoPool(history=config.funny_photo_history)
+
+        self.catalog = PostCatalog() if config.post_catalog_enabled else None
+        self.catalog_refresh_interval = config.post_catalog_refresh_interval
 
         if not kwargs.get("parse_mode"):
             self.parse_mode = DEFAULT_PARSE_MODE
 
-        self.db = asyncio.get_event_loop().run_until_complete(
-            init_database(
+        query_log.configure(
+            threshold=config.slow_query_threshold_ms / 1000,
+            window=config.slow_query_window,
+        )
+        self.config = config
+
+        # Opened by startup(), nothing touches the network before it
+        self.db = None
+        self.registrations = None
+        self.broadcaster = None
+        self.outbox = Outbox(
+            rate=config.outbox_rate,
+            chat_interval=config.outbox_chat_interval,
+            chat_burst=config.outbox_chat_burst,
+            workers=config.outbox_workers,
+        )
+        self.notifications_interval = config.notifications_interval
+        self.refresh_channel = RefreshChannel(
+            host=config.redis_host,
+            port=config.redis_port,
+            db=config.redis_db,
+            password=config.redis_password,
+            channel=config.refresh_channel,
+        )
+        self.static_data_listener = None
+        if config.static_data_listen_enabled:
+            self.static_data_listener = StaticDataListener(
+                debounce=config.static_data_debounce,
+                health_check_interval=config.static_data_health_check_interval,
+                host=config.db_host,
+                port=config.db_port,
+                user=config.db_user,
+                password=config.db_password,
+                database=config.db_name,
+            )
+
+        self.created_at = time.perf_counter()
+        self.started = asyncio.Event()
+
+    async def _open_database(self):
+        config = self.config
+        self.db = InstrumentedEngine(
+            await init_database(
                 host=config.db_host,
                 port=config.db_port,
                 user=config.db_user,
                 password=config.db_password,
                 database=config.db_name,
+                minsize=config.db_pool_min_size,
+                maxsize=config.db_pool_max_size,
+                timeout=config.db_pool_timeout,
+                pool_recycle=config.db_pool_recycle,
+                statement_timeout=config.db_statement_timeout_ms,
             )
         )
+        await self.db.warm_up()
+        self.registrations = RegistrationQueue(
+            self.db,
+            max_size=config.registration_queue_size,
+            batch_size=config.registration_batch_size,
+            flush_interval=config.registration_flush_interval,
+        )
+        self.broadcaster = Broadcaster(
+            self,
+            self.db,
+            chat_interval=config.broadcast_chat_interval,
+            workers=config.broadcast_workers,
+            batch_size=config.broadcast_batch_size,
+            limiter=self.outbox.limiter,
+        )
+
+    async def _load_funny_photos(self):
+        async with self.db.acquire() as conn:
+            await self.funny_photo_pool.load(conn)
+
+    async def _load_catalog(self):
+        async with self.db.acquire() as conn:
+            await self.catalog.sync(conn)
+
+    async def startup(self, storage=None):
+        """
+        Opens the database and FSM storage pools, then loads static data,
+        funny photos and the post catalog and renders keyboards, all
+        concurrently. Updates wait for it, see StartupGateMiddleware.
+        """
+        started = time.perf_counter()
 
-        # TODO implement this
-        # asyncio.get_event_loop().create_task(self.notify())
-        asyncio.get_event_loop().run_until_complete(self._hello_msg())
-        asyncio.get_event_loop().create_task(self._fetch_static_data_from_db())
+        warm_up = [self._open_database()]
+        if storage is not None:
+            warm_up.append(storage.warm_up())
+        await asyncio.gather(*warm_up)
+
+        loads = [self._fetch_static_data_from_db(), self._load_funny_photos()]
+        if self.catalog:
+            loads.append(self._load_catalog())
+        await asyncio.gather(*loads)
+
+        loop = asyncio.get_event_loop()
+        self.registrations.start()
+        self.outbox.start()
+        loop.create_task(self.refresh_channel.listen(self.on_refresh))
+        if self.static_data_listener:
+            self.static_data_listener.start(self.on_static_data_change)
+        if self.config.notifications_enabled:
+            loop.create_task(self.notify())
+        if self.catalog:
+            loop.create_task(self.catalog.run(self.db, self.catalog_refresh_interval))
+
+        self.started.set()
+        startup_duration.set(time.perf_counter() - started)
+        log.info(f"Started in {time.perf_counter() - started:.2f} s")
+
+        # Nothing waits for it, a failed hello is only counted
+        loop.create_task(self._hello_msg())
 
     async def _hello_msg(self):
-        await self.send_message(chat_id=self.root_id, text="Started")
+        await self.safe_send_message(chat_id=self.root_id, text="Started")
 
-    async def _fetch_static_data_from_db(self):
-        async with self.db.acquire() as conn:
-            all_pet_types = await select_all_pet_types(conn)
-            self.pet_types = []
+    async def _fetch_static_data_from_db(self, tables=STATIC_TABLES):
+        """Reloads the given static tables, all of them by default"""
+
+        async def _fetch(query):
+            # Every query gets its own pooled connection to run concurrently
+            async with self.db.acquire() as conn:
+                return await query(conn)
+
+        queries = []
+        if "pet_types" in tables:
+            queries += [select_all_pet_types, select_pet_types_posts_count]
+        if "locations" in tables:
+            queries.append(select_all_locations)
+        if "bot_texts" in tables:
+            queries.append(select_all_bot_texts)
+
+        snapshot = await asyncio.gather(*[_fetch(q) for q in queries])
+        if None in snapshot:
+            # Queries log their errors, keep the current data
+            return
+        snapshot = iter(snapshot)
+        pet_types, locations, texts = self.pet_types, self.locations, self.texts
+
+        if "pet_types" in tables:
+            all_pet_types, posts_count = next(snapshot), next(snapshot)
+            pet_types = []
             for i in all_pet_types:
-                if not i.nullable_visible:
-                    c = await select_posts_with_filters(conn, pet_type=i.id)
-                    if c.rowcount == 0:
-                        continue
-                self.pet_types.append(i)
+                if not i.nullable_visible and not posts_count.get(i.id):
+                    continue
+                pet_types.append(i)
 
-            self.locations = await select_all_locations(conn)
+        if "locations" in tables:
+            locations = next(snapshot)
 
-            texts = await select_all_bot_texts(conn)
-            for t in texts:
+        if "bot_texts" in tables:
+            texts = dict(messages={}, buttons={})
+            for t in next(snapshot):
                 if t.text_type == TextType.MESSAGE:
-                    self.texts["messages"][t.name] = t.value
+                    texts["messages"][t.name] = t.value
                 if t.text_type == TextType.BUTTON:
-                    self.texts["buttons"][t.name] = t.value
+                    texts["buttons"][t.name] = t.value
+
+        # Swap at once, so handlers never see half-loaded data
+        self.pet_types, self.locations, self.texts = pet_types, locations, texts
+
+        self.keyboards.invalidate()
+        self.keyboards.prerender()
+        self.router.rebuild(self.texts, self.pet_types)
 
     async def refresh(self):
         await self._fetch_static_data_from_db()
         return self.locations, self.pet_types
 
+    async def on_refresh(self, scope):
+        """Refresh requested over the RefreshChannel, by any worker"""
+        await self.refresh()
+        log.info(f"Static data refreshed ({scope})")
+
+    async def on_static_data_change(self, tables):
+        """Tables changed in Postgres, see StaticDataListener"""
+        reloads = []
+        if tables & STATIC_TABLES:
+            reloads.append(self._fetch_static_data_from_db(tables & STATIC_TABLES))
+        if "funny_photos" in tables:
+            reloads.append(self._load_funny_photos())
+        await asyncio.gather(*reloads)
+        log.info(f"Reloaded {', '.join(sorted(tables))}")
+
+    async def shutdown(self):
+        # Replies and registrations left in the queues are written before exit
+        await self.refresh_channel.close()
+        if self.static_data_listener:
+            await self.static_data_listener.close()
+        await self.outbox.close()
+        if self.registrations:
+            await self.registrations.close()
+
     async def notify(self):
-        raise NotImplementedError
-        # while True:
-        #     async with self.db.acquire() as conn:
-        #         pass
-        #     await asyncio.sleep(1)
+        """Broadcast new posts to all users, see Broadcaster"""
+        while True:
+            template = self.texts["messages"].get("new_post_notification")
+            if template:
+                try:
+                    await self.broadcaster.notify_posts(template)
+                except Exception as ex:
+                    log.exception(ex)
+            await asyncio.sleep(self.notifications_interval)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        api_requests.inc(method)
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception as ex:
+            api_errors.inc(method, type(ex).__name__)
+            raise
+        finally:
+            api_duration.observe(time.perf_counter() - started, method)
 
     async def safe_send_message(
         self,
@@ -87,43 +285,37 @@ class ZveroBot(Bot):
         chat_id=None,
         reply_markup=None,
         parse_mode=ParseMode.HTML,
-        **kwargs
+        **kwargs,
     ):
         try:
-            msg = await self.send_message(
-                text=text,
-                chat_id=chat_id,
-                reply_markup=reply_markup,
-                parse_mode=parse_mode,
-                **kwargs
+            msg = await self.outbox.send(
+                chat_id,
+                lambda: self.send_message(
+                    text=text,
+                    chat_id=chat_id,
+                    reply_markup=reply_markup,
+                    parse_mode=parse_mode,
+                    **kwargs,
+                ),
             )
             return msg
-        except BotBlocked:
-            pass
-        except UserDeactivated:
-            pass
-        except ChatNotFound:
-            pass
+        # BotBlocked, UserDeactivated, ChatNotFound are expected,
+        # everything is only counted
         except Exception as ex:
-            pass
+            swallowed_exceptions.inc("send_message", type(ex).__name__)
 
     async def safe_delete_message(self, message_id, chat_id=None):
         if not chat_id:
             chat_id = self.root_id
         try:
-            await self.delete_message(chat_id=chat_id, message_id=message_id)
-        except MessageToDeleteNotFound:
-            pass
-        except MessageCantBeDeleted:
-            pass
-        except BotBlocked:
-            pass
-        except UserDeactivated:
-            pass
-        except ChatNotFound:
-            pass
+            await self.outbox.delete(
+                chat_id,
+                lambda: self.delete_message(chat_id=chat_id, message_id=message_id),
+            )
+        # MessageToDeleteNotFound, MessageCantBeDeleted, BotBlocked,
+        # UserDeactivated, ChatNotFound are expected
         except Exception as ex:
-            pass
+            swallowed_exceptions.inc("delete_message", type(ex).__name__)
 
     async def safe_edit_message(
         self,
@@ -135,31 +327,24 @@ class ZveroBot(Bot):
     ):
         if not chat_id:
             chat_id = self.root_id
+        if text:
+            method = "editMessageText"
+            call = lambda: self.edit_message_text(
+                message_id=message_id,
+                chat_id=chat_id,
+                text=text,
+                reply_markup=reply_markup,
+                parse_mode=parse_mode,
+            )
+        else:
+            method = "editMessageReplyMarkup"
+            call = lambda: self.edit_message_reply_markup(
+                message_id=message_id, chat_id=chat_id, reply_markup=reply_markup
+            )
         try:
-            if text:
-                await self.edit_message_text(
-                    message_id=message_id,
-                    chat_id=chat_id,
-                    text=text,
-                    reply_markup=reply_markup,
-                    parse_mode=parse_mode,
-                )
-            else:
-                await self.edit_message_reply_markup(
-                    message_id=message_id, chat_id=chat_id, reply_markup=reply_markup
-                )
-
-        except MessageCantBeEdited:
-            pass
-        except MessageNotModified:
-            pass
-        except MessageToEditNotFound:
-            pass
-        except BotBlocked:
-            pass
-        except UserDeactivated:
-            pass
-        except ChatNotFound:
-            pass
+            # A newer edit of the same message and method replaces a queued one
+            await self.outbox.edit(chat_id, message_id, call, method)
+        # MessageCantBeEdited, MessageNotModified, MessageToEditNotFound,
+        # BotBlocked, UserDeactivated, ChatNotFound are expected
         except Exception as ex:
-            pass
+            swallowed_exceptions.inc("edit_message", type(ex).__name__)
@@ -0,0 +1,5 @@
+import sys
+
+from src.app import run_worker
+
+run_worker(int(sys.argv[1]))
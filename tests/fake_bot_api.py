@@ -0,0 +1,290 @@
+"""
+Local stand-in for the Bot API methods ZveroBot uses.
+
+Serves /bot<token>/<method> like api.telegram.org, so a bot created
+with api_url (BOT_API_URL) talks to it instead of Telegram. Messages are
+kept per chat, edits and deletions of unknown messages fail like the
+real API does. Every call is recorded with its parameters.
+
+Latency, server errors and 429 answers can be injected to benchmark
+end-to-end latency and flood handling offline.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from aiohttp import web
+
+BAD_REQUEST = 400
+NOT_FOUND = 404
+TOO_MANY_REQUESTS = 429
+INTERNAL_SERVER_ERROR = 500
+
+
+class Call:
+    __slots__ = ("method", "params", "time", "status")
+
+    def __init__(self, method, params, time, status):
+        self.method = method
+        self.params = params
+        self.time = time
+        self.status = status
+
+    def __repr__(self):
+        return f"Call({self.method}, {self.params}, status={self.status})"
+
+
+class ApiError(Exception):
+    def __init__(self, status, description, parameters=None):
+        super().__init__(description)
+        self.status = status
+        self.description = description
+        self.parameters = parameters
+
+
+class FakeBotApi:
+    """
+    `latency` seconds (plus up to `jitter`) are added to every answer.
+    `error_rate` and `flood_rate` are probabilities of an internal error
+    and of a 429 with `retry_after`, getUpdates is never failed.
+    fail() scripts errors for the next calls of a method.
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        flood_rate=0.0,
+        retry_after=1,
+        rnd_seed=0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.rnd = random.Random(rnd_seed)
+
+        self.calls = []
+        self.messages = dict()
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._scripted = dict()
+
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._new_update = asyncio.Event()
+
+        self._runner = None
+        self.url = None
+
+        self._methods = dict(
+            getMe=self.get_me,
+            getWebhookInfo=self.get_webhook_info,
+            setWebhook=self.set_webhook,
+            deleteWebhook=self.delete_webhook,
+            getUpdates=self.get_updates,
+            sendMessage=self.send_message,
+            editMessageText=self.edit_message_text,
+            editMessageReplyMarkup=self.edit_message_reply_markup,
+            deleteMessage=self.delete_message,
+            sendPhoto=self.send_photo,
+            answerCallbackQuery=self.answer_callback_query,
+            forwardMessage=self.forward_message,
+        )
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handler)
+        app.router.add_get("/bot{token}/{method}", self._handler)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Serves in the running loop, returns the url for api_url"""
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def calls_of(self, method):
+        return [c for c in self.calls if c.method == method]
+
+    def fail(self, method, status, description, times=1, retry_after=None):
+        """The next `times` calls of the method answer with this error"""
+        parameters = dict(retry_after=retry_after) if retry_after else None
+        error = ApiError(status, description, parameters)
+        self._scripted.setdefault(method, []).extend([error] * times)
+
+    def push_update(self, **update):
+        """Queues an update for getUpdates, update_id is set if missing"""
+        update.setdefault("update_id", next(self._update_ids))
+        self._updates.append(update)
+        self._new_update.set()
+        return update
+
+    async def _params(self, request):
+        if request.method == "GET":
+            raw = dict(request.query)
+        else:
+            raw = dict(await request.post())
+        params = dict()
+        for key, value in raw.items():
+            if isinstance(value, web.FileField):
+                params[key] = dict(filename=value.filename, size=len(value.file.read()))
+            elif isinstance(value, str) and value[:1] in "[{":
+                # aiogram sends keyboards and entities as JSON strings
+                params[key] = json.loads(value)
+            else:
+                params[key] = value
+        return params
+
+    def _injected_error(self, method):
+        scripted = self._scripted.get(method)
+        if scripted:
+            return scripted.pop(0)
+        if method == "getUpdates":
+            return None
+        if self.flood_rate and self.rnd.random() < self.flood_rate:
+            return ApiError(
+                TOO_MANY_REQUESTS,
+                f"Too Many Requests: retry after {self.retry_after}",
+                dict(retry_after=self.retry_after),
+            )
+        if self.error_rate and self.rnd.random() < self.error_rate:
+            return ApiError(INTERNAL_SERVER_ERROR, "Internal Server Error")
+
+    async def _handler(self, request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+        call = Call(method, params, time.monotonic(), 200)
+        self.calls.append(call)
+
+        delay = self.latency + (self.rnd.random() * self.jitter if self.jitter else 0)
+        if delay and method != "getUpdates":
+            await asyncio.sleep(delay)
+
+        try:
+            error = self._injected_error(method)
+            if error:
+                raise error
+            if method not in self._methods:
+                raise ApiError(NOT_FOUND, "Not Found: method not found")
+            result = await self._methods[method](params)
+        except ApiError as ex:
+            call.status = ex.status
+            body = dict(ok=False, error_code=ex.status, description=ex.description)
+            if ex.parameters:
+                body["parameters"] = ex.parameters
+            return web.json_response(body, status=ex.status)
+        return web.json_response(dict(ok=True, result=result))
+
+    def _message(self, chat_id, **fields):
+        message = dict(
+            message_id=next(self._message_ids),
+            date=int(time.time()),
+            chat=dict(id=int(chat_id), type="private"),
+            **fields,
+        )
+        self.messages[(int(chat_id), message["message_id"])] = message
+        return message
+
+    def _existing(self, params, description):
+        key = (int(params["chat_id"]), int(params["message_id"]))
+        if key not in self.messages:
+            raise ApiError(BAD_REQUEST, f"Bad Request: {description}")
+        return self.messages[key]
+
+    async def get_me(self, params):
+        return dict(id=1, is_bot=True, first_name="FakeBot", username="fake_bot")
+
+    async def get_webhook_info(self, params):
+        return dict(url="", has_custom_certificate=False, pending_update_count=0)
+
+    async def set_webhook(self, params):
+        return True
+
+    async def delete_webhook(self, params):
+        return True
+
+    async def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        # Confirmed updates are dropped like in the real API
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+    async def send_message(self, params):
+        if not params.get("text"):
+            raise ApiError(BAD_REQUEST, "Bad Request: message text is empty")
+        fields = dict(text=params["text"])
+        if params.get("reply_markup"):
+            fields["reply_markup"] = params["reply_markup"]
+        return self._message(params["chat_id"], **fields)
+
+    async def edit_message_text(self, params):
+        message = self._existing(params, "message to edit not found")
+        markup = params.get("reply_markup")
+        if message.get("text") == params.get("text") and message.get(
+            "reply_markup"
+        ) == (markup or None):
+            raise ApiError(
+                BAD_REQUEST,
+                "Bad Request: message is not modified: specified new message "
+                "content and reply markup are exactly the same as a current "
+                "content and reply markup of the message",
+            )
+        message["text"] = params.get("text")
+        message.pop("reply_markup", None)
+        if markup:
+            message["reply_markup"] = markup
+        return message
+
+    async def edit_message_reply_markup(self, params):
+        message = self._existing(params, "message to edit not found")
+        message.pop("reply_markup", None)
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    async def delete_message(self, params):
+        self._existing(params, "message to delete not found")
+        del self.messages[(int(params["chat_id"]), int(params["message_id"]))]
+        return True
+
+    async def send_photo(self, params):
+        file_id = f"fake-photo-{next(self._file_ids)}"
+        if isinstance(params.get("photo"), str):
+            file_id = params["photo"]
+        size = dict(file_id=file_id, file_unique_id=file_id, width=1, height=1)
+        fields = dict(photo=[size])
+        if params.get("caption"):
+            fields["caption"] = params["caption"]
+        return self._message(params["chat_id"], **fields)
+
+    async def answer_callback_query(self, params):
+        return True
+
+    async def forward_message(self, params):
+        original = self.messages.get(
+            (int(params["from_chat_id"]), int(params["message_id"]))
+        )
+        fields = {k: v for k, v in (original or {}).items() if k in ("text", "photo")}
+        return self._message(params["chat_id"], **fields)
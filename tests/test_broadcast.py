@@ -0,0 +1,173 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter, BotBlocked
+
+from src.config import Config
+from src.db.queries import *
+from src.tg.broadcast import Broadcaster
+from src.tg.ratelimit import TokenBucket, ChatRateLimiter
+
+config = Config()
+config.with_env()
+
+FIRST_USER_ID = 2000000000
+USERS_COUNT = 40
+
+
+class RecordingBot:
+    def __init__(self, blocked=()):
+        self.sent = []
+        self.blocked = blocked
+        self.flood_once = True
+
+    async def send_message(self, chat_id, text):
+        if self.flood_once and len(self.sent) == 5:
+            self.flood_once = False
+            raise RetryAfter(1)
+        if chat_id in self.blocked:
+            raise BotBlocked("Forbidden: bot was blocked by the user")
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+@pytest.mark.asyncio
+async def test_rate_limiters():
+    bucket = TokenBucket(rate=10, capacity=2)
+    started = time.monotonic()
+    for _ in range(6):
+        await bucket.acquire()
+    # 2 at once, then 4 more at 10 per second
+    assert 0.35 < time.monotonic() - started < 0.6
+
+    bucket.pause(0.3)
+    assert bucket.paused
+    started = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - started >= 0.3
+
+    chats = ChatRateLimiter(interval=0.2)
+    started = time.monotonic()
+    await chats.acquire(1)
+    await chats.acquire(2)
+    assert time.monotonic() - started < 0.1
+    await chats.acquire(1)
+    assert time.monotonic() - started >= 0.2
+
+
+@pytest.mark.asyncio
+async def test_broadcast():
+    engine = await init_database(
+        host=config.db_host,
+        port=config.db_port,
+        user=config.db_user,
+        password=config.db_password,
+        database=config.db_name,
+    )
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + USERS_COUNT))
+
+    async with engine.acquire() as conn:
+        await conn.execute(delete(TelegramUser).where(TelegramUser.id >= FIRST_USER_ID))
+        await conn.execute(insert(TelegramUser).values([{"id": i} for i in user_ids]))
+
+    bot = RecordingBot(blocked={user_ids[7]})
+    broadcaster = Broadcaster(bot, engine, rate=20, workers=4, batch_size=10)
+    checkpoints = []
+
+    async def _checkpoint(last_user_id):
+        checkpoints.append(last_user_id)
+
+    started = time.monotonic()
+    result = await broadcaster.broadcast(
+        "hello", after_id=FIRST_USER_ID - 1, on_checkpoint=_checkpoint
+    )
+    elapsed = time.monotonic() - started
+
+    assert result == (USERS_COUNT - 1, 1)
+    assert sorted(i[0] for i in bot.sent) == sorted(set(user_ids) - {user_ids[7]})
+    assert checkpoints == user_ids[9::10]
+
+    # 20 sent at once, RetryAfter stops everything for 1s, the rest go at 20/s
+    assert elapsed > 1.9
+    sent_at = sorted(i[2] for i in bot.sent)
+    for a, b in zip(sent_at, sent_at[20:]):
+        assert b - a >= 0.95
+
+    # Restart from the checkpoint sends only the rest
+    bot.sent = []
+    result = await broadcaster.broadcast("hello", after_id=user_ids[29])
+    assert result == (10, 0)
+    assert sorted(i[0] for i in bot.sent) == user_ids[30:]
+
+    async with engine.acquire() as conn:
+        await conn.execute(delete(TelegramUser).where(TelegramUser.id >= FIRST_USER_ID))
+
+
+@pytest.mark.asyncio
+async def test_notify_posts_once():
+    # Every process of the multi-process mode runs its own broadcaster
+    engines = [
+        await init_database(
+            host=config.db_host,
+            port=config.db_port,
+            user=config.db_user,
+            password=config.db_password,
+            database=config.db_name,
+        )
+        for _ in range(2)
+    ]
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + USERS_COUNT))
+
+    async with engines[0].acquire() as conn:
+
+        async def _clear():
+            await conn.execute(delete(Post).where(Post.title.like("NotifyPet%")))
+            await conn.execute(delete(Location).where(Location.name == "NotifyCity"))
+            await conn.execute(delete(PetType).where(PetType.name == "NotifyType"))
+            await conn.execute(
+                delete(TelegramUser).where(TelegramUser.id >= FIRST_USER_ID)
+            )
+
+        await _clear()
+        await conn.execute(insert(TelegramUser).values([{"id": i} for i in user_ids]))
+        location_id = await conn.scalar(
+            insert(Location).values(name="NotifyCity").returning(Location.id)
+        )
+        pet_type_id = await conn.scalar(
+            insert(PetType).values(name="NotifyType").returning(PetType.id)
+        )
+        await conn.execute(
+            insert(Post).values(
+                [
+                    {
+                        "title": f"NotifyPet{n}",
+                        "location_id": location_id,
+                        "pet_type_id": pet_type_id,
+                        "visible": True,
+                    }
+                    for n in range(2)
+                ]
+            )
+        )
+
+    bots = [RecordingBot(), RecordingBot()]
+    for bot in bots:
+        bot.flood_once = False
+    broadcasters = [
+        Broadcaster(bot, engine, rate=1000, chat_interval=0, batch_size=10)
+        for bot, engine in zip(bots, engines)
+    ]
+    await asyncio.gather(*[b.notify_posts("{1}") for b in broadcasters])
+    # Nothing is left for a later round
+    await asyncio.gather(*[b.notify_posts("{1}") for b in broadcasters])
+
+    sent = [(i[0], i[1]) for bot in bots for i in bot.sent if i[0] in user_ids]
+    assert sorted(sent) == sorted(
+        (user_id, f"NotifyPet{n}") for user_id in user_ids for n in range(2)
+    )
+
+    async with engines[0].acquire() as conn:
+        await _clear()
+    for engine in engines:
+        engine.close()
+        await engine.wait_closed()
@@ -0,0 +1,142 @@
+import itertools
+
+import pytest
+from src.config import Config
+from src.db.queries import *
+from src.db.catalog import PostCatalog
+
+config = Config()
+config.with_env()
+
+
+@pytest.mark.asyncio
+async def test_catalog_matches_sql():
+    engine = await init_database(
+        host=config.db_host,
+        port=config.db_port,
+        user=config.db_user,
+        password=config.db_password,
+        database=config.db_name,
+    )
+
+    async with engine.acquire() as conn:
+
+        async def _clear():
+            await conn.execute(delete(Post).where(Post.title.like("CatalogPet%")))
+            await conn.execute(
+                delete(Location).where(Location.name.like("CatalogCity%"))
+            )
+            await conn.execute(delete(PetType).where(PetType.name.like("CatalogType%")))
+
+        await _clear()
+
+        location_ids = []
+        for name in ("CatalogCity1", "CatalogCity2"):
+            await conn.execute(insert(Location).values({Location.name: name}))
+            cursor = await conn.execute(
+                select([Location.id]).where(Location.name == name)
+            )
+            location_ids.append((await cursor.fetchone()).id)
+
+        pet_type_ids = []
+        for name in ("CatalogType1", "CatalogType2"):
+            await conn.execute(
+                insert(PetType).values({PetType.name: name, PetType.emoji: ":)"})
+            )
+            cursor = await conn.execute(
+                select([PetType.id]).where(PetType.name == name)
+            )
+            pet_type_ids.append((await cursor.fetchone()).id)
+
+        for n in range(24):
+            category = CATEGORIES[n % 4]
+            await conn.execute(
+                insert(Post).values(
+                    {
+                        Post.title: f"CatalogPet{n}",
+                        Post.location_id: location_ids[n % 2],
+                        Post.pet_type_id: pet_type_ids[(n // 2) % 2],
+                        Post.visible: n % 5 != 0,
+                        getattr(Post, category): "" if n % 7 == 0 else "text",
+                        getattr(Post, f"{category}_visible"): n % 3 != 0,
+                    }
+                )
+            )
+
+        catalog = PostCatalog()
+        await catalog.load(conn)
+
+        cursor = await select_posts_with_filters(conn)
+        all_ids = [i.id for i in await cursor.fetchall()]
+        assert len(catalog) == len(all_ids)
+
+        pivot = all_ids[len(all_ids) // 2]
+
+        for category, pet_type, location, direction in itertools.product(
+            (None, *CATEGORIES),
+            (None, *pet_type_ids),
+            (None, *location_ids),
+            (None, "<", ">"),
+        ):
+            filters = dict(category=category, pet_type=pet_type, location=location)
+            if direction:
+                filters.update(direction=direction, post_id=pivot)
+
+            cursor = await select_posts_with_filters(conn, **filters)
+            sql_ids = [i.id for i in await cursor.fetchall()]
+            catalog_ids = [i.id for i in catalog.select_posts_with_filters(**filters)]
+
+            assert catalog_ids == sql_ids
+            first = catalog.first(**filters)
+            assert (first.id if first else None) == (sql_ids[0] if sql_ids else None)
+
+            page = await select_post_page(conn, **filters)
+            catalog_page = catalog.select_post_page(**filters)
+            if page is None:
+                assert catalog_page is None
+                continue
+
+            cursor = await select_posts_with_filters(
+                conn, category=category, pet_type=pet_type, location=location
+            )
+            filter_ids = [i.id for i in await cursor.fetchall()]
+            # Nothing left in the direction falls back to the first post
+            expected_id = sql_ids[0] if sql_ids else filter_ids[0]
+
+            assert page.post.id == catalog_page.post.id == expected_id
+            assert (
+                page.has_prev == catalog_page.has_prev == (expected_id != filter_ids[0])
+            )
+            assert (
+                page.has_next
+                == catalog_page.has_next
+                == (expected_id != filter_ids[-1])
+            )
+
+        # Callback data brings ids as strings
+        assert catalog.first(
+            category="need_home", location=str(location_ids[0])
+        ) == catalog.first(category="need_home", location=location_ids[0])
+
+        await conn.execute(
+            insert(Post).values(
+                {
+                    Post.title: "CatalogPetNew",
+                    Post.location_id: location_ids[0],
+                    Post.pet_type_id: pet_type_ids[0],
+                    Post.visible: True,
+                    Post.need_money: "text",
+                    Post.need_money_visible: True,
+                }
+            )
+        )
+        await catalog.load_delta(conn)
+
+        cursor = await select_posts_with_filters(conn, category="need_money")
+        sql_ids = [i.id for i in await cursor.fetchall()]
+        assert [
+            i.id for i in catalog.select_posts_with_filters(category="need_money")
+        ] == sql_ids
+        assert catalog.first(category="need_money", post_id=sql_ids[-1], direction="<")
+
+        await _clear()
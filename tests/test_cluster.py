@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher, types
+
+from src.config import Config
+from src.tg.cluster import ShardRouter, make_front_app, shard_of
+from src.tg.refresh import RefreshChannel
+from src.tg.webhook import SECRET_TOKEN_HEADER, make_webhook_app
+
+TOKEN = "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+
+config = Config()
+config.with_env()
+
+
+def _update(update_id, user_id, text="hi"):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+def _worker_app(received):
+    async def update_handler(request: web.Request):
+        received.append(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post("/update", update_handler)
+    return app
+
+
+@pytest.mark.asyncio
+async def test_front_end_sharding():
+    received = [[], []]
+    workers = [TestServer(_worker_app(r)) for r in received]
+    for w in workers:
+        await w.start_server()
+
+    router = ShardRouter([str(w.make_url("/update")) for w in workers])
+    router.start()
+    client = TestClient(TestServer(make_front_app(router, "/webhook", "s3cr3t")))
+    await client.start_server()
+
+    resp = await client.post("/webhook", json=_update(1, 10))
+    assert resp.status == 403
+
+    updates = [_update(i, 10 + i % 4) for i in range(20)]
+    for u in updates:
+        resp = await client.post(
+            "/webhook", json=u, headers={SECRET_TOKEN_HEADER: "s3cr3t"}
+        )
+        assert resp.status == 200
+    await router.close()
+
+    for shard, got in enumerate(received):
+        assert got == [u for u in updates if shard_of(u, 2) == shard]
+    # Every user is served by one worker
+    assert {u["message"]["from"]["id"] for u in received[0]}.isdisjoint(
+        u["message"]["from"]["id"] for u in received[1]
+    )
+
+    await client.close()
+    for w in workers:
+        await w.close()
+
+
+@pytest.mark.asyncio
+async def test_webhook_keeps_user_order():
+    dp = Dispatcher(Bot(TOKEN))
+    handled = []
+
+    @dp.message_handler()
+    async def slow_handler(message: types.Message):
+        # The first update of a user is the slowest one
+        await asyncio.sleep(0.1 if message.text == "first" else 0)
+        handled.append((message.from_user.id, message.text))
+
+    client = TestClient(TestServer(make_webhook_app(dp, "/update")))
+    await client.start_server()
+    for update_id, user_id, text in [(1, 1, "first"), (2, 2, "other"), (3, 1, "next")]:
+        await client.post("/update", json=_update(update_id, user_id, text))
+    await client.close()
+
+    assert handled == [(2, "other"), (1, "first"), (1, "next")]
+    await dp.bot.close()
+
+
+@pytest.mark.asyncio
+async def test_refresh_channel():
+    refreshed = [[], []]
+    workers = [
+        RefreshChannel(host=config.redis_host, port=config.redis_port, channel="test")
+        for _ in refreshed
+    ]
+
+    async def _listen(channel, log):
+        async def _on_refresh(scope):
+            log.append(scope)
+
+        await channel.listen(_on_refresh)
+
+    listeners = [
+        asyncio.ensure_future(_listen(channel, log))
+        for channel, log in zip(workers, refreshed)
+    ]
+    for channel in workers:
+        await asyncio.wait_for(channel.subscribed.wait(), 5)
+
+    assert await workers[0].publish() == 2
+    for _ in range(50):
+        if all(refreshed):
+            break
+        await asyncio.sleep(0.02)
+    assert refreshed == [["all"], ["all"]]
+
+    for channel in workers:
+        await channel.close()
+    await asyncio.wait_for(asyncio.gather(*listeners), 5)
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+from aiogram import types
+from aiogram.utils.exceptions import (
+    MessageNotModified,
+    MessageToEditNotFound,
+    MessageToDeleteNotFound,
+    RetryAfter,
+)
+
+from src.tg.bot_api import ApiUrlBot
+from src.tg.outbox import Outbox
+from tests.fake_bot_api import FakeBotApi
+
+TOKEN = "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+
+
+@pytest.mark.asyncio
+async def test_fake_bot_api_messages():
+    api = FakeBotApi()
+    bot = ApiUrlBot(TOKEN, api_url=await api.start())
+
+    kb = types.InlineKeyboardMarkup()
+    kb.row(types.InlineKeyboardButton(text="Next", callback_data=">,need_home,1,1,15"))
+    msg = await bot.send_message(chat_id=42, text="Post", reply_markup=kb)
+    assert msg.chat.id == 42 and msg.text == "Post"
+
+    edited = await bot.edit_message_text(
+        chat_id=42, message_id=msg.message_id, text="Next post", reply_markup=kb
+    )
+    assert edited.text == "Next post"
+    with pytest.raises(MessageNotModified):
+        await bot.edit_message_text(
+            chat_id=42, message_id=msg.message_id, text="Next post", reply_markup=kb
+        )
+    with pytest.raises(MessageToEditNotFound):
+        await bot.edit_message_reply_markup(chat_id=42, message_id=100)
+
+    photo = await bot.send_photo(chat_id=42, photo="file-id", caption="Cat")
+    assert photo.photo[-1].file_id == "file-id"
+    forwarded = await bot.forward_message(
+        chat_id=-1, from_chat_id=42, message_id=photo.message_id
+    )
+    assert forwarded.photo[-1].file_id == "file-id"
+
+    assert await bot.delete_message(chat_id=42, message_id=msg.message_id)
+    with pytest.raises(MessageToDeleteNotFound):
+        await bot.delete_message(chat_id=42, message_id=msg.message_id)
+
+    assert [c.method for c in api.calls] == [
+        "sendMessage",
+        "editMessageText",
+        "editMessageText",
+        "editMessageReplyMarkup",
+        "sendPhoto",
+        "forwardMessage",
+        "deleteMessage",
+        "deleteMessage",
+    ]
+    assert (
+        api.calls[0].params["reply_markup"]["inline_keyboard"][0][0]["text"] == "Next"
+    )
+    assert [c.status for c in api.calls_of("deleteMessage")] == [200, 400]
+
+    api.push_update(message=msg.to_python())
+    updates = await bot.get_updates(offset=0, timeout=1)
+    assert [u.message.text for u in updates] == ["Post"]
+    assert await bot.get_updates(offset=updates[-1].update_id + 1) == []
+
+    await bot.close()
+    await api.close()
+
+
+@pytest.mark.asyncio
+async def test_fake_bot_api_flood_control():
+    api = FakeBotApi(latency=0.01)
+    bot = ApiUrlBot(TOKEN, api_url=await api.start())
+
+    api.fail("sendMessage", 429, "Too Many Requests: retry after 1", retry_after=1)
+    with pytest.raises(RetryAfter):
+        await bot.send_message(chat_id=42, text="Hi")
+
+    api.fail("sendMessage", 429, "Too Many Requests: retry after 1", retry_after=1)
+    outbox = Outbox(rate=100, chat_interval=0, workers=1)
+    outbox.start()
+    started = time.monotonic()
+    msg = await outbox.send(42, lambda: bot.send_message(chat_id=42, text="Hi"))
+    assert msg.text == "Hi"
+    assert time.monotonic() - started >= 1
+    assert [c.status for c in api.calls_of("sendMessage")] == [429, 429, 200]
+    await outbox.close()
+
+    await bot.close()
+    await api.close()
@@ -0,0 +1,181 @@
+import json
+
+import pytest
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+
+from src.tg.bot_api import ApiUrlBot
+from src.config import Config
+from src.tg.fsm_storage import (
+    BatchedRedisStorage,
+    CompactCodec,
+    CompactRedisStorage,
+    RedisBackend,
+    StateSessionMiddleware,
+)
+from src.tg.user_states import UserStates
+from src.utils import default_user_data
+
+config = Config()
+config.with_env()
+
+TOKEN = "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+
+
+class CountingBackend:
+    """Redis commands on a dict, counting round-trips"""
+
+    def __init__(self):
+        self.values = dict()
+        self.round_trips = 0
+
+    async def execute(self, commands):
+        self.round_trips += 1
+        results = []
+        for command, key, *args in commands:
+            if command == "get":
+                results.append(self.values.get(key))
+            elif command == "set":
+                self.values[key] = args[0]
+                results.append(True)
+            elif command == "expire":
+                results.append(int(key in self.values))
+            else:
+                results.append(int(self.values.pop(key, None) is not None))
+        return results
+
+    async def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def _message_update(update_id, text):
+    return types.Update(
+        **{
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": 42, "type": "private"},
+                "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+                "text": text,
+            },
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_state_session():
+    backend = CountingBackend()
+    storage = BatchedRedisStorage(backend=backend)
+    bot = ApiUrlBot(TOKEN, api_url="http://localhost")
+    dp = Dispatcher(bot, storage=storage)
+    dp.middleware.setup(StateSessionMiddleware(storage))
+    Dispatcher.set_current(dp)
+
+    @dp.message_handler(commands=["start"], state="*")
+    async def start_handler(message: types.Message, state: FSMContext):
+        await state.set_data(default_user_data)
+        await UserStates.start.set()
+
+    @dp.message_handler(state=UserStates.start)
+    async def choose_handler(message: types.Message, state: FSMContext):
+        # Same calls as help_choose_handler -> post_view_build
+        user_data = await state.get_data()
+        await state.set_data({**user_data, "msg_with_kb_id": 0})
+        await state.update_data({"category_cache": message.text})
+        await state.update_data({"pet_type_cache": None})
+        await UserStates.post_view.set()
+        user_data = await state.get_data()
+        await state.update_data({"msg_with_kb_id": user_data["msg_with_kb_id"] + 1})
+
+    await dp.process_updates([_message_update(1, "/start")])
+    assert backend.round_trips == 2
+    assert await storage.get_state(chat=42) == UserStates.start.state
+
+    backend.round_trips = 0
+    await dp.process_updates([_message_update(2, "need_home")])
+    assert backend.round_trips == 2
+
+    assert await storage.get_state(chat=42, user=42) == UserStates.post_view.state
+    data = await storage.get_data(chat=42, user=42)
+    assert data["category_cache"] == "need_home"
+    assert data["msg_with_kb_id"] == 1
+    assert data["last_user_upload"] == 0
+
+    # Without a session changes are written at once
+    await storage.update_data(chat=42, user=42, data={"msg_with_kb_id": 5})
+    await storage.reset_state(chat=42, user=42)
+    assert backend.values == {}
+
+    await bot.close()
+
+
+def test_compact_codec():
+    codec = CompactCodec(default_user_data)
+
+    data = dict(default_user_data, msg_with_kb_id=12345, category_cache="need_home")
+    packed = codec.encode(UserStates.post_view.state, data)
+    assert codec.decode(packed) == (UserStates.post_view.state, data)
+    assert len(packed) < len(json.dumps(data)) / 2
+
+    # Missing fields stay missing, unknown keys are kept
+    assert codec.decode(codec.encode(None, {})) == (None, {})
+    data = {"last_user_upload": 1600000000, "other": [1]}
+    assert codec.decode(codec.encode(None, data)) == (None, data)
+
+
+@pytest.mark.asyncio
+async def test_compact_storage():
+    backend = CountingBackend()
+    legacy = BatchedRedisStorage(backend=backend)
+    storage = CompactRedisStorage(backend=backend, fields=default_user_data, ttl=60)
+
+    await legacy.set_state(user=42, state=UserStates.about)
+    await legacy.set_data(user=42, data={"msg_with_kb_id": 7})
+
+    # Old keys are read and moved to the compact one on write
+    storage.begin()
+    assert await storage.get_state(user=42) == UserStates.about.state
+    await storage.update_data(user=42, category_cache="need_temp")
+    await storage.commit()
+    assert list(backend.values) == ["fsm:42:42"]
+    assert await storage.get_data(user=42) == {
+        "msg_with_kb_id": 7,
+        "category_cache": "need_temp",
+    }
+
+    # Read-only update only prolongs the session
+    backend.round_trips = 0
+    storage.begin()
+    await storage.get_state(user=42)
+    await storage.commit()
+    assert backend.round_trips == 2
+
+    await storage.finish(user=42)
+    assert backend.values == {}
+
+
+@pytest.mark.asyncio
+async def test_compact_storage_ttl():
+    backend = RedisBackend(config.redis_host, config.redis_port, config.redis_db)
+    storage = CompactRedisStorage(
+        prefix="test_fsm", backend=backend, fields=default_user_data, ttl=60
+    )
+    redis = await backend.redis()
+
+    storage.begin()
+    await storage.set_state(user=42, state=UserStates.start)
+    await storage.set_data(user=42, data=default_user_data)
+    await storage.commit()
+
+    assert 0 < await redis.ttl("test_fsm:42:42") <= 60
+    assert await storage.get_data(user=42) == default_user_data
+
+    await storage.finish(user=42)
+    assert not await redis.exists("test_fsm:42:42")
+
+    await storage.close()
+    await storage.wait_closed()
@@ -0,0 +1,159 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from aiogram import types
+
+from src.config import Config
+from src.db.queries import *
+from src.db.photo_pool import FunnyPhotoPool
+from src.tg.funny_photos import FunnyPhotoFiles
+
+config = Config()
+config.with_env()
+
+USER_ID = 667
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append(photo)
+        return SimpleNamespace(
+            photo=[SimpleNamespace(file_id=f"file-{len(self.sent)}")]
+        )
+
+
+@pytest.mark.asyncio
+async def test_funny_photo_file_id(tmp_path):
+    engine = await init_database(
+        host=config.db_host,
+        port=config.db_port,
+        user=config.db_user,
+        password=config.db_password,
+        database=config.db_name,
+    )
+    filename = uuid.uuid4()
+    (tmp_path / f"{filename}.png").write_bytes(b"png")
+
+    async with engine.acquire() as conn:
+
+        async def _clear():
+            await conn.execute(
+                delete(FunnyPhoto).where(FunnyPhoto.upload_by_id == USER_ID)
+            )
+            await conn.execute(delete(TelegramUser).where(TelegramUser.id == USER_ID))
+
+        async def _select_photo():
+            cursor = await conn.execute(
+                select([FunnyPhoto]).where(FunnyPhoto.filename == filename)
+            )
+            return await cursor.fetchone()
+
+        await _clear()
+        await conn.execute(insert(TelegramUser).values({"id": USER_ID}))
+        await insert_photo(conn, filename, USER_ID)
+
+        bot = RecordingBot()
+        files = FunnyPhotoFiles(str(tmp_path))
+
+        photo = await _select_photo()
+        assert photo.telegram_file_id is None
+
+        # Uploaded once, then sent by file_id
+        await files.send(bot, conn, chat_id=1, photo=photo)
+        await files.send(bot, conn, chat_id=1, photo=photo)
+        assert isinstance(bot.sent[0], types.InputFile)
+        assert bot.sent[1] == "file-1"
+
+        # file_id survives restart in the database
+        photo = await _select_photo()
+        assert photo.telegram_file_id == "file-1"
+        await FunnyPhotoFiles(str(tmp_path)).send(bot, conn, chat_id=1, photo=photo)
+        assert bot.sent[2] == "file-1"
+
+        await _clear()
+
+
+def test_funny_photo_pool_choice():
+    pool = FunnyPhotoPool(history=3)
+    for photo_id in range(1, 6):
+        pool.add(photo_id)
+    pool.remove(2)
+    pool.remove(42)
+    assert len(pool) == 4 and 2 not in pool
+    assert sorted(pool._ids) == [1, 3, 4, 5]
+
+    # 3 recent photos of 4 are skipped, so every 4 picks are all photos
+    picks = [pool.choice(user_id=1) for _ in range(40)]
+    for n in range(0, 40, 4):
+        assert len(set(picks[n : n + 4])) == 4
+
+    # Pool no bigger than history still gives photos
+    small = FunnyPhotoPool(history=3)
+    small.add(7)
+    assert [small.choice(user_id=1) for _ in range(3)] == [7, 7, 7]
+
+
+@pytest.mark.asyncio
+async def test_funny_photo_pool():
+    engine = await init_database(
+        host=config.db_host,
+        port=config.db_port,
+        user=config.db_user,
+        password=config.db_password,
+        database=config.db_name,
+    )
+
+    async with engine.acquire() as conn:
+
+        async def _clear():
+            await conn.execute(
+                delete(FunnyPhoto).where(FunnyPhoto.upload_by_id == USER_ID)
+            )
+            await conn.execute(delete(TelegramUser).where(TelegramUser.id == USER_ID))
+
+        await _clear()
+        await conn.execute(insert(TelegramUser).values({"id": USER_ID}))
+
+        async def _approve(photo_id, approved):
+            await conn.execute(
+                update(FunnyPhoto)
+                .values({FunnyPhoto.approved: approved})
+                .where(FunnyPhoto.id == photo_id)
+            )
+
+        first = await insert_photo(conn, uuid.uuid4(), USER_ID)
+        second = await insert_photo(conn, uuid.uuid4(), USER_ID)
+        await _approve(first.id, True)
+        await _approve(second.id, True)
+
+        pool = FunnyPhotoPool()
+        await pool.load(conn)
+        assert pool.loaded
+        assert first.id in pool and second.id in pool
+
+        await _approve(first.id, False)
+        await pool.load(conn)
+        assert first.id not in pool and second.id in pool
+
+        pool = FunnyPhotoPool()
+        pool.loaded = True
+        pool.add(second.id)
+        for _ in range(5):
+            assert (await pool.select_random(conn, USER_ID)).id == second.id
+
+        # A failed query is not a missing photo, the pool is kept
+        broken = await engine.acquire()
+        await broken.close()
+        assert await pool.select_random(broken) is None
+        assert second.id in pool
+
+        # Disapproved outside of the bot
+        await _approve(second.id, False)
+        assert await pool.select_random(conn) is None
+        assert len(pool) == 0
+
+        await _clear()
@@ -0,0 +1,151 @@
+import json
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from src.config import Config
+from src.db.queries import *
+from src.db.queries import _posts_with_filters_query
+
+config = Config()
+config.with_env()
+
+POSTS_COUNT = 20000
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+async def _explain(conn, q):
+    sql = q.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    cursor = await conn.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+    plan = (await cursor.fetchone())[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return list(_plan_nodes(plan[0]["Plan"]))
+
+
+def _posts_indexes(nodes):
+    # Bitmap index scans name no relation, their heap scan above does
+    used = set()
+    for node in nodes:
+        if node.get("Relation Name") != "posts":
+            continue
+        if "Index Name" in node:
+            used.add(node["Index Name"])
+        if node["Node Type"] == "Bitmap Heap Scan":
+            used |= {n["Index Name"] for n in _plan_nodes(node) if "Index Name" in n}
+    return used
+
+
+def _posts_seq_scans(nodes):
+    return [
+        node
+        for node in nodes
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") == "posts"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_posts_filter_indexes():
+    engine = await init_database(
+        host=config.db_host,
+        port=config.db_port,
+        user=config.db_user,
+        password=config.db_password,
+        database=config.db_name,
+    )
+
+    async with engine.acquire() as conn:
+
+        async def _clear():
+            await conn.execute(delete(Post).where(Post.title.like("IndexPet%")))
+            await conn.execute(delete(Location).where(Location.name.like("IndexCity%")))
+            await conn.execute(delete(PetType).where(PetType.name.like("IndexType%")))
+
+        await _clear()
+        try:
+            location_ids = []
+            pet_type_ids = []
+            for n in range(10):
+                await conn.execute(
+                    insert(Location).values({Location.name: f"IndexCity{n}"})
+                )
+                cursor = await conn.execute(
+                    select([Location.id]).where(Location.name == f"IndexCity{n}")
+                )
+                location_ids.append((await cursor.fetchone()).id)
+
+                await conn.execute(
+                    insert(PetType).values({PetType.name: f"IndexType{n}"})
+                )
+                cursor = await conn.execute(
+                    select([PetType.id]).where(PetType.name == f"IndexType{n}")
+                )
+                pet_type_ids.append((await cursor.fetchone()).id)
+
+            # Most of the posts are archived, each category is a small slice of it
+            batch = []
+            for n in range(POSTS_COUNT):
+                category = CATEGORIES[n % 4]
+                batch.append(
+                    {
+                        "title": f"IndexPet{n}",
+                        "location_id": location_ids[n % 10],
+                        "pet_type_id": pet_type_ids[(n // 10) % 10],
+                        "visible": n % 2 == 0,
+                        "need_home": "text",
+                        "need_home_visible": category == "need_home" and n % 10 == 0,
+                        "need_temp": "text" if category == "need_temp" else "",
+                        "need_temp_visible": n % 3 == 0,
+                        "need_money": "text" if category == "need_money" else None,
+                        "need_money_visible": n % 25 == 0,
+                        "need_other": "text" if n % 50 == 0 else "",
+                        "need_other_visible": True,
+                    }
+                )
+                if len(batch) == 1000:
+                    await conn.execute(insert(Post).values(batch))
+                    batch = []
+
+            await conn.execute("ANALYZE posts")
+
+            cursor = await conn.execute(
+                select([sa.func.max(Post.id)]).where(Post.title.like("IndexPet%"))
+            )
+            last_id = (await cursor.fetchone())[0]
+            middle_id = last_id - POSTS_COUNT // 2
+
+            for category in CATEGORIES:
+                for filters in (
+                    {},
+                    {"pet_type": pet_type_ids[3]},
+                    {"location": location_ids[5]},
+                    {"post_id": middle_id, "direction": ">"},
+                    {"post_id": middle_id, "direction": "<"},
+                    {
+                        "location": location_ids[5],
+                        "post_id": middle_id,
+                        "direction": "<",
+                    },
+                ):
+                    nodes = await _explain(
+                        conn, _posts_with_filters_query(category, **filters)
+                    )
+                    used = _posts_indexes(nodes)
+
+                    assert not _posts_seq_scans(nodes), (category, filters)
+                    assert any(i.startswith(f"ix_posts_{category}_") for i in used), (
+                        category,
+                        filters,
+                        used,
+                    )
+        finally:
+            await _clear()
+            # Stats of the seeded rows would skew plans of later tests
+            await conn.execute("ANALYZE posts")
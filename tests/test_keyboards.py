@@ -0,0 +1,34 @@
+import json
+
+from aiogram import types
+
+from src.tg.keyboards import KeyboardRegistry
+
+
+def test_keyboard_registry():
+    keyboards = KeyboardRegistry()
+    texts = {"back": "Back"}
+    builds = []
+
+    @keyboards.cached
+    def back_kb(resize):
+        builds.append(resize)
+        kb = types.reply_keyboard.ReplyKeyboardMarkup(resize_keyboard=resize)
+        kb.row(types.reply_keyboard.KeyboardButton(text=texts["back"]))
+        return kb
+
+    kb = back_kb(True)
+    assert json.loads(kb) == {
+        "keyboard": [[{"text": "Back"}]],
+        "resize_keyboard": True,
+    }
+    assert back_kb(True) is kb
+    back_kb(False)
+    assert builds == [True, False]
+
+    texts["back"] = "Go back"
+    assert back_kb(True) is kb
+
+    keyboards.invalidate()
+    assert json.loads(back_kb(True))["keyboard"] == [[{"text": "Go back"}]]
+    assert builds == [True, False, True]
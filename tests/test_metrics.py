@@ -0,0 +1,75 @@
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Dispatcher, types
+
+from src.metrics import Counter, Histogram, Registry, make_metrics_app
+from src.tg.bot_api import ApiUrlBot
+from src.tg.metrics import MetricsMiddleware, handler_duration
+
+TOKEN = "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    registry = Registry()
+    counter = Counter("test_total", "Test counter", labels=("kind",), registry=registry)
+    histogram = Histogram(
+        "test_seconds", "Test histogram", buckets=(0.1, 1), registry=registry
+    )
+
+    counter.inc('a"b')
+    counter.inc('a"b', value=2)
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+
+    client = TestClient(TestServer(make_metrics_app(registry)))
+    await client.start_server()
+    resp = await client.get("/metrics")
+    assert resp.status == 200
+    assert (await resp.text()).splitlines() == [
+        "# HELP test_total Test counter",
+        "# TYPE test_total counter",
+        'test_total{kind="a\\"b"} 3',
+        "# HELP test_seconds Test histogram",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 3.65",
+        "test_seconds_count 4",
+    ]
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_metrics_middleware():
+    bot = ApiUrlBot(TOKEN, api_url="http://localhost")
+    dp = Dispatcher(bot)
+    dp.middleware.setup(MetricsMiddleware())
+
+    @dp.message_handler(commands=["fail"])
+    async def failing_handler(message: types.Message):
+        raise ValueError
+
+    @dp.message_handler()
+    async def echo_handler(message: types.Message):
+        pass
+
+    def _update(update_id, text):
+        return types.Update(
+            update_id=update_id,
+            message={
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": 42, "type": "private"},
+                "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+                "text": text,
+            },
+        )
+
+    await dp.process_updates([_update(1, "hi"), _update(2, "hello")])
+    with pytest.raises(ValueError):
+        await dp.process_update(_update(3, "/fail"))
+
+    assert handler_duration.count("echo_handler", "", "ok") == 2
+    assert handler_duration.count("failing_handler", "", "error") == 1
@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter, MessageNotModified
+
+from src.tg.outbox import Outbox, outbox_coalesced, outbox_pending
+
+
+class RecordingBot:
+    def __init__(self):
+        self.calls = []
+        self.flood_once = True
+
+    async def request(self, method, chat_id, value):
+        if self.flood_once and method == "flood":
+            self.flood_once = False
+            raise RetryAfter(1)
+        await asyncio.sleep(0.01)
+        self.calls.append((method, chat_id, value, time.monotonic()))
+        return value
+
+
+@pytest.mark.asyncio
+async def test_outbox_order_and_limits():
+    bot = RecordingBot()
+    outbox = Outbox(rate=100, chat_interval=0.2, chat_burst=2, workers=4)
+
+    sends = [
+        outbox.send(chat_id, lambda c=chat_id, i=i: bot.request("send", c, i))
+        for i in range(4)
+        for chat_id in (1, 2)
+    ]
+    deletes = [outbox.delete(1, lambda: bot.request("delete", 1, "d"))]
+    tasks = [asyncio.ensure_future(c) for c in sends + deletes]
+    await asyncio.sleep(0)
+    assert len(outbox) == 9
+    assert outbox_pending.callback() == 9
+
+    outbox.start()
+    assert await asyncio.gather(*tasks) == [i for i in range(4) for _ in (1, 2)] + ["d"]
+    await outbox.close()
+
+    for chat_id in (1, 2):
+        calls = [c for c in bot.calls if c[1] == chat_id]
+        assert [c[2] for c in calls if c[0] == "send"] == [0, 1, 2, 3]
+        # Two at once, then one per interval
+        times = [c[3] for c in calls]
+        assert times[3] - times[0] >= 0.4 - 0.05
+    assert bot.calls[-1][0] == "delete"
+    assert len(outbox) == 0
+
+
+@pytest.mark.asyncio
+async def test_outbox_coalesces_edits():
+    bot = RecordingBot()
+    outbox = Outbox(rate=100, chat_interval=0, workers=1)
+    coalesced = outbox_coalesced.value()
+
+    tasks = [
+        asyncio.ensure_future(outbox.edit(1, 10, lambda i=i: bot.request("edit", 1, i)))
+        for i in range(5)
+    ]
+    tasks.append(
+        asyncio.ensure_future(outbox.edit(1, 11, lambda: bot.request("edit", 1, 11)))
+    )
+    await asyncio.sleep(0)
+    outbox.start()
+
+    # Every caller gets the result of the edit which was sent
+    assert await asyncio.gather(*tasks) == [4, 4, 4, 4, 4, 11]
+    assert [c[2] for c in bot.calls] == [4, 11]
+    assert outbox_coalesced.value() - coalesced == 4
+    await outbox.close()
+
+    # A markup edit doesn't replace a queued text edit
+    bot.calls = []
+    outbox = Outbox(rate=100, chat_interval=0, workers=1)
+    tasks = [
+        asyncio.ensure_future(
+            outbox.edit(1, 10, lambda: bot.request("edit", 1, "text"), "text")
+        ),
+        asyncio.ensure_future(
+            outbox.edit(1, 10, lambda: bot.request("edit", 1, "markup"), "markup")
+        ),
+    ]
+    await asyncio.sleep(0)
+    outbox.start()
+    assert await asyncio.gather(*tasks) == ["text", "markup"]
+    assert [c[2] for c in bot.calls] == ["text", "markup"]
+    await outbox.close()
+
+
+@pytest.mark.asyncio
+async def test_outbox_retry_after_and_errors():
+    bot = RecordingBot()
+    outbox = Outbox(rate=100, chat_interval=0, workers=2)
+    outbox.start()
+
+    async def _failing():
+        raise MessageNotModified("Message is not modified")
+
+    started = time.monotonic()
+    results = await asyncio.gather(
+        outbox.send(1, lambda: bot.request("flood", 1, "a")),
+        outbox.send(2, lambda: bot.request("send", 2, "b")),
+        outbox.send(1, _failing),
+        return_exceptions=True,
+    )
+    assert results[:2] == ["a", "b"]
+    assert isinstance(results[2], MessageNotModified)
+    # The flood request is repeated after the pause
+    assert time.monotonic() - started >= 1
+    await outbox.close()
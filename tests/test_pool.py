@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from src.config import Config
+from src.db.pool import (
+    InstrumentedEngine,
+    pool_acquire_duration,
+    pool_in_use,
+    pool_waiters,
+)
+from src.db.queries import init_database
+from src.db.query_log import QueryCancelled, execute
+
+config = Config()
+config.with_env()
+
+
+@pytest.mark.asyncio
+async def test_instrumented_pool():
+    engine = InstrumentedEngine(
+        await init_database(
+            host=config.db_host,
+            port=config.db_port,
+            user=config.db_user,
+            password=config.db_password,
+            database=config.db_name,
+            minsize=2,
+            maxsize=2,
+            statement_timeout=200,
+        )
+    )
+    await engine.warm_up()
+    assert engine.size == engine.freesize == 2
+
+    async with engine.acquire() as conn:
+        cursor = await conn.execute("SHOW statement_timeout")
+        assert (await cursor.fetchone())[0] == "200ms"
+        with pytest.raises(QueryCancelled):
+            await execute(conn, "SELECT pg_sleep(1)")
+        # The connection is still usable
+        cursor = await conn.execute("SELECT 1")
+        assert (await cursor.fetchone())[0] == 1
+
+    acquired = pool_acquire_duration.count()
+    first = await engine.acquire()
+    second = await engine.acquire()
+    assert pool_in_use.callback() == 2
+
+    waiting = asyncio.ensure_future(engine.acquire())
+    await asyncio.sleep(0.05)
+    assert pool_waiters.callback() == 1
+
+    await first.close()
+    third = await waiting
+    assert pool_waiters.callback() == 0
+    assert pool_acquire_duration.count() - acquired == 3
+
+    await second.close()
+    await third.close()
+    engine.close()
+    await engine.wait_closed()
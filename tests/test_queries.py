@@ -250,3 +250,165 @@ async def test_post():
         assert len(new_post) == 0
 
         await _clear()
+
+
+@pytest.mark.asyncio
+async def test_pet_types_posts_count():
+    engine = await init_database(
+        host=config.db_host,
+        port=config.db_port,
+        user=config.db_user,
+        password=config.db_password,
+        database=config.db_name,
+    )
+
+    async with engine.acquire() as conn:
+
+        async def _clear():
+            await conn.execute(delete(Post).where(Post.title.like("CountPet%")))
+            await conn.execute(delete(Location).where(Location.name == "CountCity"))
+            await conn.execute(delete(PetType).where(PetType.name.like("CountType%")))
+
+        await _clear()
+
+        await conn.execute(insert(Location).values({Location.name: "CountCity"}))
+        cursor = await conn.execute(
+            select([Location.id]).where(Location.name == "CountCity")
+        )
+        location_id = (await cursor.fetchone()).id
+
+        pet_type_ids = []
+        for name in ("CountType1", "CountType2", "CountType3"):
+            await conn.execute(insert(PetType).values({PetType.name: name}))
+            cursor = await conn.execute(
+                select([PetType.id]).where(PetType.name == name)
+            )
+            pet_type_ids.append((await cursor.fetchone()).id)
+
+        for n, (pet_type_id, category, visible) in enumerate(
+            (
+                (pet_type_ids[0], "need_home", True),
+                (pet_type_ids[0], "need_home", True),
+                (pet_type_ids[0], "need_money", True),
+                (pet_type_ids[1], "need_temp", True),
+                (pet_type_ids[1], "need_other", False),
+                (pet_type_ids[2], "need_home", False),
+            )
+        ):
+            await conn.execute(
+                insert(Post).values(
+                    {
+                        Post.title: f"CountPet{n}",
+                        Post.location_id: location_id,
+                        Post.pet_type_id: pet_type_id,
+                        Post.visible: visible,
+                        getattr(Post, category): "text",
+                        getattr(Post, f"{category}_visible"): True,
+                    }
+                )
+            )
+
+        counts = await select_pet_types_posts_count(conn)
+
+        assert pet_type_ids[2] not in counts
+        for pet_type_id in pet_type_ids[:2]:
+            cursor = await select_posts_with_filters(conn, pet_type=pet_type_id)
+            assert counts[pet_type_id].posts == cursor.rowcount
+            for category in CATEGORIES:
+                cursor = await select_posts_with_filters(
+                    conn, category=category, pet_type=pet_type_id
+                )
+                assert counts[pet_type_id][category] == cursor.rowcount
+
+        assert counts[pet_type_ids[0]].need_home == 2
+        assert counts[pet_type_ids[1]].need_other == 0
+
+        await _clear()
+
+
+@pytest.mark.asyncio
+async def test_search_posts():
+    engine = await init_database(
+        host=config.db_host,
+        port=config.db_port,
+        user=config.db_user,
+        password=config.db_password,
+        database=config.db_name,
+    )
+
+    async with engine.acquire() as conn:
+
+        async def _clear():
+            await conn.execute(delete(Post).where(Post.title.like("SearchPet%")))
+            await conn.execute(delete(Location).where(Location.name == "SearchCity"))
+            await conn.execute(delete(PetType).where(PetType.name == "SearchType"))
+
+        await _clear()
+
+        await conn.execute(insert(Location).values({Location.name: "SearchCity"}))
+        cursor = await conn.execute(
+            select([Location.id]).where(Location.name == "SearchCity")
+        )
+        location_id = (await cursor.fetchone()).id
+        await conn.execute(insert(PetType).values({PetType.name: "SearchType"}))
+        cursor = await conn.execute(
+            select([PetType.id]).where(PetType.name == "SearchType")
+        )
+        pet_type_id = (await cursor.fetchone()).id
+
+        # ASCII words, the russian configuration stems them as English
+        for n, (visible, category, text, text_visible) in enumerate(
+            (
+                (True, "need_home", "Playful ginger kitten looking for a home", True),
+                (True, "need_money", "Ginger dog needs surgery", True),
+                (True, "need_temp", "Ginger kittens", False),
+                (False, "need_home", "Ginger kitten", True),
+            )
+        ):
+            await conn.execute(
+                insert(Post).values(
+                    {
+                        Post.title: f"SearchPet{n}",
+                        Post.location_id: location_id,
+                        Post.pet_type_id: pet_type_id,
+                        Post.visible: visible,
+                        getattr(Post, category): text,
+                        getattr(Post, f"{category}_visible"): text_visible,
+                    }
+                )
+            )
+
+        async def _titles(text, **kwargs):
+            page = await search_posts(conn, text, **kwargs)
+            return [post.title for post in page.posts], page.has_prev, page.has_next
+
+        # Hidden texts and posts are not searched
+        assert await _titles("kittens") == (["SearchPet0"], False, False)
+        assert await _titles("SearchPet1") == (["SearchPet1"], False, False)
+        # Equal ranks, newer first
+        assert await _titles("ginger") == (["SearchPet1", "SearchPet0"], False, False)
+        assert await _titles("ginger", limit=1) == (["SearchPet1"], False, True)
+        assert await _titles("ginger", offset=1, limit=1) == (
+            ["SearchPet0"],
+            True,
+            False,
+        )
+        assert await _titles("ginger cat") == ([], False, False)
+        assert not (await search_posts(conn, "ginger")).truncated
+
+        # Only the newest matches are ranked and the page says so
+        page = await search_posts(conn, "ginger", candidates=1)
+        assert [post.title for post in page.posts] == ["SearchPet1"]
+        assert page.truncated and not page.has_next
+        page = await search_posts(conn, "ginger", offset=1, candidates=1)
+        assert not page.posts and not page.truncated
+
+        # The vector follows changes of the texts
+        await conn.execute(
+            update(Post)
+            .where(Post.title == "SearchPet1")
+            .values({Post.need_money_visible: False})
+        )
+        assert await _titles("surgery") == ([], False, False)
+
+        await _clear()
@@ -0,0 +1,75 @@
+import logging
+
+import pytest
+
+from src.config import Config
+from src.db.queries import *
+from src.db.query_log import QueryLog, fingerprint, query_log
+
+config = Config()
+config.with_env()
+
+
+def test_fingerprint():
+    assert (
+        fingerprint(
+            b"SELECT * FROM posts WHERE id IN (1, 2, 3) AND title = 'it''s'\n  LIMIT 10"
+        )
+        == "SELECT * FROM posts WHERE id IN (...) AND title = ? LIMIT ?"
+    )
+    assert (
+        fingerprint(
+            "INSERT INTO t (a, b) VALUES (1, 'x'), (2, 'y') ON CONFLICT (id) DO NOTHING"
+        )
+        == "INSERT INTO t (a, b) VALUES (...) ON CONFLICT (id) DO NOTHING"
+    )
+    assert fingerprint("SELECT posts_1.id FROM posts AS posts_1") == (
+        "SELECT posts_1.id FROM posts AS posts_1"
+    )
+
+
+def test_query_log_top(caplog):
+    log = QueryLog(threshold=0.1, window=600)
+    log.record("SELECT 1 FROM a WHERE id = 1", 0.01, 1)
+    log.record("SELECT 1 FROM a WHERE id = 2", 0.03, 1)
+    log.record("SELECT 1 FROM b", 0.02, 5)
+    with caplog.at_level(logging.WARNING, logger="QueryLog"):
+        log.record("UPDATE c SET x = 1", 0.2, 3)
+
+    assert "UPDATE c SET x = 1" in caplog.text
+    assert "SELECT" not in caplog.text
+
+    top = log.top(2)
+    assert [i[0] for i in top] == ["UPDATE c SET x = ?", "SELECT ? FROM a WHERE id = ?"]
+    fp, calls, total, max_duration, rows, slowest = top[1]
+    assert (calls, rows, max_duration) == (2, 2, 0.03)
+    assert slowest == "SELECT 1 FROM a WHERE id = 2"
+    assert log.top(1, by="calls")[0][0] == "SELECT ? FROM a WHERE id = ?"
+
+    # Previous window is still counted, older ones are dropped
+    log._rotate(log._window_started + 600)
+    log.record("SELECT 1 FROM a WHERE id = 3", 0.05, 1)
+    assert log.top(1, by="calls")[0][1] == 3
+    log._rotate(log._window_started + 600)
+    assert [i[0] for i in log.top()] == ["SELECT ? FROM a WHERE id = ?"]
+
+
+@pytest.mark.asyncio
+async def test_query_log_queries():
+    engine = await init_database(
+        host=config.db_host,
+        port=config.db_port,
+        user=config.db_user,
+        password=config.db_password,
+        database=config.db_name,
+    )
+    query_log.reset()
+
+    async with engine.acquire() as conn:
+        await select_post_page(conn, category="need_home", pet_type=1, post_id=10)
+        await select_post_page(conn, category="need_home", pet_type=2, post_id=20)
+
+    fingerprints = [i[0] for i in query_log.top(100) if i[1] == 2]
+    assert len(fingerprints) == 1
+    assert "FROM posts" in fingerprints[0]
+    assert "pet_type.id = ?" in fingerprints[0]
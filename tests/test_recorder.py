@@ -0,0 +1,45 @@
+import pytest
+from aiogram import Dispatcher, types
+
+from src.tg.bot_api import ApiUrlBot
+from src.tg.recorder import UpdateRecorder, read_updates
+
+TOKEN = "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+
+
+@pytest.mark.asyncio
+async def test_update_recorder(tmp_path):
+    path = tmp_path / "updates.jsonl"
+    bot = ApiUrlBot(TOKEN, api_url="http://localhost")
+    dp = Dispatcher(bot)
+    recorder = UpdateRecorder(path)
+    dp.middleware.setup(recorder)
+
+    updates = [
+        types.Update(
+            update_id=1,
+            message={
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": 42, "type": "private"},
+                "from": {"id": 42, "is_bot": False, "first_name": "Тест"},
+                "text": "/start",
+            },
+        ),
+        types.Update(
+            update_id=2,
+            callback_query={
+                "id": "2",
+                "chat_instance": "42",
+                "from": {"id": 42, "is_bot": False, "first_name": "Тест"},
+                "data": "<,need_home,1,1,15",
+            },
+        ),
+    ]
+    await dp.process_updates(updates)
+    recorder.close()
+
+    recorded = list(read_updates(path))
+    assert [u.to_python() for _, u in recorded] == [u.to_python() for u in updates]
+    assert recorded[0][0] <= recorded[1][0]
+    assert recorded[1][1].callback_query.data == "<,need_home,1,1,15"
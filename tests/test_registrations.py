@@ -0,0 +1,76 @@
+import pytest
+
+from src.config import Config
+from src.db.queries import *
+from src.db.registrations import RegistrationQueue
+
+config = Config()
+config.with_env()
+
+FIRST_USER_ID = 2100000000
+
+
+@pytest.mark.asyncio
+async def test_registration_queue():
+    engine = await init_database(
+        host=config.db_host,
+        port=config.db_port,
+        user=config.db_user,
+        password=config.db_password,
+        database=config.db_name,
+    )
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + 25))
+
+    async with engine.acquire() as conn:
+
+        async def _clear():
+            await conn.execute(
+                delete(TelegramUser).where(TelegramUser.id >= FIRST_USER_ID)
+            )
+
+        async def _users():
+            cursor = await conn.execute(
+                select([TelegramUser])
+                .where(TelegramUser.id >= FIRST_USER_ID)
+                .order_by(TelegramUser.id)
+            )
+            return await cursor.fetchall()
+
+        await _clear()
+        await conn.execute(
+            insert(TelegramUser).values(
+                {
+                    "id": user_ids[0],
+                    "first_name": "Old",
+                    "funny_photos_subscribed": True,
+                }
+            )
+        )
+
+        queue = RegistrationQueue(
+            engine, max_size=10, batch_size=4, flush_interval=0.01
+        )
+        queue.start()
+
+        # Bounded: more users than max_size are accepted while run() flushes
+        for user_id in user_ids:
+            await queue.add({"id": user_id, "first_name": "New", "is_bot": False})
+        await queue.add({"id": user_ids[1], "first_name": "Renamed"})
+        await queue.close()
+        assert queue._task.done()
+
+        assert len(queue) == 0
+        users = await _users()
+        assert [i.id for i in users] == user_ids
+        assert users[0].first_name == "New"
+        assert users[0].funny_photos_subscribed
+        assert users[1].first_name == "Renamed"
+        assert users[2].registered_at is not None
+
+        # Users failing on close are retried and then reported, not lost silently
+        queue = RegistrationQueue(engine, flush_interval=0.01, close_retries=2)
+        await queue.add({"id": "not a number"})
+        await queue.close()
+        assert len(queue) == 1
+
+        await _clear()
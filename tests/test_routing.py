@@ -0,0 +1,48 @@
+from collections import namedtuple
+
+from src.tg.routing import ReplyRouter
+from src.tg.user_states import UserStates
+
+PetType = namedtuple("PetType", ["id", "emoji", "button_text"])
+
+
+def test_reply_router():
+    texts = {
+        "buttons": {
+            "back_to_prev": "Back",
+            "need_home": "Need home",
+            "help": "Help",
+            "about": "About",
+            "partners": "Partners",
+            "need_money": "Money",
+            "support_us": "Support",
+            "search": "Search",
+        }
+    }
+    router = ReplyRouter()
+    assert router.resolve(UserStates.start, "Help") == (None, None)
+
+    router.rebuild(texts, [PetType(1, "🐶", "Dogs"), PetType(2, "🐱", "Cats")])
+
+    assert router.back_to_prev == "Back"
+    assert router.resolve(UserStates.start, "Help") == ("help", None)
+    assert router.resolve(UserStates.start, "Search") == ("search", None)
+    assert router.resolve(UserStates.start, "Partners") == (None, None)
+    assert router.resolve(UserStates.about, "Partners") == ("partners", None)
+    assert router.resolve(UserStates.post_view, "Support") == ("support_us", None)
+    assert router.resolve(UserStates.post_view, "Money") == (
+        "category",
+        ("need_money", None),
+    )
+    assert router.resolve(UserStates.post_view, "🐱Cats") == (
+        "category",
+        ("need_home", 2),
+    )
+    assert router.resolve(UserStates.post_view, "Cats") == (None, None)
+    assert router.resolve(UserStates.filter, "Help") == (None, None)
+
+    texts["buttons"]["help"] = "Help us"
+    router.rebuild(texts, [])
+    assert router.resolve(UserStates.start, "Help") == (None, None)
+    assert router.resolve(UserStates.start, "Help us") == ("help", None)
+    assert router.resolve(UserStates.post_view, "🐱Cats") == (None, None)
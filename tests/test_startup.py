@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from aiogram import Dispatcher, types
+
+from src.config import Config
+from src.tg.metrics import time_to_first_response
+from src.tg.startup import StartupGateMiddleware
+from src.tg.zverobot import ZveroBot
+from tests.fake_bot_api import FakeBotApi
+
+config = Config()
+config.with_env()
+
+
+@pytest.mark.asyncio
+async def test_startup_gate():
+    api = FakeBotApi()
+    config.bot_api_url = await api.start()
+    config.notifications_enabled = False
+
+    bot = ZveroBot(config)
+    # Nothing is opened before startup
+    assert bot.db is None and api.calls == []
+
+    dp = Dispatcher(bot)
+    dp.middleware.setup(StartupGateMiddleware(bot))
+    handled = []
+
+    @dp.message_handler()
+    async def echo_handler(message: types.Message):
+        handled.append(bot.db is not None)
+
+    update = types.Update(
+        update_id=1,
+        message={
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+            "text": "hi",
+        },
+    )
+    processing = asyncio.ensure_future(dp.process_updates([update]))
+    await asyncio.sleep(0.1)
+    assert not processing.done() and handled == []
+
+    await bot.startup()
+    await processing
+    assert handled == [True]
+    assert "buttons" in bot.texts
+    assert time_to_first_response.value() > 0
+
+    # The hello message is sent in the background
+    for _ in range(50):
+        if api.calls_of("sendMessage"):
+            break
+        await asyncio.sleep(0.02)
+    assert api.calls_of("sendMessage")[0].params["text"] == "Started"
+
+    await bot.shutdown()
+    bot.db.close()
+    await bot.db.wait_closed()
+    await bot.close()
+    await api.close()
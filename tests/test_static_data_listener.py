@@ -0,0 +1,117 @@
+import asyncio
+import uuid
+
+import pytest
+from sqlalchemy import delete, insert, update
+
+from src.config import Config
+from src.db.listener import LISTENED_TABLES, static_data_notifications
+from src.db.models import BotText, FunnyPhoto, Location, TelegramUser, TextType
+from src.tg.zverobot import ZveroBot
+from tests.fake_bot_api import FakeBotApi
+
+config = Config()
+config.with_env()
+
+USER_ID = 668
+
+
+async def _wait_for(condition, timeout=2):
+    for _ in range(int(timeout / 0.02)):
+        if condition():
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError("Condition not met")
+
+
+@pytest.mark.asyncio
+async def test_static_data_listener():
+    api = FakeBotApi()
+    config.bot_api_url = await api.start()
+    config.notifications_enabled = False
+    config.static_data_debounce = 0.2
+    config.static_data_health_check_interval = 0.2
+
+    bot = ZveroBot(config)
+    reloads = []
+
+    async def _on_static_data_change(tables):
+        await ZveroBot.on_static_data_change(bot, tables)
+        reloads.append(tables)
+
+    bot.on_static_data_change = _on_static_data_change
+    await bot.startup()
+    await asyncio.wait_for(bot.static_data_listener.listening.wait(), 5)
+
+    notified = static_data_notifications.value("locations")
+    async with bot.db.acquire() as conn:
+        # Two transactions within the debounce window
+        await conn.execute(insert(Location).values(name="ListenerTown"))
+        await conn.execute(
+            insert(BotText).values(
+                name="listener_text", text_type=TextType.BUTTON, value="Listener"
+            )
+        )
+    await _wait_for(lambda: reloads)
+    await asyncio.sleep(0.3)
+
+    assert reloads == [{"locations", "bot_texts"}]
+    assert static_data_notifications.value("locations") - notified == 1
+    assert "ListenerTown" in [l.name for l in bot.locations]
+    assert bot.texts["buttons"]["listener_text"] == "Listener"
+
+    # Only the changed table is reloaded
+    texts = bot.texts
+    async with bot.db.acquire() as conn:
+        await conn.execute(delete(Location).where(Location.name == "ListenerTown"))
+    await _wait_for(lambda: len(reloads) == 2)
+    assert reloads[1] == {"locations"}
+    assert "ListenerTown" not in [l.name for l in bot.locations]
+    assert bot.texts is texts
+
+    # Approved photos follow the admin panel
+    async with bot.db.acquire() as conn:
+        await conn.execute(delete(BotText).where(BotText.name == "listener_text"))
+        await conn.execute(delete(FunnyPhoto).where(FunnyPhoto.upload_by_id == USER_ID))
+        await conn.execute(delete(TelegramUser).where(TelegramUser.id == USER_ID))
+        await conn.execute(insert(TelegramUser).values({"id": USER_ID}))
+    await _wait_for(lambda: len(reloads) == 3)
+
+    async with bot.db.acquire() as conn:
+        photo_id = await conn.scalar(
+            insert(FunnyPhoto)
+            .values(filename=uuid.uuid4(), upload_by_id=USER_ID, approved=True)
+            .returning(FunnyPhoto.id)
+        )
+    await _wait_for(lambda: photo_id in bot.funny_photo_pool)
+
+    async with bot.db.acquire() as conn:
+        await conn.execute(
+            update(FunnyPhoto)
+            .values({FunnyPhoto.approved: False})
+            .where(FunnyPhoto.id == photo_id)
+        )
+    await _wait_for(lambda: photo_id not in bot.funny_photo_pool)
+
+    async with bot.db.acquire() as conn:
+        await conn.execute(delete(FunnyPhoto).where(FunnyPhoto.upload_by_id == USER_ID))
+        await conn.execute(delete(TelegramUser).where(TelegramUser.id == USER_ID))
+
+    # A notifies queue not woken by a lost connection, see aiopg 1.0
+    assert await bot.static_data_listener._collect(asyncio.Queue()) is None
+
+    # Changes made while the connection is lost are picked up by a full reload
+    reloaded = len(reloads)
+    async with bot.db.acquire() as conn:
+        await conn.execute(
+            "SELECT pg_terminate_backend(%s)",
+            (bot.static_data_listener._conn.raw.get_backend_pid(),),
+        )
+    await _wait_for(lambda: set(LISTENED_TABLES) in reloads[reloaded:], timeout=5)
+
+    await bot.shutdown()
+    assert bot.static_data_listener._task.done()
+    bot.db.close()
+    await bot.db.wait_closed()
+    await bot.close()
+    await api.close()
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Dispatcher, types
+
+from src.tg.bot_api import ApiUrlBot
+from src.tg.webhook import SECRET_TOKEN_HEADER, make_webhook_app, set_webhook
+
+TOKEN = "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+SECRET = "s3cr3t"
+
+
+def _stub_telegram_api(calls):
+    async def method_handler(request: web.Request):
+        data = dict(await request.post())
+        calls.append((request.match_info["method"], data))
+        if request.match_info["method"] == "sendMessage":
+            result = {
+                "message_id": 2,
+                "date": 0,
+                "chat": {"id": int(data["chat_id"]), "type": "private"},
+                "text": data["text"],
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post(r"/bot{token}/{method}", method_handler)
+    return app
+
+
+def _update(update_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+@pytest.mark.asyncio
+async def test_webhook():
+    calls = []
+    telegram = TestServer(_stub_telegram_api(calls))
+    await telegram.start_server()
+
+    bot = ApiUrlBot(TOKEN, api_url=str(telegram.make_url("")))
+    dp = Dispatcher(bot)
+    handled = asyncio.Event()
+
+    @dp.message_handler()
+    async def echo(message: types.Message):
+        await asyncio.sleep(0.1)
+        await bot.send_message(message.chat.id, message.text)
+        handled.set()
+
+    client = TestClient(
+        TestServer(make_webhook_app(dp, "/webhook", SECRET, max_body_size=4096))
+    )
+    await client.start_server()
+
+    headers = {SECRET_TOKEN_HEADER: SECRET}
+
+    # Telegram is answered before the handler finishes
+    resp = await client.post("/webhook", json=_update(1, "hello"), headers=headers)
+    assert resp.status == 200
+    assert not handled.is_set()
+
+    await asyncio.wait_for(handled.wait(), 5)
+    assert calls == [("sendMessage", {"chat_id": "42", "text": "hello"})]
+
+    resp = await client.post("/webhook", json=_update(2, "hello"))
+    assert resp.status == 403
+    resp = await client.post(
+        "/webhook", json=_update(3, "hello"), headers={SECRET_TOKEN_HEADER: "wrong"}
+    )
+    assert resp.status == 403
+
+    resp = await client.post("/webhook", data="not json", headers=headers)
+    assert resp.status == 400
+
+    resp = await client.post("/webhook", json=_update(4, "x" * 10000), headers=headers)
+    assert resp.status == 413
+
+    assert len(calls) == 1
+
+    await set_webhook(bot, "https://example.com/webhook", secret_token=SECRET)
+    assert calls[-1] == (
+        "setWebhook",
+        {"url": "https://example.com/webhook", "secret_token": SECRET},
+    )
+
+    await client.close()
+    await bot.close()
+    await telegram.close()